@@ -1,49 +1,28 @@
 import streamlit as st
-import os
+import sys
+import json
 import logging
 from datetime import datetime
-import httpx
-
-def get_api_key(name: str) -> str:
-    return st.secrets.get(name) or os.getenv(name)
-
-# Только для локальной загрузки .env, и чтобы не мешало облаку
-if not st.secrets.get("OPENROUTER_API_KEY"):
-    try:
-        from dotenv import load_dotenv
-        load_dotenv()
-    except ImportError:
-        pass
-
-OPENROUTER_API_KEY = get_api_key("OPENROUTER_API_KEY")
-MODEL_NAME = "meta-llama/llama-3.2-90b-vision-instruct"
-OPENROUTER_URL = "https://openrouter.io/api/v1/chat/completions"
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler('medassistant.log'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
 
-# Далее ваш UI и функции...
+from modules.logging_config import setup_logging, logging_stats
+
+# Запись журнала (файл с ротацией, stderr) — в фоновом потоке; см. modules.logging_config
+setup_logging()
+logger = logging.getLogger(__name__)
 
 # Импортируем модули
-from modules.intent_detection import detect_intent
-from modules.ecg import process_ecg
-from modules.image import process_image
-from modules.image_analysis import analyze_image_with_openrouter
-from modules.lab import process_lab_analysis
-from modules.lab_analysis import analyze_lab_results
-from modules.ocr import extract_text_from_image
-
-# ============ КОНФИГ OPENROUTER ============
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY") or st.secrets.get("OPENROUTER_API_KEY")
-OPENROUTER_URL = "https://openrouter.io/api/v1/chat/completions"
-MODEL_NAME = "meta-llama/llama-3.2-90b-vision-instruct"
+# Тяжёлые зависимости модальностей (pandas, PIL, pytesseract, PyPDF2) загружаются
+# обработчиками modules.handlers при первом файле соответствующего типа
+from modules.config import get_settings
+from modules.pipeline import LocalFile, run_analysis_job
+from modules import http_client
+from modules.cache import get_response_cache
+from modules.handlers import handler_stats
+from modules.metrics import get_metrics
+from modules.prompts import cached_tokens, prompt_versions
+from modules.scheduler import get_scheduler
+from modules.jobs import get_job_queue, ACTIVE
+from modules.history import get_history
 
 # ============ STREAMLIT КОНФИГ ============
 st.set_page_config(
@@ -58,216 +37,349 @@ st.write("Мультимодальный медицинский ассистен
 
 # ============ ФУНКЦИИ ============
 
-def call_openrouter(prompt: str, system_prompt: str = None, max_tokens: int = 1400, temperature: float = 0.1) -> dict:
+@st.cache_resource
+def get_config():
     """
-    Отправляет запрос к OpenRouter API с обработкой ошибок.
+    Настройки подключения к LLM: secrets и .env читаются один раз на процесс.
     """
-    
-    if not OPENROUTER_API_KEY:
-        return {
-            "success": False,
-            "content": None,
-            "error": "OPENROUTER_API_KEY не установлен в .env или Streamlit secrets"
-        }
-    
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "HTTP-Referer": "https://medassistant-cld.local",
-        "X-Title": "MedAssistant",
-        "Content-Type": "application/json"
-    }
-    
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    
-    messages.append({"role": "user", "content": prompt})
-    
-    payload = {
-        "model": MODEL_NAME,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": max_tokens,
-        "top_p": 1.0
-    }
-    
-    try:
-        logger.info(f"Отправка запроса к OpenRouter. Модель: {MODEL_NAME}")
-        
-        with httpx.Client(timeout=60.0) as client:
-            response = client.post(OPENROUTER_URL, json=payload, headers=headers)
-        
-        if response.status_code == 200:
-            data = response.json()
-            content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            
-            logger.info("Успешный ответ от OpenRouter")
-            return {
-                "success": True,
-                "content": content,
-                "error": None,
-                "usage": data.get("usage", {})
-            }
-        
-        elif response.status_code == 401:
-            error_msg = "Ошибка аутентификации: неверный API ключ OpenRouter"
-            logger.error(error_msg)
-            return {"success": False, "content": None, "error": error_msg}
-        
-        elif response.status_code == 429:
-            error_msg = "Превышен лимит запросов (Rate Limit). Попробуйте позже."
-            logger.warning(error_msg)
-            return {"success": False, "content": None, "error": error_msg}
-        
-        elif response.status_code == 500:
-            error_msg = "Ошибка на сервере OpenRouter (500). Попробуйте позже."
-            logger.error(error_msg)
-            return {"success": False, "content": None, "error": error_msg}
-        
-        else:
-            error_msg = f"HTTP {response.status_code}: {response.text}"
-            logger.error(error_msg)
-            return {"success": False, "content": None, "error": error_msg}
-    
-    except httpx.TimeoutException:
-        error_msg = "Timeout: запрос занял слишком много времени"
-        logger.error(error_msg)
-        return {"success": False, "content": None, "error": error_msg}
-    
-    except Exception as e:
-        error_msg = f"Неожиданная ошибка: {str(e)}"
-        logger.error(error_msg, exc_info=True)
-        return {"success": False, "content": None, "error": error_msg}
+    return get_settings()
 
 
-def process_uploaded_file(uploaded_file, task_description: str) -> dict:
+@st.cache_resource
+def get_http_client():
     """
-    Обрабатывает загруженный файл в зависимости от типа.
+    Общий HTTP клиент с пулом соединений, живёт между перезапусками скрипта и сессиями.
     """
-    
-    try:
-        logger.info(f"Обработка файла: {uploaded_file.name}")
-        
-        intent = detect_intent(task_description, uploaded_file.name)
-        logger.info(f"Определен intent: {intent}")
-        
-        result = {
-            "intent": intent,
-            "analysis": None,
-            "raw_data": None,
-            "error": None
-        }
-        
-        if intent == "ecg":
-            if uploaded_file.name.endswith(('.csv', '.txt')):
-                ecg_data = process_ecg(uploaded_file)
-                result["raw_data"] = ecg_data
-                result["analysis"] = f"ЭКГ данные загружены. Количество отсчетов: {len(ecg_data)}"
-                logger.info("ЭКГ успешно обработана")
-            else:
-                result["error"] = "ECG должна быть в формате CSV или TXT"
-        
-        elif intent == "image":
-            if uploaded_file.name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-                image_analysis = process_image(uploaded_file)
-                result["raw_data"] = image_analysis
-                result["analysis"] = "Изображение загружено и проанализировано"
-                logger.info("Изображение успешно обработано")
-            else:
-                result["error"] = "Поддерживаемые форматы: PNG, JPG, JPEG, BMP"
-        
-        elif intent == "lab":
-            if uploaded_file.name.lower().endswith(('.csv', '.xlsx', '.xls')):
-                lab_data = process_lab_analysis(uploaded_file)
-                result["raw_data"] = lab_data
-                result["analysis"] = f"Лабораторные данные загружены. Параметров: {len(lab_data)}"
-                logger.info("Лабораторные анализы успешно обработаны")
-            else:
-                result["error"] = "Лабораторные анализы должны быть в формате CSV, XLSX или XLS"
-        
-        elif intent == "document":
-            if uploaded_file.name.lower().endswith(('.pdf', '.png', '.jpg', '.jpeg')):
-                extracted_text = extract_text_from_image(uploaded_file)
-                result["raw_data"] = extracted_text
-                result["analysis"] = f"Текст извлечен из документа. Длина текста: {len(extracted_text)} символов"
-                logger.info("Текст успешно извлечен из документа")
-            else:
-                result["error"] = "Поддерживаемые форматы документов: PDF, PNG, JPG"
-        
+    return http_client.get_client()
+
+
+@st.cache_resource
+def get_cache():
+    """
+    Кэш ответов LLM (память + SQLite), общий для всех сессий.
+    """
+    return get_response_cache()
+
+
+@st.cache_resource
+def get_jobs():
+    """
+    Очередь фоновых анализов, общая для всех сессий.
+    """
+    return get_job_queue()
+
+
+def render_file_result(file_result, name=None, use_cache=True):
+    prefix = f"{name}: " if name else ""
+    if file_result["error"]:
+        st.error(f"{prefix}Ошибка: {file_result['error']}")
+        return
+    st.success(f"{prefix}Файл обработан: {file_result['analysis']}")
+    with st.expander(f"Предварительный анализ {name or ''}".strip()):
+        st.write(f"Тип: {file_result['intent']}")
+        if file_result['raw_data']:
+            st.write(f"Данные: {json.dumps(file_result['raw_data'], ensure_ascii=False, indent=2, default=str)[:500]}")
+        if file_result.get("timings"):
+            st.write("Этапы, мс:", file_result["timings"])
+    if file_result["intent"] == "ecg" and file_result.get("file_hash"):
+        with st.expander(f"Кривая ЭКГ {name or ''}".strip(), expanded=True):
+            ecg_viewer(file_result["file_hash"])
+    if file_result["intent"] == "image" and file_result.get("file_hash"):
+        with st.expander(f"Снимок {name or ''}".strip(), expanded=True):
+            image_viewer(file_result["file_hash"], use_cache)
+
+
+@st.fragment
+def image_viewer(file_hash, use_cache=True):
+    """
+    Превью снимка, выбор области и окна яркости, анализ выбранной области в полном разрешении.
+    """
+    import numpy as np
+    from modules.image_store import get_image_store
+    from modules.image_analysis import analyze_image_region
+
+    record = get_image_store().get(file_hash)
+    if record is None:
+        st.caption("Снимок недоступен (вытеснен из хранилища)")
+        return
+    width, height = record.size
+    key = file_hash[:16]
+    caption = f"{width}×{height}, {record.meta['mode']}"
+    if not record.decoded:
+        # Пирамида строится только по запросу и в фоне: до этого — сохранённое превью
+        st.image(record.preview(512), caption=caption)
+        if record.decode_error and not record.decoding:
+            st.error(f"Не удалось декодировать снимок: {record.decode_error}")
+        if record.decoding or st.button("Открыть в полном разрешении", key=f"roi_open_{key}"):
+            record.decode_in_background()
+            image_decode_progress(file_hash)
+        return
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        st.image(record.preview(512), caption=caption)
+    with col2:
+        x = st.slider("Область по X, пикс.", 0, width, (0, width), key=f"roi_x_{key}")
+        y = st.slider("Область по Y, пикс.", 0, height, (0, height), key=f"roi_y_{key}")
+        window = None
+        levels = record.levels()
+        if levels[0].dtype != np.uint8:
+            # Окно яркости для 16-битных и float снимков; диапазон — по самому грубому уровню
+            coarse = np.asarray(levels[-1])
+            low, high = float(coarse.min()), float(coarse.max())
+            default = tuple(min(max(v, low), high) for v in record.meta["window"])
+            window = st.slider("Окно яркости", low, high, default, key=f"roi_window_{key}")
+    box = record.clip_box((x[0], y[0], x[1], y[1]))
+    st.image(record.region(box, max_edge=768, window=window), caption=f"Область {box}")
+    if st.button("Анализировать область", key=f"roi_analyze_{key}"):
+        with st.spinner("Анализ области..."):
+            st.session_state[f"roi_result_{key}"] = analyze_image_region(record, box, window, use_cache=use_cache)
+    result = st.session_state.get(f"roi_result_{key}")
+    if result:
+        if result.get("success"):
+            st.markdown(result["analysis"])
+            if result.get("cached"):
+                st.info("Анализ взят из кэша")
         else:
-            result["error"] = f"Неизвестный тип файла: {intent}"
-        
-        return result
-    
-    except Exception as e:
-        error_msg = f"Ошибка при обработке файла: {str(e)}"
-        logger.error(error_msg, exc_info=True)
-        return {
-            "intent": None,
-            "analysis": None,
-            "raw_data": None,
-            "error": error_msg
-        }
-
-
-def generate_medical_report(task_description: str, analysis_data: dict) -> dict:
+            st.error(f"Ошибка: {result.get('error')}")
+
+
+@st.fragment
+def ecg_viewer(file_hash):
     """
-    Генерирует медицинский отчет через OpenRouter API.
+    Просмотр кривой ЭКГ: окно и отведение меняются без перезапуска всей страницы.
     """
-    
-    context = f"""
-    Задача: {task_description}
-    Тип анализа: {analysis_data.get('intent', 'неизвестно')}
-    Предварительный анализ: {analysis_data.get('analysis', 'нет')}
+    import altair as alt
+    import pandas as pd
+    from modules.ecg_store import get_ecg_store
+    from modules.ecg_view import ecg_window, MINMAX, LTTB
+
+    record = get_ecg_store().get(file_hash)
+    if record is None or not record.lead_names:
+        st.caption("Сигнал ЭКГ недоступен (нет отведений или запись вытеснена из хранилища)")
+        return
+    duration = record.n_samples / record.fs
+    key = file_hash[:16]
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        lead = st.selectbox("Отведение", record.lead_names, key=f"ecg_lead_{key}")
+    with col2:
+        method = st.radio("Прореживание", [MINMAX, LTTB], horizontal=True, key=f"ecg_method_{key}",
+                          format_func=lambda m: "min/max" if m == MINMAX else "LTTB")
+    start_s, end_s = st.slider(
+        "Окно, с", 0.0, float(duration), (0.0, float(min(duration, 10.0))),
+        step=max(round(duration / 2000, 2), 0.01), key=f"ecg_window_{key}"
+    )
+    view = ecg_window(record, lead, start_s, end_s, method=method)
+
+    line = alt.Chart(pd.DataFrame({"t": view["t"], "y": view["y"]})).mark_line(strokeWidth=1).encode(
+        x=alt.X("t", title="Время, с", scale=alt.Scale(domain=[start_s, end_s])),
+        y=alt.Y("y", title=lead),
+    )
+    peaks = alt.Chart(pd.DataFrame({"t": view["peaks_t"], "y": view["peaks_y"]})).mark_point(
+        color="red", size=30).encode(x="t", y="y")
+    st.altair_chart(line + peaks, width="stretch")
+    level = "исходный сигнал" if view["level"] < 0 else f"уровень пирамиды {view['level']}"
+    st.caption(
+        f"{view['samples']} отсчётов → {view['points']} точек ({level}), R-пиков: {len(view['peaks_t'])}, "
+        f"{view['elapsed_ms']} мс"
+    )
+
+
+@st.fragment
+def history_viewer(patient_id):
     """
+    Динамика показателей пациента из локальной истории (без повторного разбора файлов).
+    """
+    import altair as alt
+    import pandas as pd
+    from modules.history import get_history
+
+    history = get_history()
+    codes = history.codes(patient_id)
+    if not codes:
+        st.caption("В истории пациента нет анализов и ЭКГ")
+        return
+    labels = {c["code"]: f"{c['name'] or c['code']} ({c['code']}), {c['unit'] or ''} — {c['count']} изм." for c in codes}
+    code = st.selectbox("Показатель", list(labels), format_func=labels.get, key=f"history_code_{patient_id}")
+    points = pd.DataFrame(history.trend(patient_id, code))
+    points["taken_on"] = pd.to_datetime(points["taken_on"])
+    chart = alt.Chart(points).mark_line(point=True).encode(
+        x=alt.X("taken_on", title="Дата"),
+        y=alt.Y("value", title=points["unit"].iloc[-1] or code, scale=alt.Scale(zero=False)),
+        tooltip=["taken_on", "value", "flag"],
+    )
+    st.altair_chart(chart, width="stretch")
+    st.caption(f"Исследований в истории: {len(history.studies(patient_id))}")
+
+
+@st.fragment(run_every=1.0)
+def image_decode_progress(file_hash):
+    """
+    Опрос фонового декодирования снимка; по готовности страница перерисовывается с просмотром областей.
+    """
+    from modules.image_store import get_image_store
+
+    record = get_image_store().get(file_hash)
+    if record is None or record.decoded:
+        st.rerun()
+    if record.decode_error:
+        st.error(f"Не удалось декодировать снимок: {record.decode_error}")
+        return
+    st.info("Снимок декодируется в полном разрешении…")
+
+
+def render_report(report_result):
+    st.subheader("Медицинский отчет")
+    if not report_result["success"]:
+        st.error(f"Ошибка: {report_result['error']}")
+        return
     
-    if analysis_data.get('raw_data'):
-        context += f"\nДанные: {json.dumps(analysis_data['raw_data'], ensure_ascii=False, indent=2)[:2000]}"
-    
-    system_prompt = """Ты — опытный врач-диагност и кардиолог с глубокими знаниями стандартов диагностики.
-    Твоя задача — провести качественный анализ медицинских данных, опираясь на современные стандарты медицины.
-    В ответе:
-    1. Описание находок
-    2. Предварительные выводы
-    3. Рекомендации по стандартам (ГОСТ, МКБ-10, ESC, ACC/AHA)
-    4. Необходимые дополнительные исследования
-    5. Рекомендации по лечению и наблюдению
-    Формат: структурированный отчет с понятными заголовками."""
-    
-    prompt = f"""На основе следующих медицинских данных подготовь детальный диагностический отчет:
+    st.markdown(report_result["content"])
+    st.success("Отчет готов!")
+    if report_result.get("cached"):
+        st.info("Отчет взят из кэша")
     
-    {context}
+    if report_result.get("timing"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Время до первого токена", f"{report_result['timing']['ttft_s']} с")
+        with col2:
+            st.metric("Скорость", f"{report_result['timing']['tokens_per_second']} ток/с")
+        with col3:
+            st.metric("Общее время", f"{report_result['timing']['latency_s']} с")
     
-    Проведи полный анализ с учетом клинических стандартов и рекомендаций."""
+    if report_result.get("usage"):
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Input Tokens", report_result["usage"].get("prompt_tokens", "N/A"))
+        with col2:
+            # Префикс промпта, прочитанный из кэша провайдера
+            st.metric("Cached Tokens", cached_tokens(report_result["usage"]))
+        with col3:
+            st.metric("Output Tokens", report_result["usage"].get("completion_tokens", "N/A"))
+        with col4:
+            st.metric("Total Tokens", report_result["usage"].get("total_tokens", "N/A"))
     
-    logger.info("Формирование запроса для генерации отчета")
+    if report_result.get("context"):
+        with st.expander("Контекст промпта"):
+            if report_result.get("prompt_version"):
+                st.caption(f"Шаблон: {report_result['prompt_version']}")
+            context = report_result["context"]
+            st.write(f"Использовано ~{context['used']} из {context['budget']} токенов за {context['elapsed_ms']} мс")
+            st.json({k: context[k] for k in ("sections", "dropped", "truncated")})
+    if report_result.get("timings"):
+        with st.expander("Этапы генерации, мс"):
+            st.json(report_result["timings"])
     
-    result = call_openrouter(
-        prompt=prompt,
-        system_prompt=system_prompt,
-        max_tokens=1400,
-        temperature=0.1
+    st.download_button(
+        label="Скачать отчет",
+        data=report_result["content"],
+        file_name=f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+        mime="text/plain"
     )
-    
-    return result
 
 
+def render_job(job, use_cache=True):
+    """
+    Результат завершённой задачи.
+    """
+    if job["status"] == "error":
+        st.error(f"Ошибка: {job['error']}")
+        return
+    result = job["result"]
+    names = job["meta"].get("files", [])
+    file_results = result.get("file_results") or [result["file_result"]]
+    for i, file_result in enumerate(file_results):
+        render_file_result(file_result, names[i] if len(file_results) > 1 and i < len(names) else None, use_cache)
+    if result["report"] is not None:
+        render_report(result["report"])
+        if not result["report"]["success"]:
+            logger.error("Report error: %s", result['report']['error'])
+    patient_id = job["meta"].get("patient")
+    if patient_id:
+        with st.expander(f"Динамика пациента {patient_id}"):
+            if result.get("history"):
+                st.caption("Передано в отчет:")
+                st.text("\n".join(result["history"]))
+            history_viewer(patient_id)
+
+
+@st.fragment(run_every=1.0)
+def job_progress(job_id):
+    """
+    Опрос статуса задачи раз в секунду; перезапускается только этот фрагмент.
+    """
+    job = get_jobs().get(job_id)
+    if job is None or job["status"] not in ACTIVE:
+        st.rerun()
+    stage = job["progress"] or "В очереди"
+    st.info(f"{stage}… ({job['wait_s'] if job['status'] == 'queued' else job['run_s']} с)")
+    if job["text"]:
+        st.subheader("Медицинский отчет")
+        st.markdown(job["text"])
+
+
+# Общие ресурсы создаются один раз на процесс и переживают перезапуски скрипта
+config = get_config()
+get_http_client()
+get_cache()
+get_jobs()
+
 # ============ STREAMLIT UI ============
 
 with st.sidebar:
     st.header("Параметры")
     
     st.subheader("Модель")
-    st.info(f"Модель: {MODEL_NAME}\n\nAPI: OpenRouter")
+    st.info(f"Модель: {config['model']}\n\nAPI: OpenRouter")
     
     st.subheader("Проверка конфигурации")
-    if OPENROUTER_API_KEY:
+    if config["api_key_loaded"]:
         st.success("API ключ загружен")
     else:
         st.error("API ключ не найден")
         st.write("Добавьте в .env:")
         st.code("OPENROUTER_API_KEY=sk_...")
     
+    with st.expander("HTTP пул соединений"):
+        st.json(http_client.pool_stats())
+    with st.expander("Очередь запросов к LLM"):
+        st.json(get_scheduler().stats())
+    with st.expander("Фоновые задачи"):
+        st.json(get_jobs().stats())
+        for job_id in reversed(st.session_state.get("jobs", [])):
+            job = get_jobs().get(job_id)
+            if job and st.button(f"{', '.join(job['meta'].get('files', []))}: {job['status']}", key=f"job_{job_id}"):
+                st.query_params["job"] = job_id
+    
+    st.subheader("Кэш ответов")
+    use_cache = st.checkbox("Использовать кэш", value=True, help="Отключите, чтобы принудительно запросить новый ответ")
+    with st.expander("Статистика кэша"):
+        st.json(get_cache().stats())
+    with st.expander("Кэш OCR"):
+        # Статистика есть, только если OCR уже загружался в этом процессе
+        ocr_engine = sys.modules.get("modules.ocr_engine")
+        if ocr_engine:
+            st.json(ocr_engine.ocr_cache_stats())
+        else:
+            st.caption("OCR ещё не использовался")
+    with st.expander("Обработчики модальностей"):
+        st.json(handler_stats())
+    with st.expander("Метрики этапов (p50/p95)"):
+        metrics = get_metrics()
+        st.json(metrics.summary())
+        st.download_button("Экспорт Prometheus", data=metrics.prometheus_text(),
+                           file_name="medassistant.prom", mime="text/plain")
+    with st.expander("Журнал"):
+        st.json(logging_stats())
+    with st.expander("Версии промптов"):
+        st.json(prompt_versions())
+    with st.expander("История пациентов"):
+        st.json(get_history().stats())
+    
+    st.subheader("Вывод")
+    stream_output = st.checkbox("Потоковый вывод отчета", value=True, help="Показывать текст по мере генерации")
+    
     st.divider()
     
     st.subheader("О приложении")
@@ -291,12 +403,22 @@ with col1:
         placeholder="Пример: боль в груди, одышка...",
         height=100
     )
+    col_patient, col_date = st.columns([1, 1])
+    with col_patient:
+        patient_id = st.text_input(
+            "ID пациента", help="Необязательно: результаты сохраняются в историю пациента, "
+                                "в отчет добавляется динамика по прошлым исследованиям"
+        ).strip()
+    with col_date:
+        taken_on = st.date_input("Дата исследования", value="today", format="DD.MM.YYYY")
 
 with col2:
-    uploaded_file = st.file_uploader(
-        "Загрузите файл",
+    uploaded_files = st.file_uploader(
+        "Загрузите файлы",
         type=["csv", "txt", "png", "jpg", "jpeg", "bmp", "xlsx", "xls", "pdf"],
-        help="Поддерживаемые форматы: CSV, TXT, PNG, JPG, XLSX, XLS, PDF"
+        accept_multiple_files=True,
+        help="Поддерживаемые форматы: CSV, TXT, PNG, JPG, XLSX, XLS, PDF. "
+             "Несколько файлов одного пациента (ЭКГ, анализы, выписка) анализируются в одном отчете"
     )
 
 st.write("---")
@@ -305,51 +427,31 @@ if st.button("Провести анализ", type="primary", use_container_widt
     
     if not task_description:
         st.error("Опишите задачу")
-    elif not uploaded_file:
+    elif not uploaded_files:
         st.error("Загрузите файл")
     else:
-        
-        with st.spinner("Обработка файла..."):
-            file_result = process_uploaded_file(uploaded_file, task_description)
-            
-            if file_result["error"]:
-                st.error(f"Ошибка: {file_result['error']}")
-            else:
-                st.success(f"Файл обработан: {file_result['analysis']}")
-                
-                with st.expander("Предварительный анализ"):
-                    st.write(f"Тип: {file_result['intent']}")
-                    if file_result['raw_data']:
-                        st.write(f"Данные: {json.dumps(file_result['raw_data'], ensure_ascii=False, indent=2)[:500]}")
-        
-        with st.spinner("Генерация отчета..."):
-            report_result = generate_medical_report(task_description, file_result)
-            
-            if report_result["success"]:
-                st.success("Отчет готов!")
-                
-                st.subheader("Медицинский отчет")
-                st.markdown(report_result["content"])
-                
-                if report_result.get("usage"):
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("Input Tokens", report_result["usage"].get("prompt_tokens", "N/A"))
-                    with col2:
-                        st.metric("Output Tokens", report_result["usage"].get("completion_tokens", "N/A"))
-                    with col3:
-                        st.metric("Total Tokens", report_result["usage"].get("total_tokens", "N/A"))
-                
-                st.download_button(
-                    label="Скачать отчет",
-                    data=report_result["content"],
-                    file_name=f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                    mime="text/plain"
-                )
-            
-            else:
-                st.error(f"Ошибка: {report_result['error']}")
-                logger.error(f"Report error: {report_result['error']}")
+        # Копия содержимого: UploadedFile не переживает перезапуск скрипта
+        files = [LocalFile(f.name, f.getvalue()) for f in uploaded_files]
+        job_id = get_jobs().submit(
+            run_analysis_job, task_description, files,
+            use_cache=use_cache, stream=stream_output,
+            patient_id=patient_id or None, taken_on=taken_on.isoformat(),
+            kind="analysis", meta={"files": [f.name for f in files], "task": task_description[:100],
+                                   "patient": patient_id or None}
+        )
+        st.session_state.setdefault("jobs", []).append(job_id)
+        # ID в адресе страницы: результат доступен после переподключения и по ссылке
+        st.query_params["job"] = job_id
+
+current_job = st.query_params.get("job")
+if current_job:
+    job = get_jobs().get(current_job)
+    if job is None:
+        st.warning("Задача не найдена (устарела или сервер перезапущен без хранилища задач)")
+    elif job["status"] in ACTIVE:
+        job_progress(current_job)
+    else:
+        render_job(job, use_cache)
 
 st.write("---")
 st.caption("MedAssistant CLD v1.0 | OpenRouter & Claude 3 Sonnet")
\ No newline at end of file
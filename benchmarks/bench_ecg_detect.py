@@ -0,0 +1,78 @@
+"""
+Сравнение векторизованного детектора R-пиков (modules.ecg_detect) с
+ecgdetectors.Detectors.pan_tompkins_detector на синтетических многочасовых записях.
+
+    python -m benchmarks.bench_ecg_detect --hours 0.5 1 4 --leads 12
+"""
+import time
+import argparse
+import numpy as np
+
+from benchmarks.synthetic import synthetic_ecg
+from modules.ecg_detect import detect_r_peaks
+
+
+def match_score(found: np.ndarray, truth: np.ndarray, fs: float, tolerance_s: float = 0.05):
+    """
+    Чувствительность и положительная предсказательная ценность с допуском ±50 мс.
+    """
+    if len(found) == 0 or len(truth) == 0:
+        return 0.0, 0.0
+    position = np.clip(np.searchsorted(found, truth), 1, len(found) - 1)
+    nearest = np.minimum(np.abs(found[position] - truth), np.abs(found[position - 1] - truth))
+    hits = int((nearest <= tolerance_s * fs).sum())
+    return hits / len(truth), hits / len(found)
+
+
+def run_engine(signals, truth, fs):
+    started = time.perf_counter()
+    *leads, consensus = detect_r_peaks(signals, fs, combined=True)
+    elapsed = time.perf_counter() - started
+    sensitivity, ppv = match_score(consensus, truth, fs)
+    return elapsed, sensitivity, ppv
+
+
+def run_reference(signals, truth, fs, leads):
+    from ecgdetectors import Detectors
+
+    detectors = Detectors(fs)
+    started = time.perf_counter()
+    results = [np.asarray(detectors.pan_tompkins_detector(signals[:, lead])) for lead in range(leads)]
+    elapsed = time.perf_counter() - started
+    sensitivity, ppv = match_score(np.sort(results[min(1, leads - 1)]), truth, fs)
+    return elapsed, sensitivity, ppv
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк детекции R-пиков")
+    parser.add_argument("--hours", type=float, nargs="+", default=[0.5, 1.0, 2.0])
+    parser.add_argument("--leads", type=int, default=12)
+    parser.add_argument("--fs", type=float, default=500)
+    parser.add_argument("--reference-leads", type=int, default=None,
+                        help="Сколько отведений прогонять через ecgdetectors (по умолчанию все)")
+    parser.add_argument("--skip-reference", action="store_true", help="Не запускать ecgdetectors")
+    args = parser.parse_args(argv)
+
+    reference_leads = args.reference_leads or args.leads
+    print(f"{'часы':>6} {'отсчётов':>12} {'детектор':<22} {'время, с':>9} {'Se':>6} {'PPV':>6}")
+    for hours in args.hours:
+        signals, truth = synthetic_ecg(hours * 3600, fs=args.fs, leads=args.leads, seed=int(hours * 10))
+        samples = signals.shape[0]
+
+        elapsed, se, ppv = run_engine(signals, truth, args.fs)
+        print(f"{hours:>6} {samples:>12} {'ecg_detect (' + str(args.leads) + ' отв.)':<22} {elapsed:>9.2f} {se:>6.3f} {ppv:>6.3f}")
+
+        if not args.skip_reference:
+            try:
+                ref_elapsed, se, ppv = run_reference(signals, truth, args.fs, reference_leads)
+            except ImportError:
+                print("ecgdetectors не установлен (pip install py-ecg-detectors), сравнение пропущено")
+                args.skip_reference = True
+                continue
+            label = f"pan_tompkins ({reference_leads} отв.)"
+            print(f"{hours:>6} {samples:>12} {label:<22} {ref_elapsed:>9.2f} {se:>6.3f} {ppv:>6.3f}"
+                  f"  x{ref_elapsed / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Время импорта модулей при запуске: каждый модуль импортируется в отдельном
+интерпретаторе с python -X importtime, берётся медиана из нескольких запусков.
+Показывает, какие тяжёлые библиотеки модуль подтягивает.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --repeat 5 modules.pipeline modules.ecg
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+# Что импортирует app.py до первого загруженного файла, и модальности по отдельности
+STARTUP_MODULES = [
+    "modules.config",
+    "modules.cache",
+    "modules.http_client",
+    "modules.scheduler",
+    "modules.jobs",
+    "modules.context_builder",
+    "modules.openrouter",
+    "modules.handlers",
+    "modules.pipeline",
+    "modules.batch",
+]
+MODALITY_MODULES = [
+    "modules.ecg",
+    "modules.ecg_analysis",
+    "modules.image",
+    "modules.lab",
+    "modules.lab_flags",
+    "modules.ocr",
+]
+HEAVY_MODULES = ["streamlit", "pandas", "numpy", "PIL", "pytesseract", "PyPDF2", "openpyxl", "httpx"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str) -> dict:
+    """
+    Накопленное время импорта (мс) для module и всех модулей верхнего уровня из его дерева.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def measure(module: str, repeat: int) -> dict:
+    runs = [import_times(module) for _ in range(repeat)]
+    total = statistics.median(run.get(module, 0.0) for run in runs)
+    heavy = {
+        name: statistics.median(run[name] for run in runs)
+        for name in HEAVY_MODULES if name in runs[0]
+    }
+    return {"module": module, "total_ms": total, "heavy": heavy}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк времени импорта при запуске")
+    parser.add_argument("modules", nargs="*", help="Модули (по умолчанию — стартовые и модальности)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    groups = [("модули", args.modules)] if args.modules else [
+        ("запуск приложения", STARTUP_MODULES),
+        ("модальности (при первом файле)", MODALITY_MODULES),
+    ]
+    for title, modules in groups:
+        print(f"\n{title}")
+        print(f"{'модуль':<26} {'импорт, мс':>11}  тяжёлые зависимости, мс")
+        for module in modules:
+            result = measure(module, args.repeat)
+            heavy = ", ".join(f"{name} {ms:.0f}" for name, ms in result["heavy"].items()) or "—"
+            print(f"{module:<26} {result['total_ms']:>11.1f}  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
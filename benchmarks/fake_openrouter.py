@@ -0,0 +1,250 @@
+"""
+Локальная замена OpenRouter chat completions для нагрузочных тестов без сети и затрат.
+
+Отвечает в схеме OpenRouter (choices/message, usage), умеет SSE-стриминг с
+комментариями keep-alive, ошибки 429 (с Retry-After) и 500 с заданной долей,
+задержку до первого токена из выбранного распределения и скорость генерации.
+
+    python -m benchmarks.fake_openrouter --port 8090 --latency lognormal:0.8,0.5 --rate-429 0.05
+    OPENROUTER_URL=http://127.0.0.1:8090/api/v1/chat/completions OPENROUTER_API_KEY=fake streamlit run app.py
+
+GET /stats — счётчики ответов по статусам.
+"""
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = "/api/v1/chat/completions"
+
+REPORT_WORDS = (
+    "Описание", "находок:", "ритм", "синусовый,", "ЧСС", "в", "пределах", "нормы.", "Показатели",
+    "крови", "с", "умеренными", "отклонениями.", "Рекомендовано", "наблюдение", "кардиолога,",
+    "контроль", "липидного", "профиля", "через", "6", "недель", "(ESC", "2021).",
+)
+
+
+def parse_distribution(spec: str):
+    """
+    Распределение задержки в секундах по строке:
+    fixed:0.5, uniform:0.2,1.0, lognormal:медиана,sigma, exp:среднее.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu, sigma = math.log(values[0]), values[1]
+        return lambda: random.lognormvariate(mu, sigma)
+    if kind == "exp":
+        return lambda: random.expovariate(1 / values[0])
+    raise ValueError(f"Неизвестное распределение: {spec}")
+
+
+class FakeConfig:
+    def __init__(self, latency: str = "lognormal:0.5,0.5", tokens_per_second: float = 80.0,
+                 completion_tokens: int = 300, rate_429: float = 0.0, rate_500: float = 0.0,
+                 retry_after: float = 1.0, model: str = "fake/medassistant"):
+        self.latency_spec = latency
+        self.latency = parse_distribution(latency)
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.retry_after = retry_after
+        self.model = model
+
+
+class FakeOpenRouterHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOpenRouter/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---------- ответы ----------
+
+    def _count(self, status: int):
+        with self.server.stats_lock:
+            self.server.stats[str(status)] = self.server.stats.get(str(status), 0) + 1
+
+    def _json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self._count(status)
+
+    def _error(self, status: int, message: str, headers: dict = None):
+        self._json(status, {"error": {"code": status, "message": message}}, headers)
+
+    def _chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _cached_prefix_tokens(self, messages: list) -> int:
+        """
+        Кэш префикса как у провайдера: первое сообщение (или первый блок первого
+        сообщения), уже встречавшееся раньше, считается прочитанным из кэша.
+        """
+        if not messages:
+            return 0
+        content = messages[0].get("content")
+        prefix = json.dumps(content[0] if isinstance(content, list) and content else content, ensure_ascii=False)
+        with self.server.stats_lock:
+            seen = prefix in self.server.prefixes
+            self.server.prefixes.add(prefix)
+        return len(prefix) // 4 if seen else 0
+
+    # ---------- маршруты ----------
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.server.stats_lock:
+                stats = dict(self.server.stats)
+            self._json(200, stats)
+        else:
+            self._error(404, "Not found")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if self.path.split("?")[0] != COMPLETIONS_PATH:
+            self._error(404, "Not found")
+            return
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._error(401, "No auth credentials found")
+            return
+        try:
+            request = json.loads(raw)
+        except ValueError:
+            self._error(400, "Invalid JSON")
+            return
+
+        config = self.server.config
+        roll = random.random()
+        if roll < config.rate_429:
+            self._error(429, "Rate limit exceeded", {"Retry-After": f"{config.retry_after:g}"})
+            return
+        if roll < config.rate_429 + config.rate_500:
+            time.sleep(config.latency() / 4)
+            self._error(500, "Internal Server Error")
+            return
+
+        messages = request.get("messages", [])
+        prompt_text = json.dumps(messages, ensure_ascii=False)
+        completion_tokens = min(config.completion_tokens, int(request.get("max_tokens") or config.completion_tokens))
+        usage = {
+            "prompt_tokens": max(len(prompt_text) // 4, 1),
+            "completion_tokens": completion_tokens,
+            "total_tokens": max(len(prompt_text) // 4, 1) + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": self._cached_prefix_tokens(messages)},
+        }
+        tokens = [REPORT_WORDS[i % len(REPORT_WORDS)] + " " for i in range(completion_tokens)]
+        base = {"id": f"gen-{uuid.uuid4().hex[:24]}", "created": int(time.time()),
+                "model": request.get("model") or config.model, "provider": "Fake"}
+        first_token = config.latency()
+
+        if not request.get("stream"):
+            time.sleep(first_token + completion_tokens / config.tokens_per_second)
+            self._json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # Пока модель «думает», OpenRouter шлёт комментарии keep-alive
+        deadline = time.monotonic() + first_token
+        while time.monotonic() < deadline:
+            self._chunk(": OPENROUTER PROCESSING\n\n")
+            time.sleep(min(0.5, max(deadline - time.monotonic(), 0)))
+        interval = 1 / config.tokens_per_second
+        for token in tokens:
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}]}
+            self._chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            time.sleep(interval)
+        final = {**base, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+        self._chunk(f"data: {json.dumps(final, ensure_ascii=False)}\n\n")
+        self._chunk("data: [DONE]\n\n")
+        self._chunk("")
+        self._count(200)
+
+
+class FakeOpenRouterServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Клиентский пул закрывает лишние keep-alive соединения — это не ошибка сервера
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def start_server(config: FakeConfig = None, host: str = "127.0.0.1", port: int = 0):
+    """
+    Запускает сервер в фоновом потоке. Возвращает (server, URL для OPENROUTER_URL).
+    """
+    server = FakeOpenRouterServer((host, port), FakeOpenRouterHandler)
+    server.config = config or FakeConfig()
+    server.stats = {}
+    server.prefixes = set()
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="fake-openrouter", daemon=True).start()
+    return server, f"http://{host}:{server.server_port}{COMPLETIONS_PATH}"
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", default="lognormal:0.5,0.5",
+                        help="Задержка до первого токена: fixed:С, uniform:A,B, lognormal:МЕДИАНА,SIGMA, exp:СРЕДНЕЕ")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--completion-tokens", type=int, default=300)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After для 429, с")
+
+
+def config_from_args(args) -> FakeConfig:
+    return FakeConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                      completion_tokens=args.completion_tokens, rate_429=args.rate_429,
+                      rate_500=args.rate_500, retry_after=args.retry_after)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная замена OpenRouter chat completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server, url = start_server(config_from_args(args), args.host, args.port)
+    print(f"OPENROUTER_URL={url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Нагрузочный тест пути «разбор файла → отчет LLM» с растущим числом одновременных
+пользователей. Каждый пользователь в своём потоке, как сессия Streamlit, в цикле
+вызывает process_uploaded_file и generate_medical_report (без кэша ответов).
+
+По умолчанию запросы уходят в локальный benchmarks.fake_openrouter, поднятый в этом
+процессе; --url направляет их на внешний сервер.
+
+    python -m benchmarks.load_test --users 1 4 16 --duration 20
+    python -m benchmarks.load_test --users 8 32 --rate-429 0.1 --latency exp:1.0 --stream
+    python -m benchmarks.load_test --url http://127.0.0.1:8090/api/v1/chat/completions
+
+Лимиты планировщика (LLM_RPM, LLM_TPM, LLM_MAX_CONCURRENCY) берутся из окружения или --rpm/--tpm/--llm-concurrency.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+
+from benchmarks import synthetic
+from benchmarks.fake_openrouter import add_arguments, config_from_args, start_server
+
+TASKS = {
+    "ecg": ("ecg_{n}.csv", "ЭКГ покоя, жалобы на сердцебиение"),
+    "lab": ("lab_{n}.csv", "анализ крови, мужчина 54 года"),
+    "document": ("discharge_{n}.pdf", "выписка из стационара, документ"),
+}
+
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def make_inputs(mix: list, files: int, directory: str) -> list:
+    """
+    По files разных файлов каждой модальности: разные хэши, поэтому хранилище ЭКГ и
+    кэш LabPanel не превращают нагрузку в повтор одного и того же файла.
+    """
+    writers = {
+        "ecg": lambda path, n: synthetic.write_ecg_csv(path, 30, fs=250, leads=3, seed=n),
+        "lab": lambda path, n: synthetic.write_lab_csv(path, 200, seed=n),
+        "document": lambda path, n: synthetic.write_text_pdf(path, 1 + n % 3),
+    }
+    inputs = []
+    for n in range(files):
+        for kind in mix:
+            name, task = TASKS[kind]
+            path = os.path.join(directory, name.format(n=n))
+            writers[kind](path, n)
+            with open(path, "rb") as f:
+                inputs.append((kind, os.path.basename(path), f.read(), task))
+    return inputs
+
+
+def run_level(users: int, duration: float, inputs: list, stream: bool) -> dict:
+    from modules.pipeline import LocalFile, process_uploaded_file, generate_medical_report
+
+    samples = []
+    lock = threading.Lock()
+    counter = iter(range(10 ** 9))
+    deadline = time.monotonic() + duration
+
+    def user():
+        while time.monotonic() < deadline:
+            with lock:
+                kind, name, data, task = inputs[next(counter) % len(inputs)]
+            started = time.perf_counter()
+            sample = {"kind": kind, "error": None}
+            parsed = process_uploaded_file(LocalFile(name, data), task)
+            sample["parse_s"] = time.perf_counter() - started
+            if parsed["error"]:
+                sample["error"] = "parse"
+            else:
+                report = generate_medical_report(task, parsed, use_cache=False,
+                                                 on_token=(lambda token: None) if stream else None)
+                sample["llm_s"] = time.perf_counter() - started - sample["parse_s"]
+                if not report["success"]:
+                    error = report["error"] or ""
+                    sample["error"] = "rate_limit" if "429" in error or "Rate Limit" in error else "llm"
+                elif report.get("timing"):
+                    sample["ttft_s"] = report["timing"]["ttft_s"]
+            sample["total_s"] = time.perf_counter() - started
+            with lock:
+                samples.append(sample)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, name=f"user-{i}") for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    ok = [s for s in samples if not s["error"]]
+    errors = {}
+    for s in samples:
+        if s["error"]:
+            errors[s["error"]] = errors.get(s["error"], 0) + 1
+
+    def ms(values, p):
+        value = percentile(values, p)
+        return round(value * 1000) if value is not None else None
+
+    total = [s["total_s"] for s in ok]
+    return {
+        "users": users,
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "error_rate": round(1 - len(ok) / len(samples), 3) if samples else None,
+        "elapsed_s": round(elapsed, 1),
+        "throughput_per_min": round(len(ok) / elapsed * 60, 1),
+        "total_ms": {"p50": ms(total, 50), "p95": ms(total, 95), "p99": ms(total, 99), "max": ms(total, 100)},
+        "parse_ms_p95": ms([s["parse_s"] for s in samples], 95),
+        "llm_ms_p95": ms([s["llm_s"] for s in ok if "llm_s" in s], 95),
+        "ttft_ms_p95": ms([s["ttft_s"] for s in ok if "ttft_s" in s], 95),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест разбора и генерации отчета")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Уровни параллельности")
+    parser.add_argument("--duration", type=float, default=20.0, help="Длительность уровня, с")
+    parser.add_argument("--mix", default="ecg,lab,document", help="Модальности через запятую")
+    parser.add_argument("--files", type=int, default=8, help="Разных файлов каждой модальности")
+    parser.add_argument("--stream", action="store_true", help="Потоковая генерация отчета")
+    parser.add_argument("--url", help="Внешний сервер chat completions вместо встроенной замены")
+    parser.add_argument("--rpm", type=float, help="LLM_RPM для планировщика")
+    parser.add_argument("--tpm", type=float, help="LLM_TPM для планировщика")
+    parser.add_argument("--llm-concurrency", type=int, help="LLM_MAX_CONCURRENCY для планировщика")
+    parser.add_argument("--json", dest="json_out", help="Сохранить результаты в JSON")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+    # Окружение задаётся до импорта modules.*: конфигурация читается при импорте
+    workdir = tempfile.mkdtemp(prefix="medassistant-load-")
+    os.environ["CACHE_DIR"] = workdir
+    os.environ.pop("ECG_STORE_DIR", None)
+    os.environ["JOBS_DB"] = ""
+    server = None
+    if args.url:
+        os.environ["OPENROUTER_URL"] = args.url
+    else:
+        server, os.environ["OPENROUTER_URL"] = start_server(config_from_args(args))
+        os.environ.setdefault("OPENROUTER_API_KEY", "fake")
+    for name, value in (("LLM_RPM", args.rpm), ("LLM_TPM", args.tpm), ("LLM_MAX_CONCURRENCY", args.llm_concurrency)):
+        if value is not None:
+            os.environ[name] = f"{value:g}"
+
+    from modules.scheduler import get_scheduler, LLM_RPM, LLM_TPM, LLM_MAX_CONCURRENCY
+
+    inputs = make_inputs(args.mix.split(","), args.files, workdir)
+    print(f"Сервер: {os.environ['OPENROUTER_URL']}, файлов: {len(inputs)}, "
+          f"планировщик: {LLM_RPM:g} запр/мин, {LLM_TPM:g} ток/мин, до {LLM_MAX_CONCURRENCY} одновременно")
+    print(f"\n{'польз.':>6} {'запросов':>9} {'ок/мин':>8} {'ошибки':>7} {'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8} "
+          f"{'разбор p95':>11} {'LLM p95':>8} {'повторы':>8}")
+
+    results = []
+    for users in args.users:
+        before = get_scheduler().stats()
+        level = run_level(users, args.duration, inputs, args.stream)
+        after = get_scheduler().stats()
+        level["retries"] = after["retries"] - before["retries"]
+        level["rate_limited"] = after["rate_limited"] - before["rate_limited"]
+        level["scheduler_wait_ms"] = after["wait_ms"]
+        results.append(level)
+        latency = level["total_ms"]
+        print(f"{users:>6} {level['requests']:>9} {level['throughput_per_min']:>8} {level['error_rate'] or 0:>7.1%} "
+              f"{latency['p50'] or '—':>8} {latency['p95'] or '—':>8} {latency['p99'] or '—':>8} "
+              f"{level['parse_ms_p95'] or '—':>11} {level['llm_ms_p95'] or '—':>8} {level['retries']:>8}")
+        if level["errors"]:
+            print(f"{'':>6} ошибки: {level['errors']}")
+
+    if server is not None:
+        print(f"\nОтветы сервера по статусам: {server.stats}")
+        server.shutdown()
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": results}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
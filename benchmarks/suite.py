@@ -0,0 +1,366 @@
+"""
+Набор микробенчмарков точек входа на синтетических данных нескольких размеров:
+время (медиана и минимум из повторов), пиковая память (tracemalloc) и сравнение
+с сохранённым эталоном. Регрессия сверх порога — код выхода 1.
+
+    python -m benchmarks.suite                       # профиль quick, сравнение с эталоном
+    python -m benchmarks.suite --profile full        # до суточной ЭКГ и 100k строк анализов
+    python -m benchmarks.suite --save-baseline       # записать эталон для этой машины
+    python -m benchmarks.suite -k lab --repeat 9     # только случаи, содержащие "lab"
+
+Входные файлы генерируются один раз и лежат в --data-dir. Кэши модулей (бинарное
+хранилище ЭКГ, LabPanel, OCR) перед каждым замером сбрасываются: меряется холодный путь.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "medassistant-bench")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baselines", "{profile}.json")
+
+# Регрессия: медленнее эталона больше чем на threshold и на MIN_DELTA_MS (шум коротких замеров)
+TIME_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.25
+MIN_DELTA_MS = 5.0
+MIN_DELTA_MB = 2.0
+
+PROFILES = {
+    "quick": {
+        # 3 с — короче окна порога, 301 с — последний блок записи короче 4 с
+        "ecg_seconds": [3, 10, 300, 301, 1800],
+        "ecg_fs": 500, "ecg_leads": 12,
+        "lab_rows": [10, 1000, 10000],
+        "lab_xlsx_rows": [1000],
+        "pdf_pages": [5],
+        "scan_pages": [1],
+    },
+    "full": {
+        "ecg_seconds": [3, 10, 300, 301, 3600, 86400],
+        "ecg_fs": 250, "ecg_leads": 3,
+        "lab_rows": [10, 1000, 10000, 100000],
+        "lab_xlsx_rows": [1000, 100000],
+        "pdf_pages": [5, 50],
+        "scan_pages": [1, 3],
+    },
+}
+
+
+class Case:
+    """
+    Замер: fn() — измеряемый вызов, setup() — подготовка перед каждым повтором (не измеряется).
+    """
+
+    def __init__(self, name: str, fn, setup=None, size: str = "", skip: str = None):
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+        self.size = size
+        self.skip = skip
+
+
+def _size_label(seconds: float) -> str:
+    if seconds >= 3600 and seconds % 3600 == 0:
+        return f"{seconds / 3600:g}h"
+    if seconds >= 60 and seconds % 60 == 0:
+        return f"{seconds / 60:g}min"
+    return f"{seconds:g}s"
+
+
+def _input(data_dir: str, name: str, write) -> str:
+    # Входные файлы переиспользуются между запусками
+    path = os.path.join(data_dir, name)
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        write(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        print(f"  сгенерирован {name} ({os.path.getsize(path) / 2 ** 20:.1f} МБ) за {time.perf_counter() - started:.1f} с")
+    return path
+
+
+def _open(path: str):
+    # Файл на диске с атрибутом name, как UploadedFile
+    return open(path, "rb")
+
+
+def _tesseract_missing() -> str:
+    import pytesseract
+
+    try:
+        pytesseract.get_tesseract_version()
+        return None
+    except Exception:
+        return "tesseract не установлен"
+
+
+def _poppler_missing() -> str:
+    return None if shutil.which("pdftoppm") else "poppler (pdftoppm) не установлен"
+
+
+def build_cases(profile: dict, data_dir: str) -> list:
+    from benchmarks import synthetic
+    from modules.intent_detection import detect_intent
+    from modules.ecg import process_ecg
+    from modules.ecg_store import get_ecg_store
+    from modules.ecg_analysis import analyze_ecg
+    from modules import ecg_view
+    from modules.lab import process_lab_analysis
+    from modules.lab_analysis import analyze_lab_results
+    from modules import lab_panel
+    from modules.ocr import extract_text_from_image
+    from modules.ocr_engine import get_ocr_cache
+
+    cases = []
+    store = get_ecg_store()
+
+    def forget_ecg():
+        shutil.rmtree(store.directory, ignore_errors=True)
+        os.makedirs(store.directory, exist_ok=True)
+
+    def forget_panels():
+        with lab_panel._panels_lock:
+            lab_panel._panels.clear()
+
+    def forget_ocr():
+        get_ocr_cache().clear()
+
+    names = [("ecg.csv", "ЭКГ покоя"), ("holter.txt", "холтер"), ("blood.xlsx", "анализ крови"),
+             ("scan.png", "рентген"), ("discharge.pdf", "выписка"), ("notes.doc", "")]
+
+    def intents():
+        for _ in range(1000):
+            for filename, task in names:
+                detect_intent(task, filename)
+
+    cases.append(Case("detect_intent", intents, size="6000 вызовов"))
+
+    fs, leads = profile["ecg_fs"], profile["ecg_leads"]
+    for seconds in profile["ecg_seconds"]:
+        label = _size_label(seconds)
+        path = _input(data_dir, f"ecg_{label}_{fs:g}hz_{leads}.csv",
+                      lambda p, s=seconds: synthetic.write_ecg_csv(p, s, fs=fs, leads=leads))
+
+        def ecg_summary(path=path):
+            with _open(path) as f:
+                process_ecg(f)
+
+        cases.append(Case("process_ecg", ecg_summary, setup=forget_ecg, size=label))
+
+        record = {}
+
+        def ecg_record(path=path, record=record):
+            # Конвертация в хранилище не измеряется: детекция читает сигнал через memmap
+            with _open(path) as f:
+                record["value"] = store.get_or_create(f)
+
+        cases.append(Case("analyze_ecg", lambda record=record: analyze_ecg(record["value"]),
+                          setup=ecg_record, size=label))
+
+        def ecg_pyramid_setup(path=path, record=record):
+            ecg_record(path, record)
+            ecg_view._pyramids.clear()
+            for name in (ecg_view.LOD_FILE, "lod.json"):
+                if os.path.exists(os.path.join(record["value"].path, name)):
+                    os.remove(os.path.join(record["value"].path, name))
+
+        cases.append(Case("ecg_pyramid", lambda record=record: ecg_view.get_pyramid(record["value"]),
+                          setup=ecg_pyramid_setup, size=label))
+
+        def ecg_zoom(record=record, method=ecg_view.MINMAX):
+            # От всей записи до 2 с, шагом вдвое: каждый масштаб пирамиды
+            duration = record["value"].n_samples / fs
+            width = duration
+            while width >= 2:
+                ecg_view.ecg_window(record["value"], 0, duration / 2 - width / 2, duration / 2 + width / 2,
+                                    method=method)
+                width /= 2
+
+        def ecg_zoom_setup(path=path, record=record):
+            ecg_record(path, record)
+            ecg_view.get_pyramid(record["value"]).r_peaks()
+
+        cases.append(Case("ecg_window", ecg_zoom, setup=ecg_zoom_setup, size=f"{label} min/max"))
+        cases.append(Case("ecg_window", lambda record=record: ecg_zoom(record, ecg_view.LTTB),
+                          setup=ecg_zoom_setup, size=f"{label} lttb"))
+
+    for rows in profile["lab_rows"]:
+        path = _input(data_dir, f"lab_{rows}.csv", lambda p, r=rows: synthetic.write_lab_csv(p, r))
+        for name, fn in (("process_lab_analysis", process_lab_analysis), ("analyze_lab_results", analyze_lab_results)):
+            def lab(path=path, fn=fn):
+                with _open(path) as f:
+                    fn(f)
+            cases.append(Case(name, lab, setup=forget_panels, size=f"{rows} csv"))
+
+    for rows in profile["lab_xlsx_rows"]:
+        path = _input(data_dir, f"lab_{rows}.xlsx", lambda p, r=rows: synthetic.write_lab_xlsx(p, r))
+
+        def lab_xlsx(path=path):
+            with _open(path) as f:
+                process_lab_analysis(f)
+
+        cases.append(Case("process_lab_analysis", lab_xlsx, setup=forget_panels, size=f"{rows} xlsx"))
+
+    def document(path):
+        def run():
+            with _open(path) as f:
+                extract_text_from_image(f)
+        return run
+
+    for pages in profile["pdf_pages"]:
+        path = _input(data_dir, f"text_{pages}p.pdf", lambda p, n=pages: synthetic.write_text_pdf(p, n))
+        cases.append(Case("extract_text_from_image", document(path), size=f"pdf {pages} стр. (текст)"))
+
+    tesseract = _tesseract_missing()
+    path = _input(data_dir, "scan.png", synthetic.write_document_png)
+    cases.append(Case("extract_text_from_image", document(path), setup=forget_ocr, size="png 1 стр.", skip=tesseract))
+    for pages in profile["scan_pages"]:
+        path = _input(data_dir, f"scan_{pages}p.pdf", lambda p, n=pages: synthetic.write_scanned_pdf(p, n))
+        cases.append(Case("extract_text_from_image", document(path), setup=forget_ocr,
+                          size=f"pdf {pages} стр. (скан)", skip=tesseract or _poppler_missing()))
+    return cases
+
+
+def measure(case: Case, repeat: int, min_time: float) -> dict:
+    """
+    Медиана и минимум времени из repeat повторов (не меньше одного; короткие случаи
+    повторяются, пока не наберётся min_time), затем отдельный прогон под tracemalloc.
+    """
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat or (time.perf_counter() - started < min_time and len(times) < repeat * 10):
+        if case.setup:
+            case.setup()
+        t0 = time.perf_counter()
+        case.fn()
+        times.append(time.perf_counter() - t0)
+
+    # tracemalloc замедляет выполнение, поэтому память меряется отдельным прогоном
+    if case.setup:
+        case.setup()
+    tracemalloc.start()
+    try:
+        case.fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_ms": round(statistics.median(times) * 1000, 2),
+        "min_ms": round(min(times) * 1000, 2),
+        "runs": len(times),
+        "peak_mb": round(peak / 2 ** 20, 2),
+    }
+
+
+def compare(result: dict, baseline: dict, time_threshold: float, memory_threshold: float) -> list:
+    """
+    Причины регрессии относительно эталона (пустой список — регрессии нет).
+    """
+    problems = []
+    if baseline is None:
+        return problems
+    # Минимум устойчивее медианы к фоновой нагрузке машины
+    limit = baseline["min_ms"] * (1 + time_threshold)
+    if result["min_ms"] > limit and result["min_ms"] - baseline["min_ms"] > MIN_DELTA_MS:
+        problems.append(f"время {result['min_ms']:.1f} мс > {baseline['min_ms']:.1f} мс +{time_threshold:.0%}")
+    limit = baseline["peak_mb"] * (1 + memory_threshold)
+    if result["peak_mb"] > limit and result["peak_mb"] - baseline["peak_mb"] > MIN_DELTA_MB:
+        problems.append(f"память {result['peak_mb']:.1f} МБ > {baseline['peak_mb']:.1f} МБ +{memory_threshold:.0%}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки точек входа на синтетических данных")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("-k", dest="pattern", default="", help="Только случаи, в имени или размере которых есть строка")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.5, help="Минимальное суммарное время повторов, с")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--baseline", default=None, help=f"Файл эталона (по умолчанию {DEFAULT_BASELINE})")
+    parser.add_argument("--save-baseline", action="store_true", help="Записать результаты как эталон")
+    parser.add_argument("--threshold", type=float, default=TIME_THRESHOLD, help="Допустимое замедление (доля)")
+    parser.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD)
+    parser.add_argument("--json", dest="json_out", help="Сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    # Предупреждения модулей (например, неизвестный intent) засоряют вывод и замеры
+    logging.basicConfig(level=logging.ERROR)
+    os.makedirs(args.data_dir, exist_ok=True)
+    # Кэши модулей — во временном каталоге, чтобы не трогать рабочие и не получать тёплых попаданий
+    cache_dir = tempfile.mkdtemp(prefix="medassistant-bench-cache-")
+    os.environ["CACHE_DIR"] = cache_dir
+    os.environ.pop("ECG_STORE_DIR", None)
+    baseline_path = args.baseline or DEFAULT_BASELINE.format(profile=args.profile)
+    baseline = {}
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    print(f"Профиль {args.profile}, данные в {args.data_dir}")
+    try:
+        cases = build_cases(PROFILES[args.profile], args.data_dir)
+        cases = [c for c in cases if args.pattern in f"{c.name} {c.size}"]
+
+        print(f"\n{'случай':<24} {'размер':<22} {'медиана, мс':>12} {'мин, мс':>10} {'пик, МБ':>9}  эталон")
+        results, regressions = {}, []
+        for case in cases:
+            key = f"{case.name}[{case.size}]"
+            if case.skip:
+                print(f"{case.name:<24} {case.size:<22} пропущен: {case.skip}")
+                continue
+            result = measure(case, args.repeat, args.min_time)
+            results[key] = result
+            reference = baseline.get(key)
+            problems = compare(result, reference, args.threshold, args.memory_threshold)
+            if problems:
+                regressions.append((key, problems))
+                verdict = "РЕГРЕССИЯ: " + "; ".join(problems)
+            elif reference:
+                verdict = f"x{reference['min_ms'] / result['min_ms']:.2f}" if result["min_ms"] else "ok"
+            else:
+                verdict = "—"
+            print(f"{case.name:<24} {case.size:<22} {result['median_ms']:>12.1f} {result['min_ms']:>10.1f} "
+                  f"{result['peak_mb']:>9.1f}  {verdict}")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report = {
+        "profile": args.profile,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+    }
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        # Дополняем эталон: случаи, не попавшие под -k, сохраняют прежние значения
+        previous = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path, encoding="utf-8") as f:
+                previous = json.load(f)["results"]
+        report["results"] = {**previous, **results}
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nЭталон записан: {baseline_path}")
+    elif not baseline:
+        print(f"\nЭталона нет ({baseline_path}); запишите его флагом --save-baseline")
+
+    if regressions:
+        print(f"\nРегрессий: {len(regressions)}")
+        for key, problems in regressions:
+            print(f"  {key}: {'; '.join(problems)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
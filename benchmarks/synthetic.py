@@ -0,0 +1,247 @@
+"""
+Генераторы синтетических данных для бенчмарков.
+"""
+import numpy as np
+
+# Усиление QRS по отведениям (часть отведений инвертирована, как aVR)
+LEAD_GAINS = (1.0, 1.3, 0.4, -0.9, 0.6, 1.1, 0.3, 0.8, 1.2, 1.4, 1.1, 0.9)
+LEAD_NAMES = ("I", "II", "III", "aVR", "aVL", "aVF", "V1", "V2", "V3", "V4", "V5", "V6")
+
+
+def _beat_template(fs: float) -> np.ndarray:
+    # P, Q, R, S, T как сумма гауссиан (амплитуда мВ, центр с, ширина с)
+    t = np.arange(-0.3, 0.5, 1 / fs)
+    waves = ((0.15, -0.2, 0.025), (-0.1, -0.03, 0.01), (1.0, 0.0, 0.012),
+             (-0.25, 0.03, 0.01), (0.3, 0.25, 0.04))
+    return sum(a * np.exp(-((t - c) ** 2) / (2 * w ** 2)) for a, c, w in waves), int(0.3 * fs)
+
+
+def synthetic_ecg(seconds: float, fs: float = 500, leads: int = 12, heart_rate: float = 70,
+                  noise: float = 0.05, seed: int = 0):
+    """
+    Многоканальная ЭКГ с вариабельностью ритма, дрейфом изолинии, сетевой наводкой и шумом.
+    Возвращает (signals float32 формы (отсчёты, отведения), индексы истинных R-пиков).
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * fs)
+    mean_rr = 60.0 / heart_rate
+    rr = mean_rr + 0.05 * mean_rr * rng.standard_normal(int(seconds / mean_rr) + 2)
+    beats = (np.cumsum(rr) * fs).astype(np.int64)
+    beats = beats[beats < n - int(0.5 * fs)]
+
+    template, r_offset = _beat_template(fs)
+    base = np.zeros(n, dtype=np.float32)
+    index = beats[:, None] - r_offset + np.arange(template.size)[None, :]
+    valid = (index >= 0) & (index < n)
+    np.add.at(base, index[valid], np.broadcast_to(template, index.shape)[valid].astype(np.float32))
+
+    t = np.arange(n, dtype=np.float32) / fs
+    gains = np.resize(np.array(LEAD_GAINS, dtype=np.float32), leads)
+    signals = base[:, None] * gains[None, :]
+    signals += (0.2 * np.sin(2 * np.pi * 0.3 * t))[:, None]
+    signals += (0.02 * np.sin(2 * np.pi * 50 * t))[:, None]
+    signals += noise * rng.standard_normal((n, leads), dtype=np.float32)
+    return signals, beats
+
+
+def lead_names(leads: int) -> list:
+    return [LEAD_NAMES[i] if i < len(LEAD_NAMES) else f"L{i + 1}" for i in range(leads)]
+
+
+def iter_synthetic_ecg(seconds: float, fs: float = 500, leads: int = 12, heart_rate: float = 70,
+                       noise: float = 0.05, seed: int = 0, chunk_seconds: float = 600):
+    """
+    То же, что synthetic_ecg, но блоками по chunk_seconds: суточная запись не держится
+    в памяти целиком. Возвращает (время, сигналы) для каждого блока.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * fs)
+    mean_rr = 60.0 / heart_rate
+    rr = mean_rr + 0.05 * mean_rr * rng.standard_normal(int(seconds / mean_rr) + 2)
+    beats = (np.cumsum(rr) * fs).astype(np.int64)
+    beats = beats[beats < n - int(0.5 * fs)]
+
+    template, r_offset = _beat_template(fs)
+    template = template.astype(np.float32)
+    gains = np.resize(np.array(LEAD_GAINS, dtype=np.float32), leads)
+    step = max(int(chunk_seconds * fs), 1)
+    for start in range(0, n, step):
+        stop = min(start + step, n)
+        # Комплексы, которые хотя бы частично попадают в блок
+        first = np.searchsorted(beats, start + r_offset - template.size, side="right")
+        last = np.searchsorted(beats, stop + r_offset, side="left")
+        index = beats[first:last, None] - r_offset + np.arange(template.size)[None, :] - start
+        valid = (index >= 0) & (index < stop - start)
+        base = np.zeros(stop - start, dtype=np.float32)
+        np.add.at(base, index[valid], np.broadcast_to(template, index.shape)[valid])
+
+        t = np.arange(start, stop, dtype=np.float64) / fs
+        signals = base[:, None] * gains[None, :]
+        signals += (0.2 * np.sin(2 * np.pi * 0.3 * t)).astype(np.float32)[:, None]
+        signals += (0.02 * np.sin(2 * np.pi * 50 * t)).astype(np.float32)[:, None]
+        signals += noise * rng.standard_normal((stop - start, leads), dtype=np.float32)
+        yield t, signals
+
+
+def write_ecg_csv(path: str, seconds: float, fs: float = 500, leads: int = 12, seed: int = 0):
+    """
+    CSV многоканальной ЭКГ (столбец time и отведения) — формат, который загружают в приложение.
+    """
+    import pandas as pd
+
+    names = lead_names(leads)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for number, (t, signals) in enumerate(iter_synthetic_ecg(seconds, fs, leads, seed=seed)):
+            frame = pd.DataFrame(signals, columns=names)
+            frame.insert(0, "time", t)
+            frame.to_csv(f, index=False, header=number == 0, float_format="%.4f")
+    return path
+
+
+# Показатель, единицы, норма, среднее и разброс для генерации результатов
+LAB_ANALYTES = (
+    ("Гемоглобин", "г/л", "120-160", 135, 18),
+    ("Эритроциты", "10^12/л", "4.0-5.5", 4.6, 0.5),
+    ("Лейкоциты", "10^9/л", "4.0-9.0", 6.5, 2.2),
+    ("Тромбоциты", "10^9/л", "150-400", 250, 70),
+    ("Гематокрит", "%", "36-48", 42, 4),
+    ("СОЭ", "мм/ч", "2-15", 9, 6),
+    ("Глюкоза", "ммоль/л", "3.9-6.1", 5.4, 1.2),
+    ("Креатинин", "мкмоль/л", "62-115", 88, 25),
+    ("Мочевина", "ммоль/л", "2.5-8.3", 5.5, 1.8),
+    ("АЛТ", "Ед/л", "<41", 28, 15),
+    ("АСТ", "Ед/л", "<40", 26, 12),
+    ("Билирубин общий", "мкмоль/л", "3.4-20.5", 12, 6),
+    ("Холестерин общий", "ммоль/л", "<5.2", 5.1, 1.1),
+    ("Калий", "ммоль/л", "3.5-5.1", 4.3, 0.5),
+    ("Натрий", "ммоль/л", "136-145", 140, 3),
+    ("С-реактивный белок", "мг/л", "<5", 4, 6),
+)
+
+
+def lab_rows(rows: int, seed: int = 0) -> list:
+    """
+    Строки длинного формата (пациент, показатель, значение, единицы, норма) с пропусками
+    и значениями вида «<0.5», как в выгрузках ЛИС.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(LAB_ANALYTES), rows)
+    noise = rng.standard_normal(rows)
+    special = rng.random(rows)
+    result = []
+    for i in range(rows):
+        name, unit, reference, mean, sd = LAB_ANALYTES[picks[i]]
+        value = max(mean + sd * noise[i], 0.01)
+        if special[i] < 0.01:
+            text = ""
+        elif special[i] < 0.02:
+            text = f"<{value:.1f}"
+        else:
+            text = f"{value:.2f}"
+        result.append((i // len(LAB_ANALYTES) + 1, name, text, unit, reference))
+    return result
+
+
+LAB_HEADER = ("ID", "Показатель", "Значение", "Единицы", "Норма")
+
+
+def write_lab_csv(path: str, rows: int, seed: int = 0):
+    import csv
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(LAB_HEADER)
+        writer.writerows(lab_rows(rows, seed))
+    return path
+
+
+def write_lab_xlsx(path: str, rows: int, seed: int = 0):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Результаты")
+    sheet.append(LAB_HEADER)
+    for row in lab_rows(rows, seed):
+        sheet.append(row)
+    workbook.save(path)
+    return path
+
+
+DOCUMENT_LINES = (
+    "DISCHARGE SUMMARY",
+    "Patient: John Doe, 58 y.o., male. Admitted 2024-03-02, discharged 2024-03-09.",
+    "Complaints: chest pain on exertion, shortness of breath, palpitations.",
+    "Diagnosis: I20.8 Stable angina pectoris, FC II. I11.9 Hypertensive heart disease.",
+    "ECG: sinus rhythm 72 bpm, ST depression 1 mm in V4-V6.",
+    "Echo: LVEF 55%, LV hypertrophy, mild mitral regurgitation.",
+    "Labs: Hb 138 g/L, LDL 4.1 mmol/L, creatinine 96 umol/L, glucose 5.9 mmol/L.",
+    "Treatment: aspirin 75 mg, atorvastatin 40 mg, bisoprolol 5 mg, perindopril 5 mg.",
+    "Recommendations: stress test in 1 month, lipid profile in 6 weeks, low-salt diet.",
+)
+
+
+def document_lines(count: int) -> list:
+    return [DOCUMENT_LINES[i % len(DOCUMENT_LINES)] for i in range(count)]
+
+
+def document_image(lines: int = 40, width: int = 1654, height: int = 2339):
+    """
+    Страница A4 (200 dpi) с отрендеренным текстом — имитация скана выписки.
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=28)
+    for number, line in enumerate(document_lines(lines)):
+        draw.text((100, 120 + number * 52), line, fill=0, font=font)
+    return image
+
+
+def write_document_png(path: str, lines: int = 40):
+    document_image(lines).save(path, "PNG")
+    return path
+
+
+def write_scanned_pdf(path: str, pages: int, lines: int = 40):
+    """
+    PDF без текстового слоя: каждая страница — изображение.
+    """
+    images = [document_image(lines) for _ in range(pages)]
+    images[0].save(path, "PDF", resolution=200, save_all=True, append_images=images[1:])
+    return path
+
+
+def write_text_pdf(path: str, pages: int, lines: int = 45):
+    """
+    PDF с текстовым слоем (Helvetica), как у выписок, выгруженных из МИС.
+    """
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(pages):
+        text = "BT /F1 10 Tf 14 TL 50 800 Td " + " ".join(f"({escape(line)}) '" for line in document_lines(lines)) + " ET"
+        stream = text.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{k} 0 R" for k in kids).encode(), pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
@@ -0,0 +1,242 @@
+"""
+Пакетная обработка исследований без Streamlit UI.
+
+Примеры:
+    python -m modules.batch studies/ --task "Проанализируй ЭКГ" --out results.jsonl
+    python -m modules.batch manifest.csv --out results.jsonl --concurrency 16
+
+Манифест — CSV или JSONL с полями path и task (путь относительно манифеста).
+Повторный запуск с тем же --out пропускает уже успешно обработанные элементы.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from modules.pipeline import LocalFile, process_uploaded_file, agenerate_medical_report, update_patient_history
+from modules.history import parse_date
+from modules.http_client import aclose_async_client
+from modules.scheduler import get_scheduler
+from modules.metrics import get_metrics
+from modules.logging_config import setup_logging, correlation_id
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".csv", ".txt", ".png", ".jpg", ".jpeg", ".bmp", ".xlsx", ".xls", ".pdf")
+DEFAULT_TASK = "Проанализируй медицинские данные"
+
+
+def item_id(path: str, task: str) -> str:
+    return hashlib.sha1(f"{path}\n{task}".encode("utf-8")).hexdigest()
+
+
+def load_items(source: str, default_task: str) -> list:
+    """
+    Список элементов {id, path, task} из каталога или манифеста (CSV/JSONL).
+    Необязательные поля манифеста patient и date — для истории пациента (modules.history).
+    """
+    items = []
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    items.append({"path": os.path.join(root, name), "task": default_task})
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, encoding="utf-8") as f:
+            if source.lower().endswith(".csv"):
+                rows = list(csv.DictReader(f))
+            else:
+                rows = [json.loads(line) for line in f if line.strip()]
+        for row in rows:
+            path = row["path"]
+            if not os.path.isabs(path):
+                path = os.path.join(base, path)
+            item = {"path": path, "task": row.get("task") or default_task,
+                    "patient": row.get("patient") or None, "date": None}
+            if row.get("date"):
+                try:
+                    item["date"] = parse_date(row["date"])
+                except ValueError as e:
+                    # Строка не обрабатывается: ошибка попадёт в её запись результата
+                    item["error"] = str(e)
+            items.append(item)
+
+    for item in items:
+        item["id"] = item_id(item["path"], item["task"])
+    return items
+
+
+def load_finished(out_path: str) -> set:
+    """
+    Идентификаторы элементов, успешно обработанных в предыдущих запусках.
+    """
+    finished = set()
+    if not os.path.exists(out_path):
+        return finished
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Последняя строка могла оборваться при аварийной остановке
+                continue
+            if record.get("status") == "ok":
+                finished.add(record["id"])
+    return finished
+
+
+def _parse_item(path: str, task: str, item_id: str) -> tuple:
+    """
+    Локальный разбор файла (выполняется в процессе пула).
+    """
+    started = time.perf_counter()
+    with correlation_id(item_id):
+        result = process_uploaded_file(LocalFile.from_path(path), task)
+    return result, time.perf_counter() - started
+
+
+def percentiles(values: list, points=(50, 90, 95, 99)) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    last = len(ordered) - 1
+    return {f"p{p}": round(ordered[min(last, round(p / 100 * last))], 3) for p in points}
+
+
+async def run_batch(items: list, out_path: str, workers: int, concurrency: int,
+                    use_cache: bool = True, parse_only: bool = False) -> dict:
+    """
+    Разбор файлов в пуле процессов и генерация отчетов с ограниченной параллельностью.
+    Каждый результат сразу дописывается в JSONL.
+    """
+    loop = asyncio.get_running_loop()
+    llm_slots = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    stats = {"ok": 0, "error": 0, "parse_s": [], "llm_s": [], "total_s": []}
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(out_path, "a", encoding="utf-8") as out:
+
+        async def handle(item):
+            item_started = time.perf_counter()
+            record = {"id": item["id"], "path": item["path"], "task": item["task"]}
+            try:
+                if item.get("error"):
+                    raise ValueError(item["error"])
+                parsed, parse_s = await loop.run_in_executor(pool, _parse_item, item["path"], item["task"], item["id"])
+                stats["parse_s"].append(parse_s)
+                record.update({
+                    "intent": parsed.get("intent"),
+                    "analysis": parsed.get("analysis"),
+                    "parse_s": round(parse_s, 3),
+                    "timings": parsed.get("timings", {}),
+                    "error": parsed.get("error"),
+                })
+                if item.get("patient"):
+                    # Запись в историю — в основном процессе: SQLite пишет один процесс
+                    history = update_patient_history(item["patient"], item.get("date"), [item["path"]], [parsed])
+                    record["patient"] = item["patient"]
+                    if history:
+                        parsed = {**parsed, "history": history}
+
+                if not parsed.get("error") and not parse_only:
+                    async with llm_slots:
+                        llm_started = time.perf_counter()
+                        report = await agenerate_medical_report(item["task"], parsed, use_cache=use_cache)
+                    llm_s = time.perf_counter() - llm_started
+                    stats["llm_s"].append(llm_s)
+                    record.update({
+                        "report": report.get("content"),
+                        "usage": report.get("usage", {}),
+                        "cached": report.get("cached", False),
+                        "llm_s": round(llm_s, 3),
+                        "timings": {**record["timings"], **report.get("timings", {})},
+                        "error": report.get("error"),
+                    })
+            except Exception as e:
+                logger.error("Ошибка при обработке %s: %s", item['path'], e, exc_info=True)
+                record["error"] = str(e)
+
+            total_s = time.perf_counter() - item_started
+            record["status"] = "error" if record.get("error") else "ok"
+            record["total_s"] = round(total_s, 3)
+            record["finished_at"] = datetime.now().isoformat(timespec="seconds")
+            stats[record["status"]] += 1
+            stats["total_s"].append(total_s)
+
+            out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+
+        async def worker():
+            while not queue.empty():
+                item = queue.get_nowait()
+                with correlation_id(item["id"]):
+                    await handle(item)
+
+        # Держим разбор впереди LLM, но не больше пары элементов на слот
+        in_flight = max(concurrency, workers) * 2
+        await asyncio.gather(*(worker() for _ in range(min(in_flight, len(items)) or 1)))
+
+    await aclose_async_client()
+    elapsed = time.perf_counter() - started
+    processed = stats["ok"] + stats["error"]
+    return {
+        "processed": processed,
+        "ok": stats["ok"],
+        "error": stats["error"],
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_min": round(processed / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "latency_s": {
+            "parse": percentiles(stats["parse_s"]),
+            "llm": percentiles(stats["llm_s"]),
+            "total": percentiles(stats["total_s"]),
+        },
+        "scheduler": get_scheduler().stats(),
+        # Этапы LLM этого процесса; разбор в дочерних процессах — в timings записей
+        "stages": get_metrics().summary()["stages"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная обработка медицинских файлов без UI")
+    parser.add_argument("source", help="Каталог с файлами или манифест (CSV/JSONL с полями path, task, patient, date)")
+    parser.add_argument("--out", default="results.jsonl", help="Файл результатов JSONL (дописывается)")
+    parser.add_argument("--task", default=DEFAULT_TASK, help="Описание задачи для файлов без своего task")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Процессы для локального разбора")
+    parser.add_argument("--concurrency", type=int, default=8, help="Одновременные запросы к LLM")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш ответов")
+    parser.add_argument("--parse-only", action="store_true", help="Только локальный разбор, без LLM")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    # Журнал — в stderr через фоновый поток, чтобы запись не задерживала цикл событий
+    setup_logging(level="INFO" if args.verbose else "WARNING", log_file="", fmt="text")
+
+    items = load_items(args.source, args.task)
+    finished = load_finished(args.out)
+    pending = [item for item in items if item["id"] not in finished]
+    print(f"Элементов: {len(items)}, уже обработано: {len(items) - len(pending)}, к обработке: {len(pending)}")
+    if not pending:
+        return 0
+
+    summary = asyncio.run(run_batch(
+        pending, args.out, workers=args.workers, concurrency=args.concurrency,
+        use_cache=not args.no_cache, parse_only=args.parse_only
+    ))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0 if summary["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
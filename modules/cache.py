@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("MEDASSISTANT_CACHE_DIR", ".cache")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "256"))
+RESPONSE_CACHE_MEMORY_ITEMS = int(os.getenv("RESPONSE_CACHE_MEMORY_ITEMS", "256"))
+# Время доступа при попадании в память пишется на диск пачками: не чаще раза в интервал
+# или при накоплении TOUCH_BATCH ключей, и всегда перед вытеснением
+TOUCH_INTERVAL = 30.0
+TOUCH_BATCH = 64
+
+
+def make_key(*parts) -> str:
+    """
+    Строит ключ кэша как sha256 от нормализованного JSON всех частей.
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Схлопывает пробелы и переводы строк, чтобы форматирование не влияло на ключ.
+    """
+    return " ".join((text or "").split())
+
+
+def file_sha256(uploaded_file) -> str:
+    """
+    Хэш содержимого загруженного файла (позиция чтения восстанавливается).
+    """
+    if hasattr(uploaded_file, "getvalue"):
+        data = uploaded_file.getvalue()
+    else:
+        position = uploaded_file.tell()
+        uploaded_file.seek(0)
+        data = uploaded_file.read()
+        uploaded_file.seek(position)
+    return hashlib.sha256(data).hexdigest()
+
+
+class TieredCache:
+    """
+    Двухуровневый кэш: LRU в памяти поверх SQLite на диске.
+    Значения — JSON-сериализуемые объекты. Записи старше ttl считаются промахом,
+    при превышении max_bytes на диске удаляются давно не использованные записи.
+    """
+
+    def __init__(self, name: str, directory: str = CACHE_DIR, ttl: float = RESPONSE_CACHE_TTL,
+                 max_bytes: int = int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+                 memory_items: int = RESPONSE_CACHE_MEMORY_ITEMS):
+        self.name = name
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        # key → время последнего попадания в память, ещё не записанное в accessed
+        self._touched = {}
+        self._touch_flushed = time.time()
+
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.sqlite3")
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._db.commit()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl > 0 and now - created > self.ttl
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _flush_touched(self, now: float):
+        if self._touched:
+            self._db.executemany("UPDATE entries SET accessed = ? WHERE key = ?",
+                                 [(accessed, key) for key, accessed in self._touched.items()])
+            self._db.commit()
+            self._touched.clear()
+        self._touch_flushed = now
+
+    def get(self, key: str):
+        """
+        Возвращает значение или None при промахе.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    # Иначе при вытеснении с диска первыми ушли бы самые востребованные записи
+                    self._touched[key] = now
+                    if len(self._touched) >= TOUCH_BATCH or now - self._touch_flushed > TOUCH_INTERVAL:
+                        self._flush_touched(now)
+                    return value
+                del self._memory[key]
+
+            row = self._db.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1], now):
+                if row is not None:
+                    self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._db.commit()
+                self._counters["misses"] += 1
+                return None
+
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            self._counters["disk_hits"] += 1
+            return value
+
+    def set(self, key: str, value):
+        """
+        Сохраняет значение в оба уровня и при необходимости вытесняет старые записи.
+        """
+        now = time.time()
+        raw = json.dumps(value, ensure_ascii=False, default=str)
+        with self._lock:
+            self._remember(key, now, value)
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, raw, len(raw.encode("utf-8")), now, now)
+            )
+            self._counters["writes"] += 1
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float):
+        if self.ttl > 0:
+            expired = self._db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,)).rowcount
+            self._counters["evictions"] += max(expired, 0)
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        self._flush_touched(now)
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._memory.pop(key, None)
+            total -= size
+            self._counters["evictions"] += 1
+        logger.info("Кэш %s: вытеснение до %s байт", self.name, total)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            self._db.execute("DELETE FROM entries")
+            self._db.commit()
+
+    def stats(self) -> dict:
+        """
+        Счётчики попаданий/промахов и размер кэша.
+        """
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            counters = dict(self._counters)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        counters.update({
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": entries,
+            "disk_bytes": size,
+        })
+        return counters
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> TieredCache:
+    """
+    Общий кэш ответов LLM (отчёты и анализ изображений).
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = TieredCache("responses")
+        return _response_cache
@@ -0,0 +1,50 @@
+import os
+import sys
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _streamlit_secret(name: str):
+    """
+    Значение из Streamlit secrets; None, если Streamlit или secrets.toml недоступны
+    (например, при запуске пакетной обработки без UI).
+    Streamlit не импортируется ради secrets: под streamlit run он уже загружен,
+    а пакетной обработке импорт стоил бы ~0.4 с.
+    """
+    st = sys.modules.get("streamlit")
+    if st is None:
+        return None
+    try:
+        return st.secrets.get(name)
+    except Exception:
+        return None
+
+
+def get_api_key(name: str) -> str:
+    return _streamlit_secret(name) or os.getenv(name)
+
+
+# Только для локальной загрузки .env, и чтобы не мешало облаку
+if not _streamlit_secret("OPENROUTER_API_KEY"):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+# ============ КОНФИГ OPENROUTER ============
+OPENROUTER_API_KEY = get_api_key("OPENROUTER_API_KEY")
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.io/api/v1/chat/completions")
+MODEL_NAME = os.getenv("OPENROUTER_MODEL", "meta-llama/llama-3.2-90b-vision-instruct")
+
+
+def get_settings() -> dict:
+    """
+    Настройки подключения к LLM (без значения ключа) для отображения в UI.
+    """
+    return {
+        "api_key_loaded": bool(OPENROUTER_API_KEY),
+        "url": OPENROUTER_URL,
+        "model": MODEL_NAME,
+    }
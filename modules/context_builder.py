@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import math
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Бюджет токенов на блок данных в промпте отчета
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+
+# Символов на токен: латиница и цифры кодируются плотнее кириллицы
+_ASCII_CHARS_PER_TOKEN = 4.0
+_OTHER_CHARS_PER_TOKEN = 2.5
+
+FLAG_MARKS = {"low": "↓", "high": "↑", "critical_low": "↓↓ КРИТ", "critical_high": "↑↑ КРИТ"}
+# Строки выписки, которые важнее остального текста
+KEY_LINE_RE = re.compile(r"диагноз|заключени|рекомендац|жалоб|мкб|diagnos|conclusion|impression|recommend", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка числа токенов без токенизатора модели (с запасом для кириллицы).
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    other = len(text) - ascii_chars
+    return math.ceil(ascii_chars / _ASCII_CHARS_PER_TOKEN + other / _OTHER_CHARS_PER_TOKEN)
+
+
+def _num(value, digits: int = 3) -> str:
+    # Короткая запись числа: 72.0 → 72, 0.123456 → 0.123
+    if value is None:
+        return "—"
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if math.isnan(value):
+        return "—"
+    return f"{value:.{digits}g}" if abs(value) < 10 ** digits else f"{value:.0f}"
+
+
+class Section:
+    """
+    Раздел контекста: заголовок, приоритет (0 — важнейший) и строки в порядке важности.
+    Если раздел не помещается, он обрезается по строкам; truncatable — можно резать последнюю строку.
+    """
+
+    def __init__(self, name: str, priority: int, lines: list, title: str = None, truncatable: bool = False):
+        self.name = name
+        self.priority = priority
+        self.lines = [line for line in lines if line]
+        self.title = title
+        self.truncatable = truncatable
+
+
+def _truncate(text: str, tokens: int) -> str:
+    # Обрезка по оценке токенов с запасом, по границе слова
+    if estimate_tokens(text) <= tokens:
+        return text
+    cut = text[:max(int(tokens * _OTHER_CHARS_PER_TOKEN), 0)]
+    while cut and estimate_tokens(cut + " …") > tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    return cut.rsplit(" ", 1)[0] + " …" if cut else ""
+
+
+def pack_sections(sections: list, budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Укладывает разделы в бюджет по приоритету. Возвращает текст и отчет
+    {"budget", "used", "sections": {имя: токенов}, "dropped": {имя: строк не вошло},
+    "truncated": [обрезанные разделы]}.
+    """
+    used = 0
+    placed = {}
+    report = {"budget": budget, "used": 0, "sections": {}, "dropped": {}, "truncated": []}
+    for section in sorted(sections, key=lambda s: s.priority):
+        lines = []
+        header_cost = estimate_tokens(section.title) + 1 if section.title else 0
+        spent = 0
+        for index, line in enumerate(section.lines):
+            cost = estimate_tokens(line) + 1
+            if used + header_cost + spent + cost > budget:
+                room = budget - used - header_cost - spent - 1
+                if section.truncatable and room > 16:
+                    line = _truncate(line, room)
+                    lines.append(line)
+                    spent += estimate_tokens(line) + 1
+                    report["truncated"].append(section.name)
+                    index += 1
+                if len(section.lines) > index:
+                    report["dropped"][section.name] = len(section.lines) - index
+                break
+            lines.append(line)
+            spent += cost
+        if lines:
+            used += header_cost + spent
+            placed[section.name] = (section, lines)
+            report["sections"][section.name] = header_cost + spent
+
+    # В тексте разделы идут в исходном порядке, а не по приоритету
+    blocks = []
+    for section in sections:
+        if section.name in placed:
+            _, lines = placed[section.name]
+            blocks.append("\n".join(([section.title] if section.title else []) + lines))
+    report["used"] = used
+    return "\n".join(blocks), report
+
+
+def ecg_sections(raw: dict) -> list:
+    # ecg_stream тянет pandas; модуль нужен и там, где ЭКГ не разбирается (оценка токенов)
+    from modules.ecg_stream import is_time_column
+
+    sections = []
+    rhythm = raw.get("rhythm") or {}
+    if rhythm:
+        parts = [f"ЧСС {_num(rhythm.get('heart_rate_bpm'))} уд/мин"]
+        if rhythm.get("min_heart_rate_bpm") is not None:
+            parts.append(f"мин/макс {_num(rhythm['min_heart_rate_bpm'])}/{_num(rhythm['max_heart_rate_bpm'])}")
+        for key, label in (("mean_rr_ms", "RR"), ("sdnn_ms", "SDNN"), ("rmssd_ms", "RMSSD")):
+            if rhythm.get(key) is not None:
+                parts.append(f"{label} {_num(rhythm[key])} мс")
+        if rhythm.get("pnn50_pct") is not None:
+            parts.append(f"pNN50 {_num(rhythm['pnn50_pct'])}%")
+        sections.append(Section("ecg_rhythm", 0, [
+            ", ".join(parts),
+            f"R-пиков {rhythm.get('r_peaks_count', '—')}, запись {_num(rhythm.get('duration_s'))} с, fs {_num(rhythm.get('fs'))} Гц",
+        ], title="Ритм:"))
+
+    statistics = raw.get("statistics") or {}
+    lines = [
+        f"{name}: ср {_num(s.get('mean'))}, σ {_num(s.get('std'))}, мин {_num(s.get('min'))}, "
+        f"медиана {_num(s.get('50%'))}, макс {_num(s.get('max'))}"
+        for name, s in statistics.items() if not is_time_column(name)
+    ]
+    sections.append(Section("ecg_statistics", 2, [f"Размер {raw.get('shape', '—')}"] + lines, title="Сигнал:"))
+    return sections
+
+
+def lab_sections(raw: dict) -> list:
+    sections = []
+    patient = raw.get("patient") or {}
+    profile = ", ".join(
+        part for part in (
+            {"m": "мужчина", "f": "женщина"}.get(patient.get("sex")),
+            f"{patient['age']} лет" if patient.get("age") else None,
+        ) if part
+    )
+    counts = raw.get("flag_counts") or {}
+    summary = (f"Измерений {raw.get('measurements', '—')}, отклонений {raw.get('abnormal_count', 0)}"
+               + "".join(f", {FLAG_MARKS[k]} {v}" for k, v in counts.items() if k in FLAG_MARKS and v))
+    sections.append(Section("lab_summary", 0, [f"Пациент: {profile}" if profile else None, summary]))
+
+    findings = []
+    for item in raw.get("abnormal_findings") or []:
+        low, high = (item.get("reference") or [None, None])
+        reference = f"{_num(low)}–{_num(high)}" if low is not None and high is not None else (
+            f"<{_num(high)}" if high is not None else f">{_num(low)}")
+        line = f"{item['analyte']} {_num(item['value'])} {item.get('unit', '')} {FLAG_MARKS.get(item['flag'], item['flag'])} (норма {reference})"
+        if item.get("original"):
+            line += f" [{item['original']}]"
+        if "row" in item:
+            line = f"стр.{item['row']}: {line}"
+        findings.append(" ".join(line.split()))
+    sections.append(Section("lab_findings", 1, findings, title="Отклонения:"))
+
+    by_analyte = raw.get("abnormal_by_analyte") or {}
+    if len(by_analyte) and raw.get("abnormal_count", 0) > len(findings):
+        lines = [f"{name}: " + ", ".join(f"{FLAG_MARKS.get(f, f)} {c}" for f, c in flags.items())
+                 for name, flags in by_analyte.items()]
+        sections.append(Section("lab_by_analyte", 2, lines, title="Отклонения по показателям:"))
+    return sections
+
+
+def document_sections(text: str) -> list:
+    lines = [" ".join(line.split()) for line in str(text).splitlines()]
+    lines = [line for line in lines if line]
+    key_lines = [line for line in lines if KEY_LINE_RE.search(line)]
+    return [
+        Section("document_key_lines", 1, key_lines, title="Ключевые строки:", truncatable=True),
+        Section("document_text", 2, [" ".join(lines)], title="Текст документа:", truncatable=True),
+    ]
+
+
+def image_sections(raw: dict) -> list:
+    size = raw.get("size")
+    size_text = f"{size[0]}×{size[1]}" if isinstance(size, (list, tuple)) and len(size) == 2 else size
+    return [Section("image_meta", 0, [
+        f"Изображение {raw.get('filename', '')}: {raw.get('format', '')}, {size_text}, режим {raw.get('mode', '')}"
+    ])]
+
+
+def generic_sections(raw) -> list:
+    text = raw if isinstance(raw, str) else json.dumps(raw, ensure_ascii=False, separators=(",", ":"), default=str)
+    return [Section("data", 3, [text], truncatable=True)]
+
+
+MODALITY_BUILDERS = {
+    "ecg": ecg_sections,
+    "lab": lab_sections,
+    "document": document_sections,
+    "image": image_sections,
+}
+
+
+def build_context(intent: str, raw_data, budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Плотное текстовое представление raw_data для модальности intent в пределах budget токенов.
+    Возвращает (текст, отчет по токенам разделов и времени сборки).
+    """
+    started = time.perf_counter()
+    builder = MODALITY_BUILDERS.get(intent, generic_sections)
+    try:
+        sections = builder(raw_data)
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        # Неожиданная структура данных не должна ломать отчет
+        logger.warning("Контекст %s собран в общем виде: %s", intent, e)
+        sections = generic_sections(raw_data)
+    text, report = pack_sections(sections, budget)
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info("Контекст отчета: %s из %s токенов, разделы %s", report['used'], budget, report['sections'])
+    return text, report
+
+
+def build_multi_context(files: list, budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Общий контекст для нескольких файлов одного пациента: files — список словарей
+    {"name", "intent", "analysis", "raw_data"}. Разделы всех файлов укладываются в один бюджет
+    по приоритету, поэтому главное из каждого файла попадает в промпт раньше подробностей.
+    """
+    started = time.perf_counter()
+    sections = []
+    for number, item in enumerate(files, start=1):
+        header = f"[Файл {number}: {item.get('name', '')}, тип {item.get('intent', 'неизвестно')}]"
+        sections.append(Section(f"{number}:header", 0, [header, item.get("analysis")]))
+        if not item.get("raw_data"):
+            continue
+        builder = MODALITY_BUILDERS.get(item.get("intent"), generic_sections)
+        try:
+            file_sections = builder(item["raw_data"])
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logger.warning("Контекст %s собран в общем виде: %s", item.get('name'), e)
+            file_sections = generic_sections(item["raw_data"])
+        for section in file_sections:
+            section.name = f"{number}:{section.name}"
+        sections.extend(file_sections)
+    text, report = pack_sections(sections, budget)
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info("Контекст отчета (%s файлов): %s из %s токенов", len(files), report['used'], budget)
+    return text, report
@@ -1,32 +1,25 @@
 import logging
-import pandas as pd
-import streamlit as st
+from modules.ecg_store import get_ecg_store
 
 logger = logging.getLogger(__name__)
 
 def process_ecg(uploaded_file):
     """
-    Обрабатывает ЭКГ данные из CSV/TXT файла.
+    Обрабатывает ЭКГ данные из CSV/TXT файла и возвращает запись EcgRecord
+    (сводка — record.summary).
+    Файл читается блоками, поэтому память не зависит от длины записи (Холтер).
+    При первой загрузке ЭКГ сохраняется в бинарное хранилище, повторный анализ
+    берёт сводку и сигналы оттуда без разбора текста.
     """
     try:
-        logger.info(f"Обработка ЭКГ: {uploaded_file.name}")
+        logger.info("Обработка ЭКГ: %s", uploaded_file.name)
         
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        else:  # .txt
-            df = pd.read_csv(uploaded_file, delimiter='\t')
+        # Разделитель по расширению выбирает хранилище
+        record = get_ecg_store().get_or_create(uploaded_file)
         
-        # Преобразуем в словарь для передачи
-        ecg_data = {
-            'shape': str(df.shape),
-            'columns': df.columns.tolist(),
-            'preview': df.head(5).to_dict(),
-            'statistics': df.describe().to_dict()
-        }
-        
-        logger.info(f"ЭКГ обработана: {ecg_data['shape']}")
-        return ecg_data
+        logger.info("ЭКГ обработана: %s", record.summary['shape'])
+        return record
     
     except Exception as e:
-        logger.error(f"Ошибка при обработке ЭКГ: {str(e)}", exc_info=True)
+        logger.error("Ошибка при обработке ЭКГ: %s", e, exc_info=True)
         raise
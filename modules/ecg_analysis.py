@@ -1,26 +1,87 @@
+import numpy as np
 import pandas as pd
-from ecgdetectors import Detectors
+from modules.ecg_stream import iter_ecg_chunks, is_time_column
+from modules.ecg_detect import analyze_leads
 
-def analyze_ecg(ecg_input, fs=500):
+DEFAULT_FS = 500
+
+
+def signal_columns(df: pd.DataFrame) -> list:
+    """
+    Числовые столбцы с отведениями: без оси времени и монотонного номера отсчёта.
+    """
+    columns = []
+    for name in df.select_dtypes(include="number").columns:
+        if is_time_column(name):
+            continue
+        values = df[name]
+        if len(values) > 2 and values.is_monotonic_increasing and values.is_unique:
+            continue
+        columns.append(name)
+    return columns
+
+
+def infer_fs(df: pd.DataFrame, default: float = DEFAULT_FS) -> float:
+    """
+    Частота дискретизации по столбцу времени (в секундах), иначе default.
+    """
+    for name in df.columns:
+        if is_time_column(name) and len(df) > 1:
+            step = float(np.median(np.diff(df[name].to_numpy(dtype=np.float64))))
+            if step > 0:
+                return round(1.0 / step, 3)
+    return default
+
+
+def _load_signals(ecg_input):
+    # EcgRecord из бинарного хранилища: представление memmap без копирования
+    if hasattr(ecg_input, "samples") and hasattr(ecg_input, "lead_names"):
+        return ecg_input.samples(), ecg_input.lead_names, ecg_input.fs
+
+    if isinstance(ecg_input, pd.DataFrame):
+        columns = signal_columns(ecg_input)
+        return ecg_input[columns].to_numpy(dtype=np.float32), columns, infer_fs(ecg_input)
+
+    # file-like объект или путь к файлу: читаем блоками, храним только отведения в float32
+    name = getattr(ecg_input, "name", ecg_input)
+    delimiter = '\t' if str(name).endswith('.txt') else ','
+    blocks, columns, fs = [], None, DEFAULT_FS
+    for chunk in iter_ecg_chunks(ecg_input, delimiter=delimiter):
+        if columns is None:
+            columns = signal_columns(chunk)
+            fs = infer_fs(chunk)
+        blocks.append(chunk[columns].to_numpy(dtype=np.float32))
+    return np.concatenate(blocks), columns, fs
+
+
+def analyze_ecg(ecg_input, fs=None):
     """
-    Анализирует ЭКГ-сигнал и находит R-пики.
+    Анализирует ЭКГ-сигнал: R-пики во всех отведениях, ЧСС и показатели ВСР.
 
     Параметры:
-    - ecg_input: либо pandas.DataFrame, либо путь к csv-файлу.
-      Данные должны быть в формате: ['time', 'signal']
-    - fs: частота дискретизации в Гц (по умолчанию 500)
+    - ecg_input: pandas.DataFrame, путь/файл csv или EcgRecord из modules.ecg_store.
+      Данные в формате ['time', отведение, ...]; столбец времени необязателен
+    - fs: частота дискретизации в Гц (по умолчанию — по столбцу времени или 500)
 
     Возвращает:
-    - инфострока (число R-пиков) и словарь с их индексами
+    - инфострока (число R-пиков и ЧСС) и словарь с индексами R-пиков,
+      RR-интервалами и ВСР по сводному каналу и по каждому отведению
     """
-    # Получение сигнала из DataFrame или файла
-    if isinstance(ecg_input, pd.DataFrame):
-        signal = ecg_input.iloc[:, 1].values
-    else:  # file-like объект или путь к файлу
-        df = pd.read_csv(ecg_input)
-        signal = df.iloc[:, 1].values
+    signals, columns, inferred_fs = _load_signals(ecg_input)
+    fs = fs or inferred_fs
+    result = analyze_leads(signals, columns, fs)
 
-    detectors = Detectors(fs)
-    r_peaks = detectors.pan_tompkins_detector(signal)
-    return f"R-пики: {len(r_peaks)}", {"R_peaks": list(r_peaks)}
+    r_peaks = result["r_peaks"]
+    hrv = result["hrv"]
+    info = f"R-пики: {len(r_peaks)}"
+    if hrv.get("heart_rate_bpm"):
+        info += f", ЧСС: {hrv['heart_rate_bpm']} уд/мин"
 
+    return info, {
+        "R_peaks": r_peaks.tolist(),
+        "RR_ms": (np.diff(r_peaks) / fs * 1000.0).round(1).tolist(),
+        "fs": fs,
+        "duration_s": result["duration_s"],
+        "hrv": hrv,
+        "leads": result["leads"],
+    }
@@ -0,0 +1,185 @@
+import logging
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+logger = logging.getLogger(__name__)
+
+# Длина блока обработки и перекрытие на границах блоков (секунды)
+CHUNK_SECONDS = 300
+OVERLAP_SECONDS = 2
+# Рефрактерный период: два QRS не ближе 200 мс
+REFRACTORY_SECONDS = 0.2
+# Пик ближе 360 мс к предыдущему с вдвое меньшей крутизной считаем зубцом T
+T_WAVE_SECONDS = 0.36
+# Физиологичные RR интервалы (мс) для расчёта ЧСС и ВСР
+RR_MIN_MS = 300
+RR_MAX_MS = 2000
+
+
+def _moving_average(x: np.ndarray, width: int) -> np.ndarray:
+    """
+    Скользящее среднее вдоль оси 0 (центрированное, через кумулятивную сумму).
+    """
+    width = max(int(width), 1)
+    pad_before = width // 2
+    pad_after = width - 1 - pad_before
+    padded = np.pad(x, ((pad_before, pad_after), (0, 0)), mode="edge").astype(np.float64)
+    csum = np.cumsum(padded, axis=0)
+    csum = np.vstack([np.zeros((1, x.shape[1])), csum])
+    return ((csum[width:] - csum[:-width]) / width).astype(np.float32)
+
+
+def _window_values(x: np.ndarray, rows: np.ndarray, cols: np.ndarray, before: int, after: int) -> np.ndarray:
+    """
+    Значения x[rows - before : rows + after + 1, cols] для набора точек, форма (k, before + after + 1).
+    """
+    padded = np.pad(x, ((before, after), (0, 0)), mode="constant", constant_values=-np.inf)
+    windows = sliding_window_view(padded, before + after + 1, axis=0)
+    return windows[rows, cols]
+
+
+def _block_levels(integrated: np.ndarray, block: int):
+    """
+    Уровни сигнала (98-й перцентиль) и шума (медиана) по окнам, форма (окна, отведения).
+    """
+    n, leads = integrated.shape
+    blocks = max(n // block, 1)
+    signal, noise = np.quantile(integrated[:blocks * block].reshape(blocks, -1, leads), [0.98, 0.5], axis=1)
+    return signal, noise
+
+
+def _detect_block(x: np.ndarray, fs: float, combined: bool = False) -> list:
+    """
+    Pan-Tompkins-подобный детектор для блока (отсчёты, отведения) за один векторизованный проход:
+    полосовой фильтр разностью скользящих средних, производная, квадрат, интегрирование в окне
+    150 мс, адаптивный порог по 4-секундным окнам и поиск локальных максимумов с рефрактерным
+    периодом. Возвращает индексы R-пиков для каждого отведения; при combined=True последним
+    добавляется сводный канал — сумма нормированных энергий всех отведений (устойчив к шуму
+    отдельных отведений).
+    """
+    n, leads = x.shape
+    if n < int(fs):
+        return [np.empty(0, dtype=np.int64) for _ in range(leads + int(combined))]
+
+    # Полоса ~5-15 Гц: низкие частоты убирает вычитание широкого среднего, высокие — узкое среднее
+    bandpassed = _moving_average(x, fs / 30) - _moving_average(x, fs / 5)
+    derivative = np.diff(bandpassed, axis=0, prepend=bandpassed[:1])
+    integrated = _moving_average(np.square(derivative), 0.15 * fs)
+
+    # Порог по окнам 4 с (в окно попадает хотя бы один комплекс при ЧСС > 15)
+    block = int(4 * fs)
+    levels, _ = _block_levels(integrated, block)
+    if combined:
+        scale = np.median(levels, axis=0)
+        scale[scale <= 0] = 1.0
+        integrated = np.hstack([integrated, (integrated / scale).mean(axis=1, keepdims=True)])
+        derivative = np.hstack([derivative, (np.abs(derivative) / np.sqrt(scale)).mean(axis=1, keepdims=True)])
+        bandpassed = np.hstack([bandpassed, (np.abs(bandpassed) / np.sqrt(scale)).mean(axis=1, keepdims=True)])
+        leads += 1
+
+    # Порог как в Pan-Tompkins: шум + 0.3 * (сигнал - шум)
+    levels, noise = _block_levels(integrated, block)
+    # Нижняя граница отсекает шум на участках без комплексов
+    levels = np.maximum(levels, 0.2 * np.median(levels, axis=0))
+    threshold = np.repeat(noise + 0.3 * (levels - noise), block, axis=0)
+    if threshold.shape[0] < n:
+        threshold = np.vstack([threshold, np.repeat(threshold[-1:], n - threshold.shape[0], axis=0)])
+    # Блок короче окна (fs <= n < 4 * fs): одно окно длиннее сигнала
+    threshold = threshold[:n]
+
+    inner = integrated[1:-1]
+    is_peak = (inner > integrated[:-2]) & (inner >= integrated[2:]) & (inner > threshold[1:-1])
+    rows, cols = np.nonzero(is_peak)
+    rows += 1
+
+    # Оставляем максимум в окне ±рефрактерный период
+    refractory = int(REFRACTORY_SECONDS * fs)
+    windows = _window_values(integrated, rows, cols, refractory, refractory)
+    keep = windows.argmax(axis=1) == refractory
+    rows, cols = rows[keep], cols[keep]
+
+    # Отсев зубцов T: сравниваем крутизну с предыдущим пиком того же отведения
+    # (rows отсортированы внутри отведения, т.к. np.nonzero обходит массив построчно)
+    order = np.lexsort((rows, cols))
+    rows, cols = rows[order], cols[order]
+    slope = _window_values(np.abs(derivative), rows, cols, refractory // 2, refractory // 2).max(axis=1)
+    same_lead = np.r_[False, cols[1:] == cols[:-1]]
+    close = same_lead & (np.diff(rows, prepend=rows[:1]) < int(T_WAVE_SECONDS * fs))
+    weak = slope < 0.5 * np.r_[np.inf, slope[:-1]]
+    keep = ~(close & weak)
+    rows, cols = rows[keep], cols[keep]
+
+    # Интегрирование центрированное, поэтому R лежит рядом с пиком энергии: уточняем по |сигналу| в окне ±100 мс
+    search = int(0.1 * fs)
+    magnitude = np.abs(bandpassed)
+    offsets = _window_values(magnitude, rows, cols, search, search).argmax(axis=1)
+    rows = np.clip(rows - search + offsets, 0, n - 1)
+
+    return [np.unique(rows[cols == lead]) for lead in range(leads)]
+
+
+def detect_r_peaks(signals, fs: float = 500, chunk_seconds: float = CHUNK_SECONDS,
+                   overlap_seconds: float = OVERLAP_SECONDS, combined: bool = False) -> list:
+    """
+    Находит R-пики во всех отведениях сразу.
+
+    signals — массив (отсчёты, отведения): numpy, np.memmap или любой объект со срезами.
+    Длинная запись обрабатывается блоками chunk_seconds с перекрытием overlap_seconds,
+    пики из зоны перекрытия берутся только из блока, которому они принадлежат.
+    Возвращает список массивов индексов (по одному на отведение, плюс сводный канал
+    при combined=True).
+    """
+    n = signals.shape[0]
+    leads = signals.shape[1] if len(signals.shape) > 1 else 1
+    chunk = max(int(chunk_seconds * fs), int(fs))
+    overlap = int(overlap_seconds * fs)
+    found = [[] for _ in range(leads + int(combined))]
+
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        lo, hi = max(start - overlap, 0), min(end + overlap, n)
+        block = np.asarray(signals[lo:hi], dtype=np.float32).reshape(hi - lo, leads)
+        for lead, peaks in enumerate(_detect_block(block, fs, combined)):
+            peaks = peaks + lo
+            found[lead].append(peaks[(peaks >= start) & (peaks < end)])
+
+    return [np.concatenate(parts) if parts else np.empty(0, dtype=np.int64) for parts in found]
+
+
+def compute_hrv(r_peaks: np.ndarray, fs: float = 500) -> dict:
+    """
+    RR интервалы, ЧСС и временные показатели ВСР (SDNN, RMSSD, pNN50).
+    """
+    rr = np.diff(r_peaks) / fs * 1000.0
+    rr = rr[(rr >= RR_MIN_MS) & (rr <= RR_MAX_MS)]
+    if rr.size < 2:
+        return {"r_peaks_count": int(len(r_peaks)), "rr_count": int(rr.size)}
+
+    successive = np.diff(rr)
+    heart_rate = 60000.0 / rr
+    return {
+        "r_peaks_count": int(len(r_peaks)),
+        "rr_count": int(rr.size),
+        "mean_rr_ms": round(float(rr.mean()), 1),
+        "heart_rate_bpm": round(float(60000.0 / rr.mean()), 1),
+        "min_heart_rate_bpm": round(float(heart_rate.min()), 1),
+        "max_heart_rate_bpm": round(float(heart_rate.max()), 1),
+        "sdnn_ms": round(float(rr.std(ddof=1)), 1),
+        "rmssd_ms": round(float(np.sqrt(np.mean(np.square(successive)))), 1) if successive.size else None,
+        "pnn50_pct": round(float(np.mean(np.abs(successive) > 50) * 100), 1) if successive.size else None,
+    }
+
+
+def analyze_leads(signals, lead_names: list, fs: float = 500) -> dict:
+    """
+    Детекция R-пиков и ВСР по всем отведениям и по сводному каналу.
+    """
+    *peaks, consensus = detect_r_peaks(signals, fs, combined=True)
+    return {
+        "fs": fs,
+        "duration_s": round(signals.shape[0] / fs, 1),
+        "r_peaks": consensus,
+        "lead_r_peaks": {name: p for name, p in zip(lead_names, peaks)},
+        "hrv": compute_hrv(consensus, fs),
+        "leads": {name: compute_hrv(p, fs) for name, p in zip(lead_names, peaks)},
+    }
@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+import numpy as np
+
+from modules.cache import CACHE_DIR, file_sha256
+from modules.ecg_stream import iter_ecg_chunks, StreamingStats
+from modules.ecg_analysis import signal_columns, infer_fs
+
+logger = logging.getLogger(__name__)
+
+ECG_STORE_DIR = os.getenv("ECG_STORE_DIR", os.path.join(CACHE_DIR, "ecg"))
+ECG_STORE_MAX_MB = float(os.getenv("ECG_STORE_MAX_MB", "2048"))
+
+SIGNALS_FILE = "signals.f32"
+META_FILE = "meta.json"
+
+
+def delimiter_for(name: str) -> str:
+    """
+    Разделитель по расширению (без учёта регистра): CSV — запятая, TXT — табуляция.
+    """
+    return ',' if name.lower().endswith('.csv') else '\t'
+
+
+class EcgRecord:
+    """
+    ЭКГ в бинарном хранилище: float32 массив (отведения, отсчёты), отображённый в память,
+    и метаданные (частота, имена отведений, хэш содержимого, сводка process_ecg).
+    Срезы возвращаются без копирования.
+    """
+
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        shape = (len(meta["lead_names"]), meta["n_samples"])
+        if shape[0] and shape[1]:
+            self.signals = np.memmap(os.path.join(path, SIGNALS_FILE), dtype=np.float32, mode="r", shape=shape)
+        else:
+            # np.memmap не открывает пустые файлы (нет столбцов с отведениями)
+            self.signals = np.empty(shape, dtype=np.float32)
+
+    @property
+    def fs(self) -> float:
+        return self.meta["fs"]
+
+    @property
+    def lead_names(self) -> list:
+        return self.meta["lead_names"]
+
+    @property
+    def n_samples(self) -> int:
+        return self.meta["n_samples"]
+
+    @property
+    def summary(self) -> dict:
+        return self.meta["summary"]
+
+    def lead(self, lead) -> np.ndarray:
+        """
+        Одно отведение целиком (по имени или номеру).
+        """
+        index = self.lead_names.index(lead) if isinstance(lead, str) else lead
+        return self.signals[index]
+
+    def window(self, start: int, end: int) -> np.ndarray:
+        """
+        Фрагмент всех отведений, форма (отведения, end - start).
+        """
+        return self.signals[:, start:end]
+
+    def samples(self) -> np.ndarray:
+        """
+        Представление (отсчёты, отведения) для детектора R-пиков.
+        """
+        return self.signals.T
+
+    def cached(self, name: str, compute):
+        """
+        Результат производного анализа (JSON), сохранённый рядом с сигналом.
+        """
+        path = os.path.join(self.path, f"{name}.json")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        value = compute()
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+        return value
+
+
+class EcgStore:
+    """
+    Каталог бинарных копий ЭКГ, адресуемых по sha256 исходного файла.
+    Общий размер ограничен max_bytes, вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, directory: str = ECG_STORE_DIR, max_bytes: int = int(ECG_STORE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self, path: str):
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        # Время доступа для LRU храним в mtime файла метаданных
+        os.utime(meta_path)
+        return EcgRecord(path, meta)
+
+    def get(self, content_hash: str):
+        return self._open(os.path.join(self.directory, content_hash))
+
+    def get_or_create(self, uploaded_file, delimiter: str = None) -> EcgRecord:
+        """
+        Возвращает запись из хранилища, при первом обращении конвертирует CSV/TXT.
+        Разделитель по умолчанию — по расширению имени файла; он сохраняется в метаданных.
+        """
+        source_name = getattr(uploaded_file, "name", "")
+        delimiter = delimiter or delimiter_for(source_name)
+        content_hash = file_sha256(uploaded_file)
+        record = self.get(content_hash)
+        # Запись без отведений, разобранная с другим разделителем, — ошибка угадывания, а не данные
+        stale = record is not None and not record.lead_names and record.meta.get("delimiter") != delimiter
+        if record is not None and not stale:
+            logger.info("ЭКГ найдена в бинарном хранилище: %s", content_hash[:12])
+            return record
+
+        uploaded_file.seek(0)
+        record = self._convert(uploaded_file, delimiter, content_hash, source_name, replace=stale)
+        self.evict(keep=content_hash)
+        return record
+
+    def _convert(self, source, delimiter: str, content_hash: str, source_name: str, replace: bool = False) -> EcgRecord:
+        started = time.perf_counter()
+        final_path = os.path.join(self.directory, content_hash)
+        tmp_path = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+
+        try:
+            rows = 0
+            columns = preview = stats = leads = fs = None
+            lead_files = []
+            for chunk in iter_ecg_chunks(source, delimiter):
+                if columns is None:
+                    columns = chunk.columns.tolist()
+                    preview = chunk.head(5).to_dict()
+                    stats = StreamingStats(chunk.select_dtypes(include="number").columns.tolist())
+                    leads = signal_columns(chunk)
+                    fs = infer_fs(chunk)
+                    lead_files = [open(os.path.join(tmp_path, f"lead{i}.tmp"), "wb") for i in range(len(leads))]
+                rows += len(chunk)
+                stats.update(chunk[stats.columns].to_numpy(dtype=np.float32, copy=False))
+                for f, lead in zip(lead_files, leads):
+                    f.write(chunk[lead].to_numpy(dtype=np.float32).tobytes())
+
+            if columns is None:
+                raise ValueError("Файл ЭКГ не содержит данных")
+
+            # Склеиваем отведения в один файл: каждое отведение — непрерывный блок
+            with open(os.path.join(tmp_path, SIGNALS_FILE), "wb") as out:
+                for f in lead_files:
+                    f.close()
+                    with open(f.name, "rb") as part:
+                        shutil.copyfileobj(part, out, 16 * 1024 * 1024)
+                    os.remove(f.name)
+
+            meta = {
+                "sha256": content_hash,
+                "source_name": source_name,
+                "delimiter": delimiter,
+                "fs": fs,
+                "lead_names": [str(lead) for lead in leads],
+                "n_samples": rows,
+                "dtype": "float32",
+                "layout": "lead-major",
+                "created": time.time(),
+                "summary": {
+                    'shape': str((rows, len(columns))),
+                    'columns': columns,
+                    'preview': preview,
+                    'statistics': stats.describe()
+                },
+            }
+            with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, default=str)
+
+            with self._lock:
+                if replace and os.path.exists(final_path):
+                    shutil.rmtree(final_path, ignore_errors=True)
+                if os.path.exists(final_path):
+                    # Параллельная сессия уже сконвертировала этот файл
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                else:
+                    os.rename(tmp_path, final_path)
+        except Exception:
+            for f in lead_files:
+                f.close()
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        logger.info("ЭКГ сконвертирована в бинарный формат за %.2f с: %s отсчётов", time.perf_counter() - started, rows)
+        return self._open(final_path)
+
+    def _entries(self) -> list:
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            meta_path = os.path.join(path, META_FILE)
+            if name.startswith(".") or not os.path.exists(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(meta_path), name, size))
+        return sorted(entries)
+
+    def evict(self, keep: str = None):
+        """
+        Удаляет давно не использованные записи, пока размер хранилища больше max_bytes.
+        """
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, _, size in entries)
+            for _, name, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                total -= size
+                logger.info("ЭКГ %s вытеснена из бинарного хранилища", name[:12])
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "records": len(entries),
+            "bytes": sum(size for _, _, size in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_ecg_store() -> EcgStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EcgStore()
+        return _store
@@ -0,0 +1,154 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ECG_CHUNK_ROWS = int(os.getenv("ECG_CHUNK_ROWS", "200000"))
+# Размер выборки (на столбец) для приближённых квантилей
+ECG_QUANTILE_SAMPLE = int(os.getenv("ECG_QUANTILE_SAMPLE", "65536"))
+# Ось времени оставляем в float64: float32 теряет миллисекунды на суточной записи
+TIME_COLUMNS = ('time', 't', 'timestamp', 'время', 'sec', 'seconds')
+
+
+class StreamingStats:
+    """
+    Однопроходная статистика по столбцам: count/mean/std (алгоритм Чана для
+    объединения частичных сумм), min/max и квантили по резервуарной выборке
+    фиксированного размера. Память не зависит от длины записи.
+    """
+
+    def __init__(self, columns: list, sample_size: int = ECG_QUANTILE_SAMPLE, seed: int = 0):
+        n = len(columns)
+        self.columns = list(columns)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.mean = np.zeros(n, dtype=np.float64)
+        self.m2 = np.zeros(n, dtype=np.float64)
+        self.min = np.full(n, np.inf)
+        self.max = np.full(n, -np.inf)
+        self.sample_size = sample_size
+        self._samples = [np.empty(0, dtype=np.float32) for _ in range(n)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray):
+        """
+        Добавляет блок значений формы (строки, столбцы); NaN пропускаются, как в describe().
+        """
+        for i in range(values.shape[1]):
+            column = values[:, i]
+            column = column[~np.isnan(column)]
+            n_b = column.size
+            if n_b == 0:
+                continue
+
+            column64 = column.astype(np.float64)
+            mean_b = column64.mean()
+            m2_b = np.square(column64 - mean_b).sum()
+            n_a = self.count[i]
+            total = n_a + n_b
+            delta = mean_b - self.mean[i]
+            self.mean[i] += delta * n_b / total
+            self.m2[i] += m2_b + delta * delta * n_a * n_b / total
+            self.count[i] = total
+            self.min[i] = min(self.min[i], column.min())
+            self.max[i] = max(self.max[i], column.max())
+            self._sample(i, column, n_a)
+
+    def _sample(self, i: int, column: np.ndarray, seen: int):
+        # Векторизованный алгоритм R: элемент с глобальным номером t попадает
+        # в выборку с вероятностью k / (t + 1) на случайную позицию
+        k = self.sample_size
+        sample = self._samples[i]
+        free = max(k - sample.size, 0)
+        if free:
+            sample = np.concatenate([sample, column[:free]])
+            column = column[free:]
+            seen += free
+        if column.size:
+            positions = seen + np.arange(column.size)
+            slots = (self._rng.random(column.size) * (positions + 1)).astype(np.int64)
+            accepted = slots < k
+            sample[slots[accepted]] = column[accepted]
+        self._samples[i] = sample
+
+    def describe(self) -> dict:
+        """
+        Статистика в формате df.describe().to_dict().
+        """
+        result = {}
+        for i, name in enumerate(self.columns):
+            count = int(self.count[i])
+            if count == 0:
+                continue
+            q25, q50, q75 = np.quantile(self._samples[i], [0.25, 0.5, 0.75]).tolist()
+            result[name] = {
+                "count": float(count),
+                "mean": float(self.mean[i]),
+                "std": float(np.sqrt(self.m2[i] / (count - 1))) if count > 1 else float("nan"),
+                "min": float(self.min[i]),
+                "25%": q25,
+                "50%": q50,
+                "75%": q75,
+                "max": float(self.max[i]),
+            }
+        return result
+
+
+def is_time_column(name) -> bool:
+    return str(name).strip().lower() in TIME_COLUMNS
+
+
+def _numeric_columns(source, delimiter: str) -> list:
+    # Типы определяем по началу файла, затем возвращаемся к началу
+    position = source.tell()
+    head = pd.read_csv(source, delimiter=delimiter, nrows=1000)
+    source.seek(position)
+    return [c for c in head.columns if pd.api.types.is_numeric_dtype(head[c])]
+
+
+def iter_ecg_chunks(source, delimiter: str = ",", chunk_rows: int = ECG_CHUNK_ROWS):
+    """
+    Читает CSV/TXT ЭКГ блоками по chunk_rows строк; числовые столбцы — float32
+    (кроме оси времени).
+    source — путь или файловый объект с поддержкой seek.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from iter_ecg_chunks(f, delimiter, chunk_rows)
+        return
+
+    numeric = _numeric_columns(source, delimiter)
+    dtypes = {c: np.float64 if is_time_column(c) else np.float32 for c in numeric}
+    reader = pd.read_csv(source, delimiter=delimiter, chunksize=chunk_rows, dtype=dtypes)
+    with reader:
+        yield from reader
+
+
+def summarize_ecg(source, delimiter: str = ",", chunk_rows: int = ECG_CHUNK_ROWS) -> dict:
+    """
+    shape/columns/preview/statistics за один проход по файлу с ограниченной памятью.
+    """
+    rows = 0
+    columns = None
+    preview = None
+    stats = None
+
+    for chunk in iter_ecg_chunks(source, delimiter, chunk_rows):
+        if columns is None:
+            columns = chunk.columns.tolist()
+            preview = chunk.head(5).to_dict()
+            numeric = chunk.select_dtypes(include="number").columns.tolist()
+            stats = StreamingStats(numeric)
+        rows += len(chunk)
+        stats.update(chunk[stats.columns].to_numpy(dtype=np.float32, copy=False))
+
+    if columns is None:
+        raise ValueError("Файл ЭКГ не содержит данных")
+
+    return {
+        'shape': str((rows, len(columns))),
+        'columns': columns,
+        'preview': preview,
+        'statistics': stats.describe()
+    }
@@ -0,0 +1,237 @@
+"""
+Данные для просмотра кривой ЭКГ любой длины: фрагмент отведения прореживается до
+ECG_VIEW_POINTS точек (огибающая min/max или LTTB), R-пики фрагмента — отдельным слоем.
+
+Для быстрого масштабирования рядом с сигналом в хранилище строится пирамида
+огибающих (lod.f32): уровень 0 — min/max по LOD_BASE отсчётов, каждый следующий
+грубее в LOD_FACTOR раз. Любое окно читается с уровня, где на него приходится
+не больше 4 × max_points корзин, поэтому время ответа не зависит от длины записи.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from modules.ecg_analysis import analyze_ecg
+
+logger = logging.getLogger(__name__)
+
+ECG_VIEW_POINTS = int(os.getenv("ECG_VIEW_POINTS", "2000"))
+# Отсчётов в корзине уровня 0 и во сколько раз грубее каждый следующий уровень
+LOD_BASE = 16
+LOD_FACTOR = 4
+LOD_FILE = "lod.f32"
+# Сколько открытых пирамид держать в памяти процесса
+PYRAMIDS_MAX = 8
+
+MINMAX, LTTB = "minmax", "lttb"
+
+
+def _reduce(mins: np.ndarray, maxs: np.ndarray, starts: np.ndarray):
+    return np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts)
+
+
+def lod_sizes(n_samples: int, points: int = ECG_VIEW_POINTS) -> list:
+    """
+    Число корзин на каждом уровне пирамиды; пирамида не нужна, если запись короче points.
+    """
+    sizes = []
+    size = -(-n_samples // LOD_BASE)
+    while n_samples > points and size:
+        sizes.append(size)
+        if size <= points // 2:
+            break
+        size = -(-size // LOD_FACTOR)
+    return sizes
+
+
+class EcgPyramid:
+    """
+    Пирамида огибающих записи EcgRecord, отображённая в память: для каждого отведения
+    подряд лежат уровни [min0, max0, min1, max1, ...].
+    """
+
+    def __init__(self, record, index: dict):
+        self.record = record
+        self.sizes = index["sizes"]
+        self.offsets = []
+        offset = 0
+        for size in self.sizes:
+            self.offsets.append(offset)
+            offset += 2 * size
+        self.data = None
+        self._r_peaks = None
+        if offset:
+            self.data = np.memmap(os.path.join(record.path, LOD_FILE), dtype=np.float32, mode="r",
+                                  shape=(len(record.lead_names), offset))
+
+    def level(self, lead: int, level: int):
+        """
+        (min, max, отсчётов в корзине) уровня для отведения.
+        """
+        offset, size = self.offsets[level], self.sizes[level]
+        row = self.data[lead]
+        return row[offset:offset + size], row[offset + size:offset + 2 * size], LOD_BASE * LOD_FACTOR ** level
+
+    def r_peaks(self) -> np.ndarray:
+        """
+        Номера отсчётов R-пиков из сохранённого анализа ритма (читается один раз).
+        """
+        if self._r_peaks is None:
+            record = self.record
+            _, rhythm = record.cached("rhythm", lambda: analyze_ecg(record))
+            self._r_peaks = np.asarray(rhythm["R_peaks"], dtype=np.int64)
+        return self._r_peaks
+
+
+def build_pyramid(record) -> dict:
+    """
+    Строит lod.f32 рядом с сигналом (по одному отведению в памяти) и возвращает индекс уровней.
+    """
+    started = time.perf_counter()
+    sizes = lod_sizes(record.n_samples)
+    if sizes:
+        path = os.path.join(record.path, LOD_FILE)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as out:
+            for lead in range(len(record.lead_names)):
+                signal = np.asarray(record.lead(lead))
+                mins, maxs = _reduce(signal, signal, np.arange(0, len(signal), LOD_BASE))
+                for level, size in enumerate(sizes):
+                    if level:
+                        mins, maxs = _reduce(mins, maxs, np.arange(0, len(mins), LOD_FACTOR))
+                    out.write(mins.tobytes())
+                    out.write(maxs.tobytes())
+        os.replace(tmp_path, path)
+        logger.info("Пирамида ЭКГ построена за %.2f с: %s уровней", time.perf_counter() - started, len(sizes))
+    return {"base": LOD_BASE, "factor": LOD_FACTOR, "sizes": sizes}
+
+
+_pyramids = OrderedDict()
+_pyramids_lock = threading.Lock()
+
+
+def get_pyramid(record) -> EcgPyramid:
+    """
+    Пирамида записи: из памяти процесса, с диска или построенная при первом просмотре.
+    """
+    key = record.meta["sha256"]
+    with _pyramids_lock:
+        pyramid = _pyramids.get(key)
+        if pyramid is not None:
+            _pyramids.move_to_end(key)
+            return pyramid
+    index = record.cached("lod", lambda: build_pyramid(record))
+    pyramid = EcgPyramid(record, index)
+    with _pyramids_lock:
+        _pyramids[key] = pyramid
+        while len(_pyramids) > PYRAMIDS_MAX:
+            _pyramids.popitem(last=False)
+    return pyramid
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int):
+    """
+    Largest-Triangle-Three-Buckets: n_out точек, сохраняющих форму кривой.
+    Средние следующих корзин считаются векторно; выбор точки в корзине зависит
+    от предыдущей выбранной, поэтому цикл идёт по корзинам, а не по отсчётам.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    counts = np.maximum(ends - starts, 1)
+    x_avg = np.add.reduceat(x[:n - 1], starts) / counts
+    y_avg = np.add.reduceat(y[:n - 1], starts) / counts
+    # Для последней корзины «следующая» — последняя точка
+    x_next = np.append(x_avg[1:], x[-1])
+    y_next = np.append(y_avg[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        bx, by = x[start:end], y[start:end]
+        area = np.abs((x[a] - x_next[i]) * (by - y[a]) - (x[a] - bx) * (y_next[i] - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+
+def ecg_window(record, lead=0, start_s: float = 0.0, end_s: float = None,
+               max_points: int = ECG_VIEW_POINTS, method: str = MINMAX) -> dict:
+    """
+    Фрагмент отведения для графика: время (с) и амплитуды не больше чем в max_points
+    точках, R-пики фрагмента, использованный уровень пирамиды (-1 — исходный сигнал).
+    """
+    started = time.perf_counter()
+    lead = record.lead_names.index(lead) if isinstance(lead, str) else lead
+    fs = record.fs
+    start = min(max(int(start_s * fs), 0), record.n_samples)
+    end = record.n_samples if end_s is None else min(max(int(np.ceil(end_s * fs)), start), record.n_samples)
+    count = end - start
+    signal = record.lead(lead)
+
+    pyramid = get_pyramid(record)
+    level = -1
+    if count <= max_points:
+        x, y = np.arange(start, end, dtype=np.float64), np.asarray(signal[start:end], dtype=np.float64)
+    else:
+        # Самый подробный уровень, на котором окно занимает не больше 4 × max_points корзин
+        mins = maxs = signal[start:end]
+        width, first = 1, start
+        if count > 4 * max_points and pyramid.sizes:
+            for level in range(len(pyramid.sizes)):
+                lo, hi, width = pyramid.level(lead, level)
+                if count // width <= 4 * max_points or level == len(pyramid.sizes) - 1:
+                    break
+            first = start // width * width
+            mins, maxs = lo[start // width:-(-end // width)], hi[start // width:-(-end // width)]
+        mins, maxs = np.asarray(mins, dtype=np.float64), np.asarray(maxs, dtype=np.float64)
+        centers = first + (np.arange(len(mins)) + 0.5) * width
+
+        if method == LTTB:
+            if width == 1:
+                x, y = centers - 0.5, mins
+            else:
+                # Огибающая уровня как ряд min, max, min, ... в центрах корзин
+                x, y = np.repeat(centers, 2), np.column_stack((mins, maxs)).ravel()
+            x, y = lttb(x, y, max_points)
+        else:
+            buckets = max(max_points // 2, 1)
+            bucket_starts = np.unique(np.linspace(0, len(mins), buckets, endpoint=False).astype(np.int64))
+            mins, maxs = _reduce(mins, maxs, bucket_starts)
+            bucket_ends = np.append(bucket_starts[1:], len(centers))
+            x = np.repeat((centers[bucket_starts] + centers[bucket_ends - 1]) / 2, 2)
+            y = np.column_stack((mins, maxs)).ravel()
+
+    peaks_t, peaks_y = _peaks(pyramid, lead, start, end, max_points)
+    return {
+        "t": x / fs,
+        "y": y,
+        "peaks_t": peaks_t,
+        "peaks_y": peaks_y,
+        "level": level,
+        "samples": count,
+        "points": len(x),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _peaks(pyramid: EcgPyramid, lead: int, start: int, end: int, max_points: int):
+    """
+    R-пики окна; при слишком мелком масштабе не показываются.
+    """
+    record = pyramid.record
+    if not record.lead_names:
+        return np.empty(0), np.empty(0)
+    peaks = pyramid.r_peaks()
+    peaks = peaks[np.searchsorted(peaks, start):np.searchsorted(peaks, end)]
+    if len(peaks) > max_points // 4:
+        return np.empty(0), np.empty(0)
+    return peaks / record.fs, np.asarray(record.lead(lead)[peaks], dtype=np.float64)
@@ -0,0 +1,152 @@
+"""
+Обработчики файлов по типу анализа (intent).
+
+Тяжёлые зависимости модальности (pandas, PIL, pytesseract, PyPDF2 и модули modules.*,
+которые их тянут) импортируются внутри обработчика при первом вызове, поэтому
+запуск приложения и пакетной обработки не платит за модальности, которые не используются.
+"""
+import sys
+import time
+import logging
+
+from modules.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# intent → Handler
+HANDLERS = {}
+
+
+class Handler:
+    """
+    Обработчик модальности: допустимые расширения, сообщение об ошибке формата и
+    функция fn(uploaded_file, task_description) → (analysis, raw_data).
+    """
+
+    def __init__(self, intent: str, extensions: tuple, format_error: str, fn):
+        self.intent = intent
+        self.extensions = extensions
+        self.format_error = format_error
+        self.fn = fn
+        self.calls = 0
+        self.first_call_s = None
+
+    def accepts(self, filename: str) -> bool:
+        return filename.lower().endswith(self.extensions)
+
+    def __call__(self, uploaded_file, task_description: str):
+        started = time.perf_counter()
+        with span(f"parse.{self.intent}", bytes=_file_size(uploaded_file)):
+            analysis, raw_data = self.fn(uploaded_file, task_description)
+        if self.calls == 0:
+            # Первый вызов включает импорт зависимостей модальности
+            self.first_call_s = round(time.perf_counter() - started, 3)
+            logger.info("Обработчик %s загружен, первый вызов %s с", self.intent, self.first_call_s)
+        self.calls += 1
+        return analysis, raw_data
+
+
+def _file_size(uploaded_file) -> int:
+    position = uploaded_file.tell()
+    size = uploaded_file.seek(0, 2)
+    uploaded_file.seek(position)
+    return size
+
+
+def register(intent: str, extensions: tuple, format_error: str):
+    """
+    Декоратор: регистрирует функцию как обработчик intent.
+    """
+    def decorator(fn):
+        HANDLERS[intent] = Handler(intent, extensions, format_error, fn)
+        return fn
+    return decorator
+
+
+def get_handler(intent: str) -> Handler:
+    return HANDLERS.get(intent)
+
+
+@register("ecg", (".csv", ".txt"), "ECG должна быть в формате CSV или TXT")
+def handle_ecg(uploaded_file, task_description: str):
+    from modules.ecg import process_ecg
+    from modules.ecg_analysis import analyze_ecg
+
+    with span("ecg.store"):
+        record = process_ecg(uploaded_file)
+    ecg_data = record.summary
+    # Сигнал уже в бинарном хранилище: детекция R-пиков читает его без разбора CSV
+    if record.lead_names:
+        with span("ecg.rhythm"):
+            rhythm_info, rhythm = record.cached("rhythm", lambda: analyze_ecg(record))
+        ecg_data = {**ecg_data, "rhythm": {"fs": rhythm["fs"], "duration_s": rhythm["duration_s"], **rhythm["hrv"]}}
+    else:
+        rhythm_info = "отведения не найдены"
+    logger.info("ЭКГ успешно обработана")
+    return f"ЭКГ данные загружены. Количество отсчетов: {record.n_samples}. {rhythm_info}", ecg_data
+
+
+@register("image", (".png", ".jpg", ".jpeg", ".bmp"), "Поддерживаемые форматы: PNG, JPG, JPEG, BMP")
+def handle_image(uploaded_file, task_description: str):
+    from modules.image import process_image
+    from modules.image_store import get_image_store
+
+    with span("image.header"):
+        image_analysis = process_image(uploaded_file)
+    # Только копия файла и заголовок: пирамида для просмотра и анализа областей
+    # декодируется при первом обращении к пикселям
+    with span("image.store"):
+        get_image_store().get_or_create(uploaded_file)
+    logger.info("Изображение успешно обработано")
+    return "Изображение загружено и проанализировано", image_analysis
+
+
+@register("lab", (".csv", ".xlsx", ".xls"), "Лабораторные анализы должны быть в формате CSV, XLSX или XLS")
+def handle_lab(uploaded_file, task_description: str):
+    from modules.lab import process_lab_analysis
+    from modules.lab_panel import load_lab_panel
+    from modules.lab_flags import flag_panel, abnormal_findings, analyte_values, parse_patient_profile
+
+    with span("lab.read"):
+        lab_data = process_lab_analysis(uploaded_file)
+    # В отчет идут только отклонения, найденные локально по референсным интервалам
+    profile = parse_patient_profile(task_description)
+    with span("lab.flags") as s:
+        flagged = flag_panel(load_lab_panel(uploaded_file), profile)
+        findings = abnormal_findings(flagged)
+        s.set(measurements=findings["measurements"])
+    # Нормализованные значения по показателям — для истории пациента (modules.history)
+    raw_data = {"shape": lab_data["shape"], "patient": profile, **findings, "values": analyte_values(flagged)}
+    logger.info("Лабораторные анализы успешно обработаны")
+    return (
+        f"Лабораторные данные загружены. Параметров: {lab_data['analytes']}, "
+        f"отклонений: {findings['abnormal_count']} из {findings['measurements']}"
+    ), raw_data
+
+
+@register("document", (".pdf", ".png", ".jpg", ".jpeg"), "Поддерживаемые форматы документов: PDF, PNG, JPG")
+def handle_document(uploaded_file, task_description: str):
+    from modules.ocr import extract_text_from_image
+
+    with span("ocr") as s:
+        extracted_text = extract_text_from_image(uploaded_file)
+        s.set(chars=len(extracted_text))
+    logger.info("Текст успешно извлечен из документа")
+    return f"Текст извлечен из документа. Длина текста: {len(extracted_text)} символов", extracted_text
+
+
+# Модули, которые обработчики загружают по требованию (для статистики)
+HEAVY_MODULES = ("pandas", "numpy", "PIL", "pytesseract", "PyPDF2", "openpyxl")
+
+
+def handler_stats() -> dict:
+    """
+    Какие обработчики уже вызывались и какие тяжёлые библиотеки загружены в процесс.
+    """
+    return {
+        "handlers": {
+            intent: {"calls": h.calls, "first_call_s": h.first_call_s}
+            for intent, h in HANDLERS.items()
+        },
+        "loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+    }
@@ -0,0 +1,269 @@
+"""
+История пациента: нормализованные результаты анализов и сводки ЭКГ по пациенту и дате
+в SQLite, чтобы сравнивать с прошлыми исследованиями без повторной загрузки и разбора файлов.
+
+Исследование (файл) добавляется один раз: повторный анализ того же файла для того же
+пациента ничего не пишет. Значения лежат в таблице без rowid, упорядоченной по
+(пациент, показатель, дата), поэтому динамика показателя — одно чтение диапазона индекса.
+
+    history = get_history()
+    history.add_file_result("P-001", "2025-06-02", "labs.csv", file_result)
+    history.trend("P-001", "HGB")
+    history.trend_summary("P-001", current=file_values(file_result))
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import date, datetime
+
+from modules.cache import CACHE_DIR
+from modules.context_builder import FLAG_MARKS
+
+logger = logging.getLogger(__name__)
+
+# Пустое значение — история только в памяти процесса
+HISTORY_DB = os.getenv("HISTORY_DB", os.path.join(CACHE_DIR, "history.sqlite3"))
+# Сколько прошлых значений показателя и строк динамики передавать в отчет
+HISTORY_POINTS = int(os.getenv("HISTORY_POINTS", "3"))
+HISTORY_MAX_LINES = int(os.getenv("HISTORY_MAX_LINES", "20"))
+# Изменение меньше этой доли считается стабильным
+TREND_TOLERANCE = 0.05
+
+# Показатели сводки ЭКГ: ключ ВСР → (код, название, единица)
+ECG_METRICS = {
+    "heart_rate_bpm": ("ECG_HR", "ЧСС", "уд/мин"),
+    "mean_rr_ms": ("ECG_RR", "RR", "мс"),
+    "sdnn_ms": ("ECG_SDNN", "SDNN", "мс"),
+    "rmssd_ms": ("ECG_RMSSD", "RMSSD", "мс"),
+    "pnn50_pct": ("ECG_PNN50", "pNN50", "%"),
+}
+
+
+def parse_date(value) -> str:
+    """
+    Дата исследования в ISO (YYYY-MM-DD) — только в таком виде даты сравниваются и
+    сортируются как строки. Принимает date, YYYY-MM-DD и DD.MM.YYYY; иначе ValueError.
+    """
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    text = str(value).strip()
+    try:
+        return date.fromisoformat(text).isoformat()
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(text, "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        raise ValueError(f"Неверная дата исследования: {text!r} (ожидается YYYY-MM-DD или DD.MM.YYYY)") from None
+
+
+def file_values(file_result: dict) -> dict:
+    """
+    Значения из результата разбора файла: {код: {name, value, unit, flag}}.
+    Сохраняются анализы (raw_data.values) и ритм ЭКГ; остальные типы истории не дают.
+    """
+    raw = file_result.get("raw_data")
+    if file_result.get("error") or not isinstance(raw, dict):
+        return {}
+    if file_result.get("intent") == "lab":
+        return raw.get("values") or {}
+    if file_result.get("intent") == "ecg":
+        rhythm = raw.get("rhythm") or {}
+        return {
+            code: {"name": name, "value": float(rhythm[key]), "unit": unit, "flag": None}
+            for key, (code, name, unit) in ECG_METRICS.items() if rhythm.get(key) is not None
+        }
+    return {}
+
+
+def _change(previous: float, current: float) -> str:
+    delta = current - previous
+    if previous and abs(delta) <= abs(previous) * TREND_TOLERANCE:
+        return "≈"
+    arrow = "↑" if delta > 0 else "↓"
+    if previous:
+        return f"{arrow} {delta:+g}, {delta / abs(previous):+.0%}"
+    return f"{arrow} {delta:+g}"
+
+
+class PatientHistory:
+    """
+    Хранилище истории в SQLite (WAL); одно соединение на процесс под блокировкой.
+    """
+
+    def __init__(self, db_path: str = HISTORY_DB):
+        self._lock = threading.Lock()
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path or ":memory:", timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS studies ("
+            "id INTEGER PRIMARY KEY, patient_id TEXT NOT NULL, taken_on TEXT NOT NULL, kind TEXT NOT NULL, "
+            "file_hash TEXT NOT NULL, source TEXT, created REAL NOT NULL, UNIQUE (patient_id, file_hash))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS studies_patient ON studies (patient_id, taken_on)")
+        # Ключ таблицы — порядок запроса динамики: значения одного показателя лежат подряд по дате
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "patient_id TEXT NOT NULL, code TEXT NOT NULL, taken_on TEXT NOT NULL, "
+            "study_id INTEGER NOT NULL REFERENCES studies (id) ON DELETE CASCADE, "
+            "name TEXT, value REAL NOT NULL, unit TEXT, flag TEXT, "
+            "PRIMARY KEY (patient_id, code, taken_on, study_id)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_study ON results (study_id)")
+        self._db.commit()
+
+    def add_study(self, patient_id: str, taken_on: str, kind: str, file_hash: str, values: dict,
+                  source: str = None) -> bool:
+        """
+        Добавляет исследование и его значения одной транзакцией.
+        False — исследование этого файла у пациента уже есть (или значений нет).
+        """
+        if not values:
+            return False
+        taken_on = parse_date(taken_on)
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO studies (patient_id, taken_on, kind, file_hash, source, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (patient_id, taken_on, kind, file_hash, source, time.time())
+            )
+            if not cursor.rowcount:
+                return False
+            study_id = cursor.lastrowid
+            self._db.executemany(
+                "INSERT INTO results (patient_id, code, taken_on, study_id, name, value, unit, flag) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(patient_id, code, taken_on, study_id, item.get("name"), item["value"], item.get("unit"),
+                  item.get("flag")) for code, item in values.items()]
+            )
+        logger.info("История %s: исследование %s от %s, показателей %s", patient_id, kind, taken_on, len(values))
+        return True
+
+    def add_file_result(self, patient_id: str, taken_on: str, name: str, file_result: dict) -> bool:
+        values = file_values(file_result)
+        if not values or not file_result.get("file_hash"):
+            return False
+        return self.add_study(patient_id, taken_on, file_result["intent"], file_result["file_hash"], values, name)
+
+    def trend(self, patient_id: str, code: str, since: str = None, until: str = None) -> list:
+        """
+        Значения показателя по датам: [{taken_on, value, unit, flag}], от старых к новым.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT taken_on, value, unit, flag FROM results "
+                "WHERE patient_id = ? AND code = ? AND taken_on >= ? AND taken_on <= ? ORDER BY taken_on, study_id",
+                (patient_id, code, parse_date(since) if since else "", parse_date(until) if until else "9999")
+            ).fetchall()
+        return [{"taken_on": t, "value": v, "unit": u, "flag": f} for t, v, u, f in rows]
+
+    def codes(self, patient_id: str) -> list:
+        """
+        Показатели пациента: [{code, name, unit, count, last}].
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT code, MAX(name), MAX(unit), COUNT(*), MAX(taken_on) FROM results "
+                "WHERE patient_id = ? GROUP BY code ORDER BY code",
+                (patient_id,)
+            ).fetchall()
+        return [{"code": c, "name": n, "unit": u, "count": k, "last": t} for c, n, u, k, t in rows]
+
+    def studies(self, patient_id: str) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT taken_on, kind, source, file_hash FROM studies WHERE patient_id = ? ORDER BY taken_on",
+                (patient_id,)
+            ).fetchall()
+        return [{"taken_on": t, "kind": k, "source": s, "file_hash": h} for t, k, s, h in rows]
+
+    def recent(self, patient_id: str, codes=None, until: str = None, exclude_files=(),
+               points: int = HISTORY_POINTS) -> dict:
+        """
+        Последние points значений каждого показателя (или только codes) не позже until,
+        без исследований из exclude_files: {код: [(дата, значение, единица, флаг, название), ...]}.
+        """
+        codes = list(codes or ())
+        exclude_files = list(exclude_files)
+        query = (
+            "SELECT code, taken_on, value, unit, flag, name FROM ("
+            " SELECT r.*, ROW_NUMBER() OVER (PARTITION BY r.code ORDER BY r.taken_on DESC, r.study_id DESC) AS n"
+            " FROM results r JOIN studies s ON s.id = r.study_id"
+            " WHERE r.patient_id = ? AND r.taken_on <= ?"
+        )
+        params = [patient_id, parse_date(until) if until else "9999"]
+        if codes:
+            query += f" AND r.code IN ({', '.join('?' * len(codes))})"
+            params += codes
+        if exclude_files:
+            query += f" AND s.file_hash NOT IN ({', '.join('?' * len(exclude_files))})"
+            params += exclude_files
+        query += ") WHERE n <= ? ORDER BY code, taken_on"
+        params.append(points)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        recent = {}
+        for code, *row in rows:
+            recent.setdefault(code, []).append(tuple(row))
+        return recent
+
+    def trend_summary(self, patient_id: str, current: dict = None, until: str = None, exclude_files=(),
+                      max_lines: int = HISTORY_MAX_LINES) -> list:
+        """
+        Компактная динамика для отчета: строка на показатель с прошлыми значениями и
+        изменением относительно текущего. current — {код: {value, flag, ...}} текущих файлов;
+        без него — последние значения всех показателей. Сначала текущие отклонения.
+        """
+        current = current or {}
+        recent = self.recent(patient_id, current.keys(), until, exclude_files)
+
+        def order(code):
+            flag = (current.get(code) or {}).get("flag")
+            return (flag not in FLAG_MARKS, code)
+
+        lines = []
+        for code in sorted(recent, key=order)[:max_lines]:
+            points = recent[code]
+            name, unit = points[-1][4] or code, points[-1][2] or ""
+            past = "; ".join(f"{t} {value:g}{' ' + FLAG_MARKS[flag] if flag in FLAG_MARKS else ''}"
+                             for t, value, _, flag, _ in points)
+            line = f"{name} ({code}), {unit}: {past}" if name != code else f"{code}, {unit}: {past}"
+            if code in current:
+                value = current[code]["value"]
+                line += f" → сейчас {value:g} ({_change(points[-1][1], value)})"
+            elif len(points) > 1:
+                line += f" ({_change(points[0][1], points[-1][1])})"
+            lines.append(" ".join(line.split()))
+        if len(recent) > max_lines:
+            lines.append(f"... ещё показателей: {len(recent) - max_lines}")
+        return lines
+
+    def stats(self) -> dict:
+        with self._lock:
+            patients, studies = self._db.execute(
+                "SELECT COUNT(DISTINCT patient_id), COUNT(*) FROM studies").fetchone()
+            results = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {"patients": patients, "studies": studies, "results": results}
+
+
+def today() -> str:
+    return date.today().isoformat()
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history() -> PatientHistory:
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = PatientHistory()
+        return _history
@@ -0,0 +1,150 @@
+import os
+import asyncio
+import logging
+import threading
+import weakref
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Параметры пула соединений (переопределяются через переменные окружения)
+HTTP_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("OPENROUTER_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("OPENROUTER_HTTP2", "1").lower() in ("1", "true", "yes")
+
+_lock = threading.Lock()
+_sync_client = None
+# Асинхронный клиент привязан к event loop, поэтому храним по одному на цикл
+_async_clients = weakref.WeakKeyDictionary()
+_requests_sent = {"sync": 0, "async": 0}
+
+
+def _http2_available() -> bool:
+    """
+    Проверяет, установлен ли пакет h2 (нужен httpx для HTTP/2).
+    """
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logger.warning("Пакет h2 не установлен, HTTP/2 отключён (pip install httpx[http2])")
+        return False
+
+
+def _client_options() -> dict:
+    return {
+        "timeout": httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        "http2": _http2_available(),
+    }
+
+
+def _count_sync(request):
+    _requests_sent["sync"] += 1
+
+
+async def _count_async(request):
+    _requests_sent["async"] += 1
+
+
+def get_client() -> httpx.Client:
+    """
+    Возвращает общий синхронный httpx.Client с пулом соединений и keep-alive.
+    Клиент создаётся один раз на процесс.
+    """
+    global _sync_client
+    with _lock:
+        if _sync_client is None or _sync_client.is_closed:
+            options = _client_options()
+            _sync_client = httpx.Client(event_hooks={"request": [_count_sync]}, **options)
+            logger.info("Создан HTTP клиент: http2=%s, max_connections=%s", options['http2'], HTTP_MAX_CONNECTIONS)
+        return _sync_client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Возвращает общий httpx.AsyncClient для текущего event loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            options = _client_options()
+            client = httpx.AsyncClient(event_hooks={"request": [_count_async]}, **options)
+            _async_clients[loop] = client
+            logger.info("Создан асинхронный HTTP клиент: http2=%s", options['http2'])
+        return client
+
+
+def _pool_connections(client):
+    # httpx не даёт публичного доступа к пулу, берём его у транспорта httpcore
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", []) or [])
+
+
+def _describe_pool(client, requests_sent: int) -> dict:
+    connections = _pool_connections(client)
+    return {
+        "requests_sent": requests_sent,
+        "connections": len(connections),
+        "idle": sum(1 for c in connections if c.is_idle()),
+        "active": sum(1 for c in connections if not c.is_idle() and not c.is_closed()),
+        "http2": sum(1 for c in connections if "HTTP/2" in c.info()),
+    }
+
+
+def pool_stats() -> dict:
+    """
+    Статистика пулов соединений: число запросов и соединений (всего/простаивающих/активных).
+    """
+    stats = {"settings": {
+        "http2": HTTP2_ENABLED,
+        "max_connections": HTTP_MAX_CONNECTIONS,
+        "max_keepalive": HTTP_MAX_KEEPALIVE,
+        "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+        "timeout": HTTP_TIMEOUT,
+    }}
+    if _sync_client is not None and not _sync_client.is_closed:
+        stats["sync"] = _describe_pool(_sync_client, _requests_sent["sync"])
+    async_clients = [c for c in list(_async_clients.values()) if not c.is_closed]
+    if async_clients:
+        pools = [_describe_pool(c, 0) for c in async_clients]
+        stats["async"] = {
+            "clients": len(async_clients),
+            "requests_sent": _requests_sent["async"],
+            "connections": sum(p["connections"] for p in pools),
+            "idle": sum(p["idle"] for p in pools),
+            "active": sum(p["active"] for p in pools),
+        }
+    return stats
+
+
+def close_clients():
+    """
+    Закрывает синхронный клиент (асинхронные закрываются вместе со своими циклами).
+    """
+    global _sync_client
+    with _lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
+
+
+async def aclose_async_client():
+    """
+    Закрывает асинхронный клиент текущего event loop.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
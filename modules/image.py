@@ -1,28 +1,157 @@
+import io
+import os
+import time
 import logging
+import numpy as np
 from PIL import Image
-import streamlit as st
 
 logger = logging.getLogger(__name__)
 
+# Параметры подготовки изображения перед отправкой в vision-модель
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2048"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+# Предел пикселей снимка для хранилища (проверяется по заголовку, до декодирования).
+# Глобальный Image.MAX_IMAGE_PIXELS Pillow не меняем: он действует и для OCR и PDF;
+# файлы больше 2 × MAX_IMAGE_PIXELS Pillow отклоняет сам ещё при открытии.
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(150_000_000)))
+
+MEDIA_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
 def process_image(uploaded_file):
     """
-    Обрабатывает медицинское изображение.
+    Обрабатывает медицинское изображение: формат, размер и режим читаются
+    из заголовка файла, пиксели не декодируются.
     """
     try:
-        logger.info(f"Обработка изображения: {uploaded_file.name}")
-        
-        image = Image.open(uploaded_file)
-        
-        image_data = {
-            'filename': uploaded_file.name,
-            'format': image.format,
-            'size': image.size,
-            'mode': image.mode
-        }
-        
-        logger.info(f"Изображение обработано: {image_data['size']}")
+        logger.info("Обработка изображения: %s", uploaded_file.name)
+
+        uploaded_file.seek(0)
+        with Image.open(uploaded_file) as image:
+            image_data = {
+                'filename': uploaded_file.name,
+                'format': image.format,
+                'size': image.size,
+                'mode': image.mode
+            }
+        uploaded_file.seek(0)
+
+        logger.info("Изображение обработано: %s", image_data['size'])
         return image_data
-    
+
     except Exception as e:
-        logger.error(f"Ошибка при обработке изображения: {str(e)}", exc_info=True)
+        logger.error("Ошибка при обработке изображения: %s", e, exc_info=True)
         raise
+
+
+def preprocess_params(max_edge: int = IMAGE_MAX_EDGE, fmt: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> dict:
+    """
+    Параметры подготовки (входят в ключ кэша ответов).
+    """
+    return {"max_edge": max_edge, "format": fmt, "quality": quality}
+
+
+def apply_window(pixels: np.ndarray, low: float, high: float) -> np.ndarray:
+    """
+    Окно яркости: значения [low, high] линейно в 0..255 (uint8), вне окна — насыщение.
+    """
+    if pixels.dtype == np.uint8 and low <= 0 and high >= 255:
+        return pixels
+    scale = 255.0 / (high - low) if high > low else 0.0
+    out = np.subtract(pixels, low, dtype=np.float32)
+    out *= scale
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+
+def _normalize_mode(image: Image.Image) -> Image.Image:
+    # 16-битные и float снимки (DICOM-экспорт, рентген) растягиваем в 8 бит по диапазону
+    if image.mode in ("I", "I;16", "I;16B", "I;16L", "F"):
+        pixels = np.asarray(image)
+        return Image.fromarray(apply_window(pixels, float(pixels.min()), float(pixels.max())), "L")
+    if image.mode in ("L", "RGB"):
+        return image
+    if image.mode == "1":
+        return image.convert("L")
+    if "A" in image.getbands() or image.info.get("transparency") is not None:
+        # Прозрачность накладываем на белый фон
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _reduce(image: Image.Image, factor: int) -> Image.Image:
+    # reduce() не поддерживает I;16: берём каждый factor-й пиксель (дальше всё равно LANCZOS)
+    if image.mode.startswith("I;16"):
+        return Image.fromarray(np.ascontiguousarray(np.asarray(image)[::factor, ::factor]))
+    if image.mode in ("P", "1"):
+        image = image.convert("RGBA" if image.mode == "P" else "L")
+    return image.reduce(factor)
+
+
+def load_preview(image_bytes: bytes, max_edge: int) -> Image.Image:
+    """
+    Уменьшенная копия до max_edge по длинной стороне в режиме L/RGB без полноразмерных
+    промежуточных копий: JPEG декодируется сразу в масштабе 1/2–1/8 (draft), остальные
+    форматы сначала уменьшаются целочисленным reduce(), затем окно яркости и LANCZOS.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        if image.format == "JPEG" and max(image.size) > max_edge:
+            image.draft(image.mode, (max_edge, max_edge))
+        image.load()
+        preview = image
+        factor = max(image.size) // (2 * max_edge)
+        if factor > 1:
+            preview = _reduce(image, factor)
+        preview = _normalize_mode(preview)
+        if max(preview.size) > max_edge:
+            preview.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        return preview.copy() if preview is image else preview
+
+
+def encode_image(image: Image.Image, fmt: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> bytes:
+    """
+    Кодирует L/RGB изображение в fmt без метаданных (EXIF, ICC, текст).
+    """
+    out = io.BytesIO()
+    # Метаданные не копируются: в save не передаём exif/icc_profile/pnginfo
+    if fmt == "PNG":
+        image.save(out, "PNG", optimize=True)
+    else:
+        image.save(out, fmt, quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def preprocess_image(image_bytes: bytes, max_edge: int = IMAGE_MAX_EDGE, fmt: str = IMAGE_FORMAT,
+                     quality: int = IMAGE_QUALITY) -> dict:
+    """
+    Готовит изображение к base64: уменьшает до max_edge по длинной стороне,
+    приводит режим к L/RGB, перекодирует в fmt с качеством quality без метаданных (EXIF, ICC, текст).
+
+    Возвращает {"data", "media_type", "size", "original_size", "original_bytes",
+    "bytes", "bytes_saved", "elapsed_ms"}.
+    """
+    started = time.perf_counter()
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        original_size = image.size
+    prepared = load_preview(image_bytes, max_edge)
+    data = encode_image(prepared, fmt, quality)
+    result = {
+        "data": data,
+        "media_type": MEDIA_TYPES.get(fmt, f"image/{fmt.lower()}"),
+        "size": prepared.size,
+        "original_size": original_size,
+        "original_bytes": len(image_bytes),
+        "bytes": len(data),
+        "bytes_saved": len(image_bytes) - len(data),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info(
+        "Изображение подготовлено: %s -> %s, %s -> %s байт за %s мс",
+        original_size, prepared.size, len(image_bytes), len(data), result['elapsed_ms']
+    )
+    return result
@@ -1,20 +1,85 @@
-import os
+import json
 import logging
 import httpx
 import base64
-from dotenv import load_dotenv
-
-load_dotenv()
+import hashlib
+from modules.config import OPENROUTER_API_KEY, OPENROUTER_URL
+from modules.http_client import get_client
+from modules.cache import get_response_cache, make_key
+from modules.image import preprocess_image, preprocess_params
+from modules.image_store import get_image_store, prepare_region
+from modules.metrics import span
+from modules.prompts import IMAGE_INSTRUCTIONS, supports_cache_control, text_part, cached_tokens
+from modules.scheduler import get_scheduler, RetryableError, RETRYABLE_STATUS, parse_retry_after, INTERACTIVE
 
 logger = logging.getLogger(__name__)
 
-# Конфиг OpenRouter
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_URL = "https://openrouter.io/api/v1/chat/completions"
+VISION_MODEL = "meta-llama/llama-3.2-90b-vision-instruct"
+
+REGION_NOTE = """На изображении — фрагмент снимка: область x {left}–{right}, y {top}–{bottom} из {width}×{height} пикселей
+в полном разрешении. Опиши находки в пределах этой области."""
+
 
-def analyze_image_with_openrouter(file):
+def analyze_image_with_openrouter(file, use_cache: bool = True, priority: int = INTERACTIVE,
+                                  region: tuple = None, window: tuple = None):
     """
     Анализирует медицинское изображение через OpenRouter API с Claude Vision.
+    Перед отправкой изображение уменьшается и перекодируется (modules.image.preprocess_image).
+    region=(left, top, right, bottom) в пикселях снимка — отправляется только эта область
+    в полном разрешении (до IMAGE_MAX_EDGE), window=(low, high) — окно яркости для неё.
+    Ответы кэшируются по хэшу изображения (и области), параметрам подготовки, тексту
+    запроса и параметрам модели; use_cache=False — запрос в обход кэша.
+    Запрос идёт через общий планировщик LLM (лимиты, повторы при 429/5xx).
+    """
+    if region is not None:
+        return analyze_image_region(get_image_store().get_or_create(file), region, window, use_cache, priority)
+    with span("llm.vision") as s:
+        file.seek(0)
+        image_data = file.read()
+        result = _analyze_image(
+            file.name, hashlib.sha256(image_data).hexdigest(), lambda: preprocess_image(image_data),
+            None, use_cache, priority
+        )
+        _record_usage(s, result)
+    return result
+
+
+def analyze_image_region(record, region: tuple, window: tuple = None, use_cache: bool = True,
+                         priority: int = INTERACTIVE):
+    """
+    Анализ области снимка из modules.image_store: пиксели читаются с уровня пирамиды,
+    достаточного для IMAGE_MAX_EDGE, без декодирования всего кадра.
+    """
+    box = record.clip_box(region)
+    width, height = record.size
+    note = REGION_NOTE.format(left=box[0], top=box[1], right=box[2], bottom=box[3],
+                                               width=width, height=height)
+    image_key = f"{record.meta['sha256']}:{box}:{window}"
+    with span("llm.vision") as s:
+        result = _analyze_image(
+            f"{record.meta['source_name']} {box}", image_key,
+            lambda: prepare_region(record, box, window), note, use_cache, priority
+        )
+        _record_usage(s, result)
+    return result
+
+
+def _record_usage(s, result: dict):
+    usage = result.get("usage") or {}
+    s.set(
+        cache_hit=bool(result.get("cached")),
+        failed=not result.get("success"),
+        prompt_tokens=usage.get("prompt_tokens") or 0,
+        cached_tokens=cached_tokens(usage),
+        completion_tokens=usage.get("completion_tokens") or 0,
+    )
+
+
+def _analyze_image(name: str, image_key: str, prepare, note: str, use_cache: bool, priority: int):
+    """
+    Запрос к vision-модели: prepare() готовит изображение (dict как у preprocess_image),
+    image_key — его идентификатор в ключе кэша, note — текст после изображения.
+    Порядок блоков: инструкции (общий для всех запросов префикс), изображение, note.
     """
     try:
         if not OPENROUTER_API_KEY:
@@ -24,23 +89,31 @@ def analyze_image_with_openrouter(file):
                 "status_code": 400
             }
         
-        # Читаем файл и конвертируем в base64
-        file.seek(0)
-        image_data = file.read()
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
+        cache_key = make_key(
+            image_key, preprocess_params(), IMAGE_INSTRUCTIONS.id, note or "",
+            VISION_MODEL, {"temperature": 0.1, "max_tokens": 1000}
+        )
+        cache = get_response_cache()
+        if use_cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                logger.info("Анализ изображения %s взят из кэша", name)
+                return {
+                    "success": True,
+                    "analysis": cached["analysis"],
+                    "usage": cached.get("usage", {}),
+                    "status_code": 200,
+                    "cached": True
+                }
         
-        # Определяем тип медиа
-        filename = file.name.lower()
-        if filename.endswith('.png'):
-            media_type = "image/png"
-        elif filename.endswith(('.jpg', '.jpeg')):
-            media_type = "image/jpeg"
-        elif filename.endswith('.bmp'):
-            media_type = "image/bmp"
-        else:
-            media_type = "image/jpeg"  # по умолчанию
+        with span("image.preprocess") as sp:
+            prepared = prepare()
+            sp.set(bytes=prepared["original_bytes"], bytes_saved=prepared["bytes_saved"])
+        image_base64 = base64.b64encode(prepared["data"]).decode('utf-8')
+        media_type = prepared["media_type"]
+        preprocessing = {k: v for k, v in prepared.items() if k != "data"}
         
-        logger.info(f"Анализ изображения: {file.name}")
+        logger.info("Анализ изображения: %s", name)
         
         headers = {
             "Authorization": f"Bearer {OPENROUTER_API_KEY}",
@@ -49,41 +122,48 @@ def analyze_image_with_openrouter(file):
             "X-Title": "MedAssistant"
         }
         
-        payload = {
-            "model": "meta-llama/llama-3.2-90b-vision-instruct",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": image_base64
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": """Проанализируй медицинское изображение (рентген, УЗИ, КТ, МРТ).
-                            
-Предоставь:
-1. Описание видимых структур и патологических изменений
-2. Предварительные выводы и диагностические возможности
-3. Рекомендации по дополнительным исследованиям
-4. Ссылки на медицинские стандарты (если применимо)
-
-Формат: структурированный отчёт."""
-                        }
-                    ]
+        content = [
+            text_part(IMAGE_INSTRUCTIONS.text, cache=supports_cache_control(VISION_MODEL)),
+            {
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": media_type,
+                    "data": image_base64
                 }
-            ],
+            },
+        ]
+        if note:
+            content.append(text_part(note))
+        payload = {
+            "model": VISION_MODEL,
+            "messages": [{"role": "user", "content": content}],
             "temperature": 0.1,
-            "max_tokens": 1000
+            "max_tokens": 1000,
+            "usage": {"include": True}
         }
         
-        with httpx.Client(timeout=60.0) as client:
-            response = client.post(OPENROUTER_URL, json=payload, headers=headers)
+        client = get_client()
+        # Тело с base64 сериализуется один раз, а не при каждом повторе
+        with span("llm.serialize") as sp:
+            body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            sp.set(request_bytes=len(body))
+        
+        def send():
+            with span("llm.http"):
+                response = client.post(OPENROUTER_URL, content=body, headers=headers)
+            if response.status_code in RETRYABLE_STATUS:
+                raise RetryableError(response.status_code, response.text,
+                                     parse_retry_after(response.headers.get("Retry-After")))
+            return response, (response.json().get("usage") if response.status_code == 200 else None)
+        
+        # Изображение считаем примерно как 1000 токенов промпта
+        try:
+            response = get_scheduler().run(send, priority=priority, tokens=1000 + payload["max_tokens"])
+        except RetryableError as e:
+            error_msg = f"HTTP {e.status_code}: {e.body}"
+            logger.error("HTTP %s: %.500s", e.status_code, e.body)
+            return {"error": error_msg, "status_code": e.status_code, "success": False}
         
         if response.status_code == 200:
             data = response.json()
@@ -91,13 +171,17 @@ def analyze_image_with_openrouter(file):
                 "success": True,
                 "analysis": data.get("choices", [{}])[0].get("message", {}).get("content", ""),
                 "usage": data.get("usage", {}),
-                "status_code": 200
+                "status_code": 200,
+                "cached": False,
+                "preprocessing": preprocessing,
+                "prompt_version": IMAGE_INSTRUCTIONS.id
             }
+            cache.set(cache_key, {"analysis": analysis["analysis"], "usage": analysis["usage"]})
             logger.info("Анализ изображения успешно завершён")
             return analysis
         else:
             error_msg = f"HTTP {response.status_code}: {response.text}"
-            logger.error(error_msg)
+            logger.error("HTTP %s: %.500s", response.status_code, response.text)
             return {
                 "error": error_msg,
                 "status_code": response.status_code,
@@ -105,14 +189,12 @@ def analyze_image_with_openrouter(file):
             }
     
     except httpx.TimeoutException:
-        error_msg = "Timeout: анализ изображения занял слишком много времени"
-        logger.error(error_msg)
-        return {"error": error_msg, "status_code": 504, "success": False}
+        logger.error("Timeout: анализ изображения %s занял слишком много времени", name)
+        return {"error": "Timeout: анализ изображения занял слишком много времени", "status_code": 504, "success": False}
     
     except Exception as e:
-        error_msg = f"Ошибка при анализе изображения: {str(e)}"
-        logger.error(error_msg, exc_info=True)
-        return {"error": error_msg, "status_code": 500, "success": False}
+        logger.error("Ошибка при анализе изображения %s: %s", name, e, exc_info=True)
+        return {"error": f"Ошибка при анализе изображения: {str(e)}", "status_code": 500, "success": False}
 
 
 # Для обратной совместимости
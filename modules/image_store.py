@@ -0,0 +1,403 @@
+"""
+Хранилище больших снимков для просмотра и анализа по областям.
+
+При загрузке сохраняется только исходный файл и заголовок (без декодирования).
+При первом обращении к пикселям снимок один раз декодируется в пирамиду уровней
+(уровень 0 — полное разрешение, каждый следующий вдвое меньше) в исходной
+разрядности, отображённую в память: область интереса и плитки читаются срезом
+нужного уровня без повторного декодирования и без копии кадра в памяти сессии.
+Превью до декодирования — через load_preview (draft для JPEG).
+"""
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+import numpy as np
+from PIL import Image
+
+from modules.cache import CACHE_DIR, file_sha256
+from modules.image import (
+    IMAGE_MAX_EDGE, IMAGE_MAX_PIXELS, IMAGE_FORMAT, IMAGE_QUALITY, MEDIA_TYPES, apply_window, encode_image, load_preview, _normalize_mode
+)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(CACHE_DIR, "images"))
+IMAGE_STORE_MAX_MB = float(os.getenv("IMAGE_STORE_MAX_MB", "4096"))
+# Сторона плитки и наименьший уровень пирамиды, пиксели
+TILE_SIZE = 512
+PYRAMID_MIN_EDGE = 256
+# Строк за один шаг при записи и уменьшении уровней
+STRIP_ROWS = 1024
+
+SOURCE_FILE = "source.bin"
+META_FILE = "meta.json"
+
+
+def _level_file(level: int) -> str:
+    return f"level{level}.raw"
+
+
+def _downsample(src: np.ndarray, dst: np.ndarray):
+    """
+    Уровень вдвое меньше: среднее блоков 2×2, полосами по STRIP_ROWS строк.
+    """
+    height, width = dst.shape[:2]
+    for top in range(0, height, STRIP_ROWS // 2):
+        rows = min(STRIP_ROWS // 2, height - top)
+        block = np.asarray(src[2 * top:2 * (top + rows), :2 * width], dtype=np.float32)
+        block = block.reshape(rows, 2, width, 2, *src.shape[2:]).mean(axis=(1, 3))
+        if np.issubdtype(dst.dtype, np.integer):
+            block = np.rint(block)
+        dst[top:top + rows] = block.astype(dst.dtype)
+
+
+class ImageRecord:
+    """
+    Снимок в хранилище: исходный файл, метаданные и (после первого обращения к
+    пикселям) пирамида уровней в памяти только для чтения.
+    """
+
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        self._levels = None
+        self._lock = threading.Lock()
+        # Отдельная блокировка: _lock занят на всё время декодирования
+        self._decoder_lock = threading.Lock()
+        self._decoder = None
+        self.decode_error = None
+
+    @property
+    def size(self) -> tuple:
+        return tuple(self.meta["size"])
+
+    @property
+    def decoded(self) -> bool:
+        return "levels" in self.meta
+
+    @property
+    def decoding(self) -> bool:
+        decoder = self._decoder
+        return decoder is not None and decoder.is_alive()
+
+    def source_bytes(self) -> bytes:
+        with open(os.path.join(self.path, SOURCE_FILE), "rb") as f:
+            return f.read()
+
+    def preview(self, max_edge: int = 512) -> Image.Image:
+        """
+        Превью L/RGB: из пирамиды, если снимок уже декодирован, иначе из исходного
+        файла с уменьшением при декодировании; сохраняется рядом со снимком.
+        """
+        path = os.path.join(self.path, f"preview{max_edge}.png")
+        if os.path.exists(path):
+            with Image.open(path) as image:
+                return image.copy()
+        if self.decoded:
+            preview = self.region((0, 0, *self.size), max_edge=max_edge)
+        else:
+            preview = load_preview(self.source_bytes(), max_edge)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        preview.save(tmp_path, "PNG")
+        os.replace(tmp_path, path)
+        return preview
+
+    # ---------- пирамида ----------
+
+    def levels(self) -> list:
+        """
+        Уровни пирамиды (массивы высота × ширина [× каналы]); декодирует снимок при первом вызове.
+        """
+        if self._levels is None:
+            with self._lock:
+                if self._levels is None:
+                    if not self.decoded:
+                        self._decode()
+                    dtype = np.dtype(self.meta["dtype"])
+                    self._levels = [
+                        np.memmap(os.path.join(self.path, _level_file(i)), dtype=dtype, mode="r",
+                                  shape=tuple(shape))
+                        for i, shape in enumerate(self.meta["levels"])
+                    ]
+        return self._levels
+
+    def decode_in_background(self) -> bool:
+        """
+        Запускает декодирование пирамиды в фоновом потоке, чтобы не держать поток
+        интерфейса. True — уровни уже на диске и levels() вернётся сразу.
+        """
+        if self.decoded:
+            return True
+        with self._decoder_lock:
+            if not self.decoded and not self.decoding:
+                self.decode_error = None
+                self._decoder = threading.Thread(target=self._decode_quietly, daemon=True,
+                                                 name=f"image-decode-{self.meta['sha256'][:8]}")
+                self._decoder.start()
+        return self.decoded
+
+    def _decode_quietly(self):
+        try:
+            self.levels()
+        except Exception as e:
+            logger.error("Не удалось декодировать снимок %s: %s", self.meta["sha256"][:12], e, exc_info=True)
+            self.decode_error = str(e)
+
+    def _decode(self):
+        started = time.perf_counter()
+        with Image.open(io.BytesIO(self.source_bytes())) as image:
+            image.load()
+            if not image.mode.startswith("I") and image.mode not in ("F", "L", "RGB"):
+                image = _normalize_mode(image)
+            width, height = image.size
+            first = np.asarray(image.crop((0, 0, width, 1)))
+            shape = (height, width, *first.shape[2:])
+            tmp_files = []
+            level0 = self._new_level(0, shape, first.dtype, tmp_files)
+            for top in range(0, height, STRIP_ROWS):
+                bottom = min(top + STRIP_ROWS, height)
+                level0[top:bottom] = np.asarray(image.crop((0, top, width, bottom)))
+        # Полный кадр в памяти больше не нужен: дальше только уровни на диске
+        levels = [level0]
+        src = dst = None
+        while max(levels[-1].shape[:2]) > PYRAMID_MIN_EDGE and min(levels[-1].shape[:2]) >= 2:
+            src = levels[-1]
+            dst = self._new_level(len(levels), (src.shape[0] // 2, src.shape[1] // 2, *src.shape[2:]),
+                                  src.dtype, tmp_files)
+            _downsample(src, dst)
+            levels.append(dst)
+        for level in levels:
+            level.flush()
+
+        window = self._default_window(levels)
+        meta = {**self.meta, "dtype": str(level0.dtype), "levels": [list(level.shape) for level in levels],
+                "window": window}
+        # Отображения временных файлов закрываются до переименования
+        levels = level0 = src = dst = None
+        for tmp_path, final_path in tmp_files:
+            os.replace(tmp_path, final_path)
+        tmp_meta = os.path.join(self.path, f"{META_FILE}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta, os.path.join(self.path, META_FILE))
+        self.meta = meta
+        logger.info("Снимок %s декодирован в пирамиду за %.2f с: %s уровней",
+                    meta["sha256"][:12], time.perf_counter() - started, len(meta["levels"]))
+
+    def _new_level(self, level: int, shape: tuple, dtype, tmp_files: list) -> np.memmap:
+        final_path = os.path.join(self.path, _level_file(level))
+        tmp_path = f"{final_path}.{uuid.uuid4().hex}.tmp"
+        tmp_files.append((tmp_path, final_path))
+        return np.memmap(tmp_path, dtype=dtype, mode="w+", shape=shape)
+
+    @staticmethod
+    def _default_window(levels: list) -> list:
+        # Окно по перцентилям 0.5–99.5 самого подробного уровня не больше 1 Мпикс
+        sample = next((level for level in levels if level.shape[0] * level.shape[1] <= 1_000_000), levels[-1])
+        if sample.dtype == np.uint8:
+            return [0, 255]
+        low, high = np.percentile(np.asarray(sample), [0.5, 99.5])
+        return [float(low), float(high)]
+
+    # ---------- доступ к пикселям ----------
+
+    def clip_box(self, box) -> tuple:
+        """
+        Область (left, top, right, bottom) в пикселях полного разрешения, обрезанная по кадру.
+        """
+        width, height = self.size
+        left, top, right, bottom = (int(round(v)) for v in box)
+        left, right = sorted((min(max(left, 0), width), min(max(right, 0), width)))
+        top, bottom = sorted((min(max(top, 0), height), min(max(bottom, 0), height)))
+        left, top = min(left, width - 1), min(top, height - 1)
+        return left, top, max(right, left + 1), max(bottom, top + 1)
+
+    def pixels(self, box, max_edge: int = None):
+        """
+        Пиксели области в исходной разрядности с самого грубого уровня, на котором
+        длинная сторона области не меньше max_edge (None — полное разрешение).
+        Возвращает (массив, номер уровня).
+        """
+        left, top, right, bottom = self.clip_box(box)
+        levels = self.levels()
+        level = 0
+        if max_edge:
+            while level + 1 < len(levels) and max(right - left, bottom - top) >> (level + 1) >= max_edge:
+                level += 1
+        scale = 2 ** level
+        return levels[level][top // scale:max(bottom // scale, top // scale + 1),
+                             left // scale:max(right // scale, left // scale + 1)], level
+
+    def tile(self, level: int, column: int, row: int) -> np.ndarray:
+        """
+        Плитка TILE_SIZE × TILE_SIZE уровня (у краёв меньше).
+        """
+        return self.levels()[level][row * TILE_SIZE:(row + 1) * TILE_SIZE,
+                                    column * TILE_SIZE:(column + 1) * TILE_SIZE]
+
+    def region(self, box, max_edge: int = IMAGE_MAX_EDGE, window=None) -> Image.Image:
+        """
+        Область как изображение L/RGB не больше max_edge по длинной стороне.
+        window=(low, high) — окно яркости; по умолчанию — окно снимка (перцентили).
+        """
+        pixels, _ = self.pixels(box, max_edge)
+        low, high = window or self.meta["window"]
+        image = Image.fromarray(np.ascontiguousarray(apply_window(pixels, low, high)))
+        if max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        return image
+
+
+def prepare_region(record: ImageRecord, box, window=None, max_edge: int = IMAGE_MAX_EDGE,
+                   fmt: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> dict:
+    """
+    Область снимка для vision-модели; результат в формате preprocess_image
+    (original_bytes — объём области в исходной разрядности).
+    """
+    started = time.perf_counter()
+    left, top, right, bottom = record.clip_box(box)
+    image = record.region((left, top, right, bottom), max_edge, window)
+    data = encode_image(image, fmt, quality)
+    levels = record.levels()
+    original_bytes = (right - left) * (bottom - top) * levels[0].itemsize * (levels[0].shape[2] if levels[0].ndim == 3 else 1)
+    result = {
+        "data": data,
+        "media_type": MEDIA_TYPES.get(fmt, f"image/{fmt.lower()}"),
+        "size": image.size,
+        "original_size": (right - left, bottom - top),
+        "original_bytes": original_bytes,
+        "bytes": len(data),
+        "bytes_saved": original_bytes - len(data),
+        "region": (left, top, right, bottom),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info("Область %s снимка %s подготовлена: %s байт за %s мс",
+                result["region"], record.meta["sha256"][:12], len(data), result["elapsed_ms"])
+    return result
+
+
+class ImageStore:
+    """
+    Каталог снимков, адресуемых по sha256 исходного файла; размер ограничен max_bytes
+    (вытесняются давно не использованные).
+    """
+
+    def __init__(self, directory: str = IMAGE_STORE_DIR, max_bytes: int = int(IMAGE_STORE_MAX_MB * 1024 * 1024)):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._records = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, content_hash: str):
+        path = os.path.join(self.directory, content_hash)
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        # Время доступа для LRU храним в mtime файла метаданных
+        os.utime(meta_path)
+        with self._lock:
+            # Один объект на снимок: пирамида декодируется один раз на процесс
+            record = self._records.get(content_hash)
+            if record is None:
+                with open(meta_path, encoding="utf-8") as f:
+                    record = self._records[content_hash] = ImageRecord(path, json.load(f))
+            return record
+
+    def get_or_create(self, uploaded_file) -> ImageRecord:
+        """
+        Запись снимка; при первом обращении сохраняет исходный файл и заголовок.
+        """
+        content_hash = file_sha256(uploaded_file)
+        record = self.get(content_hash)
+        if record is not None:
+            return record
+
+        final_path = os.path.join(self.directory, content_hash)
+        tmp_path = os.path.join(self.directory, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+        try:
+            uploaded_file.seek(0)
+            with open(os.path.join(tmp_path, SOURCE_FILE), "wb") as f:
+                shutil.copyfileobj(uploaded_file, f, 16 * 1024 * 1024)
+            uploaded_file.seek(0)
+            with Image.open(uploaded_file) as image:
+                width, height = image.size
+                if width * height > IMAGE_MAX_PIXELS:
+                    raise ValueError(
+                        f"Снимок {width}×{height} больше допустимых {IMAGE_MAX_PIXELS} пикселей (IMAGE_MAX_PIXELS)"
+                    )
+                meta = {
+                    "sha256": content_hash,
+                    "source_name": getattr(uploaded_file, "name", ""),
+                    "format": image.format,
+                    "mode": image.mode,
+                    "size": list(image.size),
+                    "created": time.time(),
+                }
+            uploaded_file.seek(0)
+            with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            with self._lock:
+                if os.path.exists(final_path):
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                else:
+                    os.rename(tmp_path, final_path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self.evict(keep=content_hash)
+        return self.get(content_hash)
+
+    def _entries(self) -> list:
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            meta_path = os.path.join(path, META_FILE)
+            if name.startswith(".") or not os.path.exists(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(meta_path), name, size))
+        return sorted(entries)
+
+    def evict(self, keep: str = None):
+        """
+        Удаляет давно не использованные снимки, пока размер хранилища больше max_bytes.
+        """
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, _, size in entries)
+            for _, name, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                self._records.pop(name, None)
+                total -= size
+                logger.info("Снимок %s вытеснен из хранилища", name[:12])
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "images": len(entries),
+            "bytes": sum(size for _, _, size in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_image_store() -> ImageStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore()
+        return _store
@@ -54,5 +54,5 @@ def detect_intent(task_description: str, filename: str) -> str:
         logger.info("Intent: Document (по расширению)")
         return 'document'
     
-    logger.warning(f"Intent не определён для файла: {filename}")
+    logger.warning("Intent не определён для файла: %s", filename)
     return 'unknown'
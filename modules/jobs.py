@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.cache import CACHE_DIR
+from modules.logging_config import correlation_id
+
+logger = logging.getLogger(__name__)
+
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "4"))
+# Пустое значение — задачи только в памяти процесса
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+JOBS_TTL_HOURS = float(os.getenv("JOBS_TTL_HOURS", "24"))
+# Как часто удалять устаревшие задачи (проверяется при постановке новой)
+JOBS_CLEANUP_INTERVAL = float(os.getenv("JOBS_CLEANUP_INTERVAL", "300"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "error"
+ACTIVE = (QUEUED, RUNNING)
+
+
+class Job:
+    """
+    Задача в очереди. Функция задачи получает её первым аргументом и может сообщать
+    этап (set_progress) и передавать потоковый текст (append_text).
+    """
+
+    def __init__(self, job_id: str, kind: str, meta: dict = None):
+        self.id = job_id
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = QUEUED
+        self.progress = ""
+        self.text = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def set_progress(self, message: str):
+        self.progress = message
+
+    def append_text(self, token: str):
+        self.text.append(token)
+
+    def snapshot(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "meta": self.meta,
+            "status": self.status,
+            "progress": self.progress,
+            "text": "".join(self.text),
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "wait_s": round((self.started or time.time()) - self.created, 3),
+            "run_s": round((self.finished or time.time()) - self.started, 3) if self.started else None,
+        }
+
+
+class JobQueue:
+    """
+    Пул потоков для фоновых анализов. Состояние задач хранится в памяти и, если задан
+    db_path, в SQLite: результаты доступны после перезапуска скрипта, переподключения
+    браузера и перезапуска сервера.
+    """
+
+    def __init__(self, max_workers: int = JOBS_MAX_WORKERS, db_path: str = JOBS_DB, ttl_hours: float = JOBS_TTL_HOURS):
+        self.max_workers = max_workers
+        self.ttl = ttl_hours * 3600
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._db = None
+        self._cleaned = 0.0
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, data TEXT NOT NULL, "
+                "created REAL NOT NULL, finished REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created)")
+            # Задачи, не завершённые до перезапуска, выполнить уже нельзя: входные файлы были в памяти
+            self._db.execute(
+                "UPDATE jobs SET status = ?, data = json_set(data, '$.status', ?, '$.error', ?) WHERE status IN (?, ?)",
+                (FAILED, FAILED, "Задача прервана перезапуском сервера", QUEUED, RUNNING)
+            )
+            self._db.commit()
+        self.cleanup()
+
+    def _save(self, job: Job):
+        if self._db is None:
+            return
+        snapshot = job.snapshot()
+        data = json.dumps(snapshot, ensure_ascii=False, default=str)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO jobs (id, kind, status, data, created, finished) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.status, data, job.created, job.finished)
+            )
+            self._db.commit()
+
+    def submit(self, fn, *args, kind: str = "analysis", meta: dict = None, **kwargs) -> str:
+        """
+        Ставит fn(job, *args, **kwargs) в очередь и сразу возвращает ID задачи.
+        """
+        if time.time() - self._cleaned > JOBS_CLEANUP_INTERVAL:
+            self.cleanup()
+        job = Job(uuid.uuid4().hex, kind, meta)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._save(job)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        logger.info("Задача %s (%s) поставлена в очередь", job.id[:8], kind)
+        return job.id
+
+    def _run(self, job: Job, fn, args, kwargs):
+        job.status = RUNNING
+        job.started = time.time()
+        self._save(job)
+        # Все записи журнала этой задачи помечаются её ID
+        with correlation_id(job.id[:8]):
+            try:
+                job.result = fn(job, *args, **kwargs)
+                job.status = DONE
+            except Exception as e:
+                logger.error("Задача %s завершилась ошибкой: %s", job.id[:8], e, exc_info=True)
+                job.error = str(e)
+                job.status = FAILED
+            job.finished = time.time()
+            self._save(job)
+            if self._db is not None:
+                # Завершённая задача уже в SQLite: get() прочитает её оттуда, память не растёт
+                with self._lock:
+                    self._jobs.pop(job.id, None)
+            logger.info("Задача %s: %s за %.2f с", job.id[:8], job.status, job.finished - job.started)
+
+    def get(self, job_id: str) -> dict:
+        """
+        Состояние задачи (из памяти или SQLite) или None, если задача неизвестна.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        if self._db is None or not job_id:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cleanup(self):
+        """
+        Удаляет завершённые задачи старше ttl.
+        """
+        self._cleaned = time.time()
+        cutoff = self._cleaned - self.ttl
+        with self._lock:
+            for job_id in [i for i, j in self._jobs.items() if j.finished and j.finished < cutoff]:
+                del self._jobs[job_id]
+            if self._db is not None:
+                self._db.execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (cutoff,))
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            counts = {status: statuses.count(status) for status in (QUEUED, RUNNING, DONE, FAILED)}
+            if self._db is not None:
+                # Завершённые задачи хранятся только в SQLite
+                for status, count in self._db.execute(
+                        "SELECT status, COUNT(*) FROM jobs WHERE status IN (?, ?) GROUP BY status", (DONE, FAILED)):
+                    counts[status] = count
+        return {
+            "workers": self.max_workers,
+            "queued": counts[QUEUED],
+            "running": counts[RUNNING],
+            "done": counts[DONE],
+            "error": counts[FAILED],
+            "in_memory": len(statuses),
+            "persistent": self._db is not None,
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,444 @@
+import re
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Коды флагов: порядок задаёт тяжесть при сортировке находок
+UNKNOWN, NORMAL, LOW, HIGH, CRITICAL_LOW, CRITICAL_HIGH = range(6)
+FLAG_LABELS = np.array(["unknown", "normal", "low", "high", "critical_low", "critical_high"])
+SEVERITY = np.array([0, 0, 1, 1, 2, 2], dtype=np.int8)
+
+# Сколько отклонений передавать в отчет (самые тяжёлые)
+MAX_FINDINGS = 40
+
+ANY, MALE, FEMALE = 0, 1, 2
+
+# Справочник показателей: синонимы (RU/EN), базовая единица, пересчёт единиц в базовую,
+# референсные интервалы (пол, возраст от, возраст до, нижняя, верхняя) и критические границы.
+# Интервалы — ориентировочные для взрослых, если не указано иное; первый подходящий выигрывает.
+ANALYTES = {
+    "HGB": {
+        "names": ("гемоглобин", "hgb", "hb", "hemoglobin", "haemoglobin"),
+        "unit": "г/л",
+        "units": {"g/l": 1.0, "g/dl": 10.0, "mmol/l": 16.11},
+        "ranges": [(ANY, 0, 12, 110, 140), (MALE, 12, 200, 130, 170), (FEMALE, 12, 200, 120, 150), (ANY, 12, 200, 120, 170)],
+        "critical": (70, 200),
+    },
+    "RBC": {
+        "names": ("эритроциты", "rbc", "red blood cells", "erythrocytes"),
+        "unit": "10^12/л",
+        "units": {"10^12/l": 1.0, "10^6/ul": 1.0, "млн/ul": 1.0},
+        "ranges": [(MALE, 12, 200, 4.3, 5.7), (FEMALE, 12, 200, 3.8, 5.1), (ANY, 0, 200, 3.8, 5.7)],
+        "critical": (None, None),
+    },
+    "HCT": {
+        "names": ("гематокрит", "hct", "hematocrit", "haematocrit"),
+        "unit": "%",
+        "units": {"%": 1.0, "l/l": 100.0},
+        "ranges": [(MALE, 12, 200, 39, 49), (FEMALE, 12, 200, 35, 45), (ANY, 0, 200, 35, 49)],
+        "critical": (20, 60),
+    },
+    "WBC": {
+        "names": ("лейкоциты", "wbc", "white blood cells", "leukocytes", "leucocytes"),
+        "unit": "10^9/л",
+        "units": {"10^9/l": 1.0, "10^3/ul": 1.0, "тыс/ul": 1.0, "/ul": 0.001},
+        "ranges": [(ANY, 0, 12, 4.5, 13.5), (ANY, 12, 200, 4.0, 9.0)],
+        "critical": (1.0, 30.0),
+    },
+    "PLT": {
+        "names": ("тромбоциты", "plt", "platelets", "thrombocytes"),
+        "unit": "10^9/л",
+        "units": {"10^9/l": 1.0, "10^3/ul": 1.0, "тыс/ul": 1.0, "/ul": 0.001},
+        "ranges": [(ANY, 0, 200, 150, 400)],
+        "critical": (20, 1000),
+    },
+    "ESR": {
+        "names": ("соэ", "скорость оседания эритроцитов", "esr", "erythrocyte sedimentation rate"),
+        "unit": "мм/ч",
+        "units": {"mm/h": 1.0, "mm/hr": 1.0},
+        "ranges": [(MALE, 0, 200, 2, 15), (FEMALE, 0, 200, 2, 20), (ANY, 0, 200, 2, 20)],
+        "critical": (None, None),
+    },
+    "GLU": {
+        "names": ("глюкоза", "глюкоза крови", "сахар крови", "glu", "glucose", "blood glucose"),
+        "unit": "ммоль/л",
+        "units": {"mmol/l": 1.0, "mg/dl": 0.0555},
+        "ranges": [(ANY, 0, 200, 3.9, 6.1)],
+        "critical": (2.5, 25.0),
+    },
+    "HBA1C": {
+        "names": ("гликированный гемоглобин", "hba1c", "a1c", "glycated hemoglobin"),
+        "unit": "%",
+        "units": {"%": 1.0},
+        "ranges": [(ANY, 0, 200, 4.0, 6.0)],
+        "critical": (None, None),
+    },
+    "CREA": {
+        "names": ("креатинин", "crea", "creatinine"),
+        "unit": "мкмоль/л",
+        "units": {"umol/l": 1.0, "mg/dl": 88.4},
+        "ranges": [(MALE, 18, 200, 62, 115), (FEMALE, 18, 200, 53, 97), (ANY, 0, 200, 27, 115)],
+        "critical": (None, 700),
+    },
+    "UREA": {
+        "names": ("мочевина", "urea", "bun", "blood urea nitrogen"),
+        "unit": "ммоль/л",
+        "units": {"mmol/l": 1.0, "mg/dl": 0.357},
+        "ranges": [(ANY, 0, 200, 2.5, 8.3)],
+        "critical": (None, 35.0),
+    },
+    "ALT": {
+        "names": ("алт", "аланинаминотрансфераза", "alt", "alat", "alanine aminotransferase", "sgpt"),
+        "unit": "Ед/л",
+        "units": {"u/l": 1.0, "iu/l": 1.0},
+        "ranges": [(MALE, 0, 200, 0, 41), (FEMALE, 0, 200, 0, 33), (ANY, 0, 200, 0, 41)],
+        "critical": (None, 1000),
+    },
+    "AST": {
+        "names": ("аст", "аспартатаминотрансфераза", "ast", "asat", "aspartate aminotransferase", "sgot"),
+        "unit": "Ед/л",
+        "units": {"u/l": 1.0, "iu/l": 1.0},
+        "ranges": [(MALE, 0, 200, 0, 40), (FEMALE, 0, 200, 0, 32), (ANY, 0, 200, 0, 40)],
+        "critical": (None, 1000),
+    },
+    "TBIL": {
+        "names": ("билирубин общий", "общий билирубин", "билирубин", "tbil", "total bilirubin", "bilirubin"),
+        "unit": "мкмоль/л",
+        "units": {"umol/l": 1.0, "mg/dl": 17.1},
+        "ranges": [(ANY, 0, 200, 3.4, 20.5)],
+        "critical": (None, 300),
+    },
+    "CHOL": {
+        "names": ("холестерин", "холестерин общий", "общий холестерин", "chol", "cholesterol", "total cholesterol"),
+        "unit": "ммоль/л",
+        "units": {"mmol/l": 1.0, "mg/dl": 0.02586},
+        "ranges": [(ANY, 0, 200, 0, 5.2)],
+        "critical": (None, None),
+    },
+    "LDL": {
+        "names": ("лпнп", "холестерин лпнп", "ldl", "ldl cholesterol", "ldl-c"),
+        "unit": "ммоль/л",
+        "units": {"mmol/l": 1.0, "mg/dl": 0.02586},
+        "ranges": [(ANY, 0, 200, 0, 3.0)],
+        "critical": (None, None),
+    },
+    "HDL": {
+        "names": ("лпвп", "холестерин лпвп", "hdl", "hdl cholesterol", "hdl-c"),
+        "unit": "ммоль/л",
+        "units": {"mmol/l": 1.0, "mg/dl": 0.02586},
+        "ranges": [(MALE, 0, 200, 1.0, None), (FEMALE, 0, 200, 1.2, None), (ANY, 0, 200, 1.0, None)],
+        "critical": (None, None),
+    },
+    "TG": {
+        "names": ("триглицериды", "tg", "trig", "triglycerides"),
+        "unit": "ммоль/л",
+        "units": {"mmol/l": 1.0, "mg/dl": 0.01129},
+        "ranges": [(ANY, 0, 200, 0, 1.7)],
+        "critical": (None, 11.3),
+    },
+    "CRP": {
+        "names": ("срб", "с-реактивный белок", "c-реактивный белок", "crp", "c-reactive protein"),
+        "unit": "мг/л",
+        "units": {"mg/l": 1.0, "mg/dl": 10.0},
+        "ranges": [(ANY, 0, 200, 0, 5)],
+        "critical": (None, None),
+    },
+    "K": {
+        "names": ("калий", "k", "k+", "potassium"),
+        "unit": "ммоль/л",
+        "units": {"mmol/l": 1.0, "meq/l": 1.0},
+        "ranges": [(ANY, 0, 200, 3.5, 5.1)],
+        "critical": (2.5, 6.5),
+    },
+    "NA": {
+        "names": ("натрий", "na", "na+", "sodium"),
+        "unit": "ммоль/л",
+        "units": {"mmol/l": 1.0, "meq/l": 1.0},
+        "ranges": [(ANY, 0, 200, 136, 145)],
+        "critical": (120, 160),
+    },
+    "TSH": {
+        "names": ("ттг", "тиреотропный гормон", "tsh", "thyroid stimulating hormone", "thyrotropin"),
+        "unit": "мМЕ/л",
+        "units": {"miu/l": 1.0, "uiu/ml": 1.0, "mu/l": 1.0},
+        "ranges": [(ANY, 0, 200, 0.4, 4.0)],
+        "critical": (None, None),
+    },
+    "FERR": {
+        "names": ("ферритин", "ferritin", "ferr"),
+        "unit": "мкг/л",
+        "units": {"ug/l": 1.0, "ng/ml": 1.0},
+        "ranges": [(MALE, 0, 200, 20, 250), (FEMALE, 0, 200, 10, 120), (ANY, 0, 200, 10, 250)],
+        "critical": (None, None),
+    },
+    "INR": {
+        "names": ("мно", "inr", "international normalized ratio"),
+        "unit": "",
+        "units": {},
+        "ranges": [(ANY, 0, 200, 0.8, 1.2)],
+        "critical": (None, 5.0),
+    },
+    "TP": {
+        "names": ("общий белок", "белок общий", "tp", "total protein"),
+        "unit": "г/л",
+        "units": {"g/l": 1.0, "g/dl": 10.0},
+        "ranges": [(ANY, 0, 200, 64, 83)],
+        "critical": (None, None),
+    },
+    "ALB": {
+        "names": ("альбумин", "alb", "albumin"),
+        "unit": "г/л",
+        "units": {"g/l": 1.0, "g/dl": 10.0},
+        "ranges": [(ANY, 0, 200, 35, 52)],
+        "critical": (15, None),
+    },
+}
+
+CODES = list(ANALYTES)
+
+# Кириллические обозначения единиц → латиница (порядок важен: длинные раньше коротких)
+_UNIT_REPLACEMENTS = [
+    ("×", ""), ("х10", "10"), ("x10", "10"), ("*10", "10"), ("⁹", "^9"), ("¹²", "^12"), ("³", "^3"), ("⁶", "^6"),
+    ("µ", "u"), ("μ", "u"), ("мк", "u"), ("моль", "mol"), ("мэкв", "meq"), ("ме", "iu"), ("ед", "u"),
+    ("нг", "ng"), ("мл", "ml"), ("мм", "mm"), ("час", "h"), ("м", "m"), ("л", "l"), ("г", "g"), ("д", "d"), ("ч", "h"),
+]
+
+
+def _name_key(name: str) -> str:
+    text = str(name).lower().replace("ё", "е")
+    text = re.sub(r"[^\w+\-\s]", " ", text)
+    return " ".join(text.split())
+
+
+def unit_key(unit: str) -> str:
+    """
+    Нормализованная запись единицы: «мкмоль/л» → «umol/l», «10*9/л» → «10^9/l».
+    """
+    text = str(unit or "").lower().replace(" ", "")
+    text = re.sub(r"10[eе\*](\d+)", r"10^\1", text)
+    for old, new in _UNIT_REPLACEMENTS:
+        text = text.replace(old, new)
+    return text
+
+
+def _build_index() -> dict:
+    index = {}
+    for code, spec in ANALYTES.items():
+        for name in spec["names"] + (code,):
+            index[_name_key(name)] = code
+    return index
+
+
+def _build_rules():
+    rows = []
+    for number, (code, spec) in enumerate(ANALYTES.items()):
+        critical_low, critical_high = spec["critical"]
+        for sex, age_min, age_max, low, high in spec["ranges"]:
+            rows.append((number, sex, age_min, age_max, low, high, critical_low, critical_high))
+    rules = np.array([[np.nan if v is None else v for v in row] for row in rows], dtype=np.float32)
+    return rules
+
+
+# Индекс синонимов и таблица интервалов строятся один раз при импорте
+SYNONYMS = _build_index()
+RULES = _build_rules()
+
+
+def match_analyte(name: str):
+    """
+    Код показателя по названию («Гемоглобин (HGB)», «hemoglobin», «HGB») или None.
+    """
+    key = _name_key(name)
+    if key in SYNONYMS:
+        return SYNONYMS[key]
+    # «Гемоглобин (HGB)»: пробуем текст вне и внутри скобок
+    for part in re.split(r"[()\[\],;/]", str(name)):
+        code = SYNONYMS.get(_name_key(part))
+        if code:
+            return code
+    return None
+
+
+def parse_patient_profile(text: str) -> dict:
+    """
+    Возраст и пол пациента из описания задачи («женщина 45 лет», «male, 60 y.o.», «пол: м»).
+    """
+    text = (text or "").lower()
+    profile = {"age": None, "sex": None}
+
+    match = (re.search(r"(\d{1,3})\s*(?:-\s*)?(?:лет|год|года|г\.|years?|y\.?o\.?|yo)\b", text)
+             or re.search(r"(?:возраст|age)\s*[:=\-]?\s*(\d{1,3})", text))
+    if match and 0 < int(match.group(1)) < 120:
+        profile["age"] = int(match.group(1))
+
+    if re.search(r"\b(?:женщин\w*|пациентк\w*|женск\w*|девочк\w*|female|woman|girl)\b|\bпол\s*[:\-]?\s*ж", text):
+        profile["sex"] = "f"
+    elif re.search(r"\b(?:мужчин\w*|мужск\w*|мальчик\w*|male|man|boy)\b|\bпол\s*[:\-]?\s*м", text):
+        profile["sex"] = "m"
+    return profile
+
+
+def _sex_codes(values) -> np.ndarray:
+    categorical = pd.Categorical(values)
+    lookup = np.array([
+        FEMALE if str(c).strip().lower()[:1] in ("ж", "f", "w") else MALE if str(c).strip().lower()[:1] in ("м", "m") else ANY
+        for c in categorical.categories
+    ] + [ANY], dtype=np.int8)
+    return lookup[categorical.codes]
+
+
+def flag_panel(panel, profile: dict = None) -> pd.DataFrame:
+    """
+    Флаги для всех измерений LabPanel за один векторизованный проход.
+
+    Название показателя сопоставляется со справочником через индекс синонимов (по категориям,
+    а не по строкам), значение пересчитывается в базовую единицу, интервал выбирается по полу и
+    возрасту (столбцы файла или profile из описания задачи). Если в файле указана норма, она
+    приоритетнее справочной. Возвращает измерения со столбцами code, value_norm, unit_norm, low,
+    high и flag (unknown/normal/low/high/critical_low/critical_high); value_ref — значение в единицах
+    выбранного интервала.
+    """
+    profile = profile or {}
+    n = len(panel)
+
+    # Показатель: синонимы ищутся только для уникальных названий
+    category_codes = np.array(
+        [CODES.index(code) if code else -1 for code in map(match_analyte, panel.analyte.categories)] + [-1],
+        dtype=np.int16
+    )
+    analyte = category_codes[panel.analyte.codes]
+
+    # Единицы: коэффициент для каждой уникальной пары (показатель, единица)
+    # (пустая единица и неизвестный показатель кодируются как -1, поэтому сдвигаем на 1)
+    stride = len(panel.unit.categories) + 1
+    pairs, inverse = np.unique((analyte.astype(np.int64) + 1) * stride + panel.unit.codes + 1, return_inverse=True)
+    factors = np.full(len(pairs), np.nan, dtype=np.float32)
+    for i, pair in enumerate(pairs):
+        code_index, unit_index = divmod(int(pair), stride)
+        if code_index == 0:
+            continue
+        spec = ANALYTES[CODES[code_index - 1]]
+        unit = unit_key(panel.unit.categories[unit_index - 1]) if unit_index > 0 else ""
+        if unit == "" or unit == unit_key(spec["unit"]):
+            factors[i] = 1.0
+        else:
+            factors[i] = spec["units"].get(unit, np.nan)
+    value_norm = panel.value * factors[inverse.reshape(-1)]
+
+    # Профиль пациента: столбцы файла, иначе описание задачи
+    age = panel.age if panel.age is not None else np.full(n, np.nan, dtype=np.float32)
+    age = np.where(np.isnan(age), np.float32(profile.get("age") or np.nan), age)
+    age = np.where(np.isnan(age), np.float32(40), age)
+    sex = _sex_codes(panel.sex) if panel.sex is not None else np.zeros(n, dtype=np.int8)
+    profile_sex = {"m": MALE, "f": FEMALE}.get(profile.get("sex"), ANY)
+    sex = np.where(sex == ANY, np.int8(profile_sex), sex)
+
+    # Интервал: первое подходящее правило справочника
+    low = np.full(n, np.nan, dtype=np.float32)
+    high = np.full(n, np.nan, dtype=np.float32)
+    critical_low = np.full(n, np.nan, dtype=np.float32)
+    critical_high = np.full(n, np.nan, dtype=np.float32)
+    assigned = analyte < 0
+    for rule in RULES:
+        code, rule_sex, age_min, age_max = int(rule[0]), rule[1], rule[2], rule[3]
+        mask = ~assigned & (analyte == code) & (age >= age_min) & (age < age_max)
+        if rule_sex != ANY:
+            mask &= sex == rule_sex
+        if mask.any():
+            low[mask], high[mask], critical_low[mask], critical_high[mask] = rule[4], rule[5], rule[6], rule[7]
+            assigned |= mask
+
+    # Норма из файла относится к исходной единице файла
+    own = ~np.isnan(panel.ref_low) | ~np.isnan(panel.ref_high)
+    compare = np.where(own, panel.value, value_norm)
+    low = np.where(own, panel.ref_low, low)
+    high = np.where(own, panel.ref_high, high)
+    has_range = ~np.isnan(low) | ~np.isnan(high)
+
+    flag = np.full(n, UNKNOWN, dtype=np.int8)
+    flag[has_range & ~np.isnan(compare)] = NORMAL
+    flag[compare < low] = LOW
+    flag[compare > high] = HIGH
+    flag[value_norm < critical_low] = CRITICAL_LOW
+    flag[value_norm > critical_high] = CRITICAL_HIGH
+
+    unit_names = np.array([ANALYTES[code]["unit"] for code in CODES] + [""], dtype=object)
+    result = panel.measurements()
+    result["code"] = pd.Categorical.from_codes(analyte, CODES)
+    result["value_norm"] = value_norm
+    result["value_ref"] = compare
+    result["unit_norm"] = np.where(own, result["unit"].astype(object), unit_names[analyte])
+    result["low"] = low
+    result["high"] = high
+    result["flag"] = pd.Categorical.from_codes(flag, FLAG_LABELS)
+    result["severity"] = SEVERITY[flag]
+    return result
+
+
+def abnormal_findings(flagged: pd.DataFrame, limit: int = MAX_FINDINGS) -> dict:
+    """
+    Только отклонения для отчета: самые тяжёлые находки и счётчики по показателям.
+    """
+    abnormal = flagged[flagged["severity"] > 0]
+    counts = flagged["flag"].value_counts()
+    by_analyte = (abnormal.groupby(["analyte", "flag"], observed=True).size()
+                  .unstack(fill_value=0).to_dict(orient="index") if len(abnormal) else {})
+    top = abnormal.sort_values(["severity", "row"], ascending=[False, True]).head(limit)
+
+    # В широком формате в строке несколько показателей: указываем номер строки (пациента)
+    with_row = bool(flagged["row"].duplicated().any())
+    findings = []
+    for item in top.itertuples(index=False):
+        unit = "" if pd.isna(item.unit) else str(item.unit)
+        finding = {
+            "analyte": str(item.analyte),
+            "value": round(float(item.value_ref), 3),
+            "unit": str(item.unit_norm or ""),
+            "flag": str(item.flag),
+            "reference": [None if np.isnan(item.low) else round(float(item.low), 3),
+                          None if np.isnan(item.high) else round(float(item.high), 3)],
+        }
+        if unit_key(unit) != unit_key(finding["unit"]):
+            # Пересчитано в базовую единицу: оставляем исходную запись
+            finding["original"] = f"{float(item.value):g} {unit}".strip()
+        if with_row:
+            finding["row"] = int(item.row)
+        findings.append(finding)
+
+    return {
+        "measurements": len(flagged),
+        "flag_counts": {str(label): int(counts.get(label, 0)) for label in FLAG_LABELS},
+        "abnormal_count": int(len(abnormal)),
+        "abnormal_by_analyte": {str(k): {f: int(c) for f, c in v.items() if c} for k, v in by_analyte.items()},
+        "abnormal_findings": findings,
+    }
+
+
+def analyte_values(flagged: pd.DataFrame) -> dict:
+    """
+    Одно значение на показатель справочника для истории пациента: медиана в базовой
+    единице и самый тяжёлый флаг (в длинном формате показатель может повторяться).
+    Широкий формат с несколькими строками — разные пациенты: истории нет.
+    """
+    rows = flagged["row"]
+    if rows.duplicated().any() and rows.nunique() > 1:
+        return {}
+    known = flagged[flagged["code"].notna()]
+    if not len(known):
+        return {}
+    grouped = known.groupby("code", observed=True)
+    medians = grouped["value_norm"].median()
+    worst = known.loc[grouped["severity"].idxmax(), ["code", "flag"]].set_index("code")["flag"]
+    values = {}
+    for code, value in medians.items():
+        if np.isnan(value):
+            continue
+        values[str(code)] = {
+            "name": ANALYTES[code]["names"][0],
+            "value": round(float(value), 3),
+            "unit": ANALYTES[code]["unit"],
+            "flag": str(worst[code]),
+        }
+    return values
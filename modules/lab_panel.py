@@ -0,0 +1,358 @@
+import io
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from modules.cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# Сколько разобранных файлов держать в памяти (по sha256 содержимого)
+PANEL_CACHE_ITEMS = 16
+# Строк листа Excel, накапливаемых перед преобразованием в типизированный блок
+XLSX_CHUNK_ROWS = 50000
+
+# Названия столбцов «длинного» формата: одна строка — один показатель
+ANALYTE_COLUMNS = ("параметр", "показатель", "анализ", "тест", "исследование", "наименование",
+                   "analyte", "test", "parameter", "name")
+VALUE_COLUMNS = ("значение", "результат", "value", "result")
+UNIT_COLUMNS = ("единица", "единицы", "ед", "ед.", "ед. изм.", "ед.изм.", "единицы измерения", "unit", "units")
+REFERENCE_COLUMNS = ("норма", "референс", "референсные значения", "референсный интервал",
+                     "reference", "reference range", "ref", "range", "norm")
+AGE_COLUMNS = ("возраст", "age")
+SEX_COLUMNS = ("пол", "sex", "gender")
+ID_COLUMNS = ("id", "№", "n", "no", "номер", "код", "patient_id", "sample_id")
+
+_NUMBER = r"[-+]?\d+(?:[.,]\d+)?"
+_VALUE_RE = re.compile(rf"^\s*(?:[<>≤≥]=?)?\s*({_NUMBER})")
+_RANGE_RE = re.compile(rf"^\s*({_NUMBER})\s*(?:-|–|—|\.\.\.?)\s*({_NUMBER})")
+_UPPER_RE = re.compile(rf"^\s*(?:<=?|≤|до)\s*({_NUMBER})", re.IGNORECASE)
+_LOWER_RE = re.compile(rf"^\s*(?:>=?|≥|от|более)\s*({_NUMBER})", re.IGNORECASE)
+# «Гемоглобин, г/л» или «Гемоглобин (г/л)»
+_NAME_UNIT_RE = re.compile(r"^(.*?)\s*(?:\(([^()]+)\)|,\s*([^,]+))\s*$")
+
+
+def _number(text: str) -> float:
+    return float(text.replace(",", "."))
+
+
+def parse_value(text) -> float:
+    """
+    Число из ячейки результата («12,5», «<0.1»); для качественных результатов — NaN.
+    """
+    if isinstance(text, (int, float, np.number)):
+        return float(text)
+    match = _VALUE_RE.match(str(text))
+    return _number(match.group(1)) if match else np.nan
+
+
+def parse_range(text) -> tuple:
+    """
+    Границы референсного интервала («3,5-5,0», «<5», «до 20», «>1.0») как (low, high), NaN если нет.
+    """
+    text = "" if text is None else str(text)
+    match = _RANGE_RE.match(text)
+    if match:
+        return _number(match.group(1)), _number(match.group(2))
+    match = _UPPER_RE.match(text)
+    if match:
+        return np.nan, _number(match.group(1))
+    match = _LOWER_RE.match(text)
+    if match:
+        return _number(match.group(1)), np.nan
+    return np.nan, np.nan
+
+
+def _by_categories(values: pd.Series, parse, width: int = None) -> np.ndarray:
+    """
+    Применяет parse к уникальным строкам столбца, а не к каждой ячейке.
+    width — длина кортежа, который возвращает parse (форма результата не зависит
+    от того, есть ли в столбце значения).
+    """
+    categorical = values.astype("category")
+    shape = () if width is None else (width,)
+    parsed = np.array([parse(c) for c in categorical.cat.categories], dtype=np.float32).reshape((-1,) + shape)
+    codes = categorical.cat.codes.to_numpy()
+    out = np.full(codes.shape + shape, np.nan, dtype=np.float32)
+    present = codes >= 0
+    if parsed.size:
+        out[present] = parsed[codes[present]]
+    return out
+
+
+def _text(values: pd.Series) -> pd.Series:
+    # Строковое представление столбца, пустые ячейки — пустая строка
+    return values.astype(object).where(values.notna(), "").astype(str).str.strip()
+
+
+def _find_column(columns, names):
+    for column in columns:
+        if str(column).strip().lower().rstrip(":") in names:
+            return column
+    return None
+
+
+def _compact(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Уменьшает таблицу в памяти: float → float32, целые — минимальный тип, строки → category.
+    """
+    out = {}
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_bool_dtype(values):
+            out[column] = values
+        elif pd.api.types.is_integer_dtype(values):
+            out[column] = pd.to_numeric(values, downcast="integer")
+        elif pd.api.types.is_float_dtype(values):
+            out[column] = values.astype(np.float32)
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            out[column] = values
+        else:
+            out[column] = values.astype("category")
+    return pd.DataFrame(out, index=df.index)
+
+
+def _block(records: list, names: list) -> pd.DataFrame:
+    frame = pd.DataFrame.from_records(records, columns=names).infer_objects()
+    floats = frame.select_dtypes(include="float64").columns
+    return frame.astype({column: np.float32 for column in floats})
+
+
+def _read_xlsx(data: bytes) -> dict:
+    """
+    Все листы книги потоковым чтением openpyxl (read_only): {лист: DataFrame}.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    sheets = {}
+    try:
+        for worksheet in workbook.worksheets:
+            rows = worksheet.iter_rows(values_only=True)
+            header = None
+            for row in rows:
+                if any(cell is not None for cell in row):
+                    header = row
+                    break
+            if header is None:
+                continue
+            # Пустые и повторяющиеся заголовки называем как pandas
+            names, seen = [], {}
+            for i, name in enumerate(header):
+                name = f"Unnamed: {i}" if name is None else str(name).strip()
+                if name in seen:
+                    seen[name] += 1
+                    name = f"{name}.{seen[name]}"
+                else:
+                    seen[name] = 0
+                names.append(name)
+            # Строки копим блоками: в памяти одновременно только один блок кортежей
+            blocks, records = [], []
+            for row in rows:
+                if any(cell is not None for cell in row):
+                    records.append(row[:len(names)])
+                if len(records) >= XLSX_CHUNK_ROWS:
+                    blocks.append(_block(records, names))
+                    records = []
+            if records or not blocks:
+                blocks.append(_block(records, names))
+            sheets[worksheet.title] = pd.concat(blocks, ignore_index=True) if len(blocks) > 1 else blocks[0]
+    finally:
+        workbook.close()
+    return sheets
+
+
+def _read_table(name: str, data: bytes) -> pd.DataFrame:
+    lower = name.lower()
+    if lower.endswith(".xlsx"):
+        sheets = _read_xlsx(data)
+    elif lower.endswith(".xls"):
+        sheets = pd.read_excel(io.BytesIO(data), sheet_name=None)
+    elif lower.endswith(".csv"):
+        return pd.read_csv(io.BytesIO(data))
+    else:
+        raise ValueError(f"Неподдерживаемый формат: {name}")
+
+    sheets = {title: frame for title, frame in sheets.items() if len(frame.columns)}
+    if not sheets:
+        return pd.DataFrame()
+    if len(sheets) == 1:
+        return next(iter(sheets.values()))
+    # Несколько листов: объединяем, лист указываем отдельным столбцом
+    return pd.concat(
+        [frame.assign(**{"Лист": title}) for title, frame in sheets.items()],
+        ignore_index=True, sort=False
+    )
+
+
+def _is_index_column(name, values: pd.Series) -> bool:
+    # Идентификаторы и порядковые номера — не показатели
+    if str(name).strip().lower() in ID_COLUMNS:
+        return True
+    return len(values) > 2 and pd.api.types.is_integer_dtype(values) and values.is_monotonic_increasing and values.is_unique
+
+
+class LabPanel:
+    """
+    Лабораторный файл, разобранный один раз.
+
+    table — исходная таблица в компактных типах (float32, category) для сводок;
+    показатели в «длинном» виде, по одному элементу на измерение:
+    analyte (category), value (float32, NaN для качественных), unit (category, коды — unit.codes),
+    ref_low/ref_high (float32), row — номер строки table, age/sex — профиль пациента строки, если есть.
+    """
+
+    def __init__(self, name: str, table: pd.DataFrame):
+        self.name = name
+        self.table = _compact(table)
+        self._build_measurements()
+
+    def _build_measurements(self):
+        table = self.table
+        columns = table.columns
+        analyte_col = _find_column(columns, ANALYTE_COLUMNS)
+        value_col = _find_column(columns, VALUE_COLUMNS)
+        age_col = _find_column(columns, AGE_COLUMNS)
+        sex_col = _find_column(columns, SEX_COLUMNS)
+        rows = np.arange(len(table), dtype=np.int32)
+
+        if analyte_col is not None and value_col is not None:
+            # Длинный формат: Параметр | Значение | Единица | Норма
+            unit_col = _find_column(columns, UNIT_COLUMNS)
+            reference_col = _find_column(columns, REFERENCE_COLUMNS)
+            analyte = _text(table[analyte_col])
+            value = _by_categories(table[value_col], parse_value)
+            unit = _text(table[unit_col]) if unit_col is not None else pd.Series([""] * len(table))
+            if reference_col is not None:
+                ranges = _by_categories(table[reference_col], lambda c: parse_range(c), width=2)
+                ref_low, ref_high = ranges[:, 0], ranges[:, 1]
+            else:
+                ref_low = ref_high = np.full(len(table), np.nan, dtype=np.float32)
+            keep = (analyte != "").to_numpy()
+        else:
+            # Широкий формат: каждый числовой столбец — показатель, единица — в названии столбца
+            skip = {age_col, sex_col}
+            numeric = [
+                c for c in table.select_dtypes(include="number").columns
+                if c not in skip and not _is_index_column(c, table[c])
+            ]
+            names, units = [], []
+            for column in numeric:
+                match = _NAME_UNIT_RE.match(str(column))
+                name, unit_text = (match.group(1), match.group(2) or match.group(3)) if match else (str(column), "")
+                names.append(name.strip())
+                units.append((unit_text or "").strip())
+            k = len(numeric)
+            analyte = pd.Series(np.repeat(np.array(names, dtype=object), len(table)))
+            unit = pd.Series(np.repeat(np.array(units, dtype=object), len(table)))
+            value = (np.concatenate([table[c].to_numpy(dtype=np.float32) for c in numeric])
+                     if k else np.empty(0, dtype=np.float32))
+            rows = np.tile(rows, k)
+            ref_low = ref_high = np.full(len(value), np.nan, dtype=np.float32)
+            keep = ~np.isnan(value)
+
+        rows = rows[keep]
+        self.row = rows
+        self.analyte = pd.Categorical(np.asarray(analyte, dtype=object)[keep])
+        self.value = np.asarray(value, dtype=np.float32)[keep]
+        self.unit = pd.Categorical(np.asarray(unit, dtype=object)[keep])
+        self.ref_low = np.asarray(ref_low, dtype=np.float32)[keep]
+        self.ref_high = np.asarray(ref_high, dtype=np.float32)[keep]
+        self.age = _by_categories(table[age_col], parse_value)[rows] if age_col is not None else None
+        self.sex = (pd.Categorical(_text(table[sex_col]).str.lower().to_numpy()[rows])
+                    if sex_col is not None else None)
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    @property
+    def analytes(self) -> list:
+        return self.analyte.categories.tolist()
+
+    def measurements(self) -> pd.DataFrame:
+        """
+        Показатели в длинном виде одной таблицей.
+        """
+        frame = pd.DataFrame({
+            "row": self.row,
+            "analyte": self.analyte,
+            "value": self.value,
+            "unit": self.unit,
+            "ref_low": self.ref_low,
+            "ref_high": self.ref_high,
+        })
+        if self.age is not None:
+            frame["age"] = self.age
+        if self.sex is not None:
+            frame["sex"] = self.sex
+        return frame
+
+    def memory_bytes(self) -> int:
+        arrays = [self.row, self.value, self.ref_low, self.ref_high, self.analyte.codes, self.unit.codes]
+        return int(self.table.memory_usage(deep=True).sum() + sum(a.nbytes for a in arrays))
+
+    def summary(self, preview_rows: int = 10) -> dict:
+        """
+        Сводка для modules.lab.process_lab_analysis.
+        """
+        return {
+            'shape': str(self.table.shape),
+            'columns': self.table.columns.tolist(),
+            'preview': self.table.head(preview_rows).to_dict(),
+            'data_types': self.table.dtypes.to_dict(),
+            'analytes': len(self.analytes),
+            'measurements': len(self),
+        }
+
+    def describe(self, preview_rows: int = 5) -> dict:
+        """
+        Сводка для modules.lab_analysis.analyze_lab_results.
+        """
+        return {
+            'total_rows': len(self.table),
+            'total_columns': len(self.table.columns),
+            'columns': self.table.columns.tolist(),
+            'data_types': {str(k): str(v) for k, v in self.table.dtypes.to_dict().items()},
+            'missing_values': self.table.isnull().sum().to_dict(),
+            'preview': self.table.head(preview_rows).to_dict(),
+            'analytes': self.analytes,
+            'measurements': len(self),
+        }
+
+
+_panels = OrderedDict()
+_panels_lock = threading.Lock()
+
+
+def load_lab_panel(uploaded_file) -> LabPanel:
+    """
+    Разбирает CSV/XLSX/XLS в LabPanel; повторная загрузка того же файла берётся из памяти.
+    """
+    content_hash = file_sha256(uploaded_file)
+    with _panels_lock:
+        panel = _panels.get(content_hash)
+        if panel is not None:
+            _panels.move_to_end(content_hash)
+            return panel
+
+    started = time.perf_counter()
+    position = uploaded_file.tell()
+    uploaded_file.seek(0)
+    data = uploaded_file.read()
+    uploaded_file.seek(position)
+    panel = LabPanel(uploaded_file.name, _read_table(uploaded_file.name, data))
+    logger.info(
+        "Лабораторный файл разобран за %.2f с: %s строк, %s измерений, %s показателей",
+        time.perf_counter() - started, len(panel.table), len(panel), len(panel.analytes)
+    )
+
+    with _panels_lock:
+        _panels[content_hash] = panel
+        while len(_panels) > PANEL_CACHE_ITEMS:
+            _panels.popitem(last=False)
+    return panel
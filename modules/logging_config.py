@@ -0,0 +1,269 @@
+"""
+Неблокирующее журналирование: потоки запросов только кладут запись в ограниченную
+очередь, форматирование и запись на диск — в фоновом потоке QueueListener.
+
+- JSON-записи (LOG_FORMAT=json) или текст с ID корреляции анализа;
+- ротация по размеру (LOG_MAX_MB, LOG_BACKUPS) или по времени (LOG_ROTATE_WHEN=midnight, H, ...);
+- выборка частых INFO/DEBUG: из одинаковых сообщений (по шаблону) за LOG_SAMPLE_WINDOW с
+  пишутся первые LOG_SAMPLE_BURST и далее каждое LOG_SAMPLE_EVERY-е;
+- при переполнении очереди запись отбрасывается, а не ждёт диска.
+
+    setup_logging()
+    with correlation_id(job_id):
+        logger.info("Разбор %s", name)   # аргументы форматируются в фоновом потоке
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+LOG_FILE = os.getenv("LOG_FILE", "medassistant.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_MAX_MB = float(os.getenv("LOG_MAX_MB", "20"))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", "60"))
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "20"))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+# Длинные сообщения (тела ответов, тексты документов) обрезаются при записи
+LOG_MAX_MESSAGE = int(os.getenv("LOG_MAX_MESSAGE", "2000"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s"
+
+_correlation_id = contextvars.ContextVar("correlation_id", default="-")
+
+
+@contextmanager
+def correlation_id(value: str):
+    """
+    ID корреляции для записей журнала внутри блока (поток / задача asyncio).
+    Пулы потоков контекст не наследуют: см. contextvars.copy_context().
+    """
+    token = _correlation_id.set(value)
+    try:
+        yield value
+    finally:
+        _correlation_id.reset(token)
+
+
+def get_correlation_id() -> str:
+    return _correlation_id.get()
+
+
+class CorrelationFilter(logging.Filter):
+    """
+    Запоминает ID корреляции в записи в потоке вызова, пока контекст ещё доступен.
+    """
+
+    def filter(self, record):
+        record.correlation_id = _correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживает повторяющиеся INFO/DEBUG по (логгер, шаблон сообщения).
+    Предупреждения и ошибки проходят всегда. В пропущенную запись добавляется
+    поле suppressed — сколько таких же сообщений было отброшено перед ней.
+    """
+
+    def __init__(self, window: float = LOG_SAMPLE_WINDOW, burst: int = LOG_SAMPLE_BURST,
+                 every: int = LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.every = max(every, 1)
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._window_started = time.monotonic()
+        self.suppressed_total = 0
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or self.window <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_started > self.window:
+                self._counts.clear()
+                self._window_started = now
+            count, suppressed = self._counts.get(key, (0, 0))
+            count += 1
+            if count <= self.burst or count % self.every == 0:
+                self._counts[key] = (count, 0)
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            self._counts[key] = (count, suppressed + 1)
+            self.suppressed_total += 1
+            return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Кладёт запись в очередь без ожидания. Сообщение не форматируется в потоке вызова:
+    msg и args уходят в фоновый поток как есть.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self._dropped_lock = threading.Lock()
+        self.dropped = 0
+        self._pending_dropped = 0
+
+    def prepare(self, record):
+        if record.exc_info:
+            # Трассировку нужно снять сейчас: кадры стека могут измениться до записи
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        pending = self._pending_dropped
+        if pending:
+            record.dropped_before = pending
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+                self._pending_dropped += 1
+            return
+        if pending:
+            with self._dropped_lock:
+                self._pending_dropped -= pending
+
+
+def _truncate(message: str) -> str:
+    if LOG_MAX_MESSAGE and len(message) > LOG_MAX_MESSAGE:
+        return f"{message[:LOG_MAX_MESSAGE]}… [+{len(message) - LOG_MAX_MESSAGE} симв.]"
+    return message
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна запись — одна строка JSON.
+    """
+
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _truncate(record.getMessage()),
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "thread": record.threadName,
+        }
+        for key in ("suppressed", "dropped_before"):
+            if getattr(record, key, 0):
+                data[key] = getattr(record, key)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def formatMessage(self, record):
+        record.message = _truncate(record.message)
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = "-"
+        return super().formatMessage(record)
+
+
+def _file_handler(path: str) -> logging.Handler:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if LOG_ROTATE_WHEN:
+        return TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS, encoding="utf-8")
+    return RotatingFileHandler(path, maxBytes=int(LOG_MAX_MB * 1024 * 1024), backupCount=LOG_BACKUPS,
+                               encoding="utf-8")
+
+
+_listener = None
+_queue_handler = None
+_sampler = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level: str = LOG_LEVEL, log_file: str = LOG_FILE, fmt: str = LOG_FORMAT,
+                  console: bool = True) -> QueueListener:
+    """
+    Настраивает корневой логгер на очередь с фоновой записью. Повторные вызовы
+    (перезапуски скрипта Streamlit) ничего не меняют.
+    """
+    global _listener, _queue_handler, _sampler
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        formatter = JsonFormatter() if fmt == "json" else TextFormatter()
+        handlers = []
+        if log_file:
+            file_handler = _file_handler(log_file)
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        if console:
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setFormatter(TextFormatter())
+            handlers.append(console_handler)
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _sampler = SamplingFilter()
+        _queue_handler.addFilter(_sampler)
+        _queue_handler.addFilter(CorrelationFilter())
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_queue_handler)
+
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_stop_listener)
+        # Дочерние процессы (fork пула OCR) не получают поток записи: пишем в stderr напрямую
+        os.register_at_fork(after_in_child=_reset_in_child)
+        return _listener
+
+
+def _stop_listener():
+    # Дописывает очередь до выхода процесса
+    if _listener is not None:
+        _listener.stop()
+
+
+def _reset_in_child():
+    global _listener
+    if _queue_handler is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(TextFormatter())
+    handler.addFilter(CorrelationFilter())
+    root.addHandler(handler)
+    _listener = None
+
+
+def logging_stats() -> dict:
+    """
+    Очередь журнала: текущая длина, отброшено при переполнении и при выборке.
+    """
+    if _queue_handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "sampled_out": _sampler.suppressed_total,
+    }
@@ -0,0 +1,276 @@
+"""
+Метрики этапов обработки: спаны с длительностью и атрибутами (размеры, токены,
+попадания в кэш), агрегаты p50/p95 и экспорт в текстовом формате Prometheus.
+
+    with span("parse.ecg", bytes=size) as s:
+        ...
+        s.set(prompt_tokens=120, cache_hit=False)
+
+Числовые и логические атрибуты спана суммируются в счётчики medassistant_<атрибут>_total{stage=...}.
+Экспорт: METRICS_FILE — файл для textfile collector node_exporter (перезаписывается
+раз в METRICS_EXPORT_INTERVAL с), METRICS_PORT — HTTP /metrics в фоновом потоке.
+"""
+import os
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", "15"))
+
+# Сколько последних длительностей этапа хранить для перцентилей
+METRICS_SAMPLES = 1024
+# Границы гистограммы, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = "medassistant"
+
+# Спаны текущей трассировки (см. trace); None — трассировка не ведётся
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+class StageStats:
+    def __init__(self):
+        self.samples = deque(maxlen=METRICS_SAMPLES)
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+
+class Metrics:
+    """
+    Потокобезопасный реестр длительностей этапов и счётчиков процесса.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.observe(seconds)
+
+    def inc(self, name: str, amount: float = 1, stage: str = ""):
+        key = (name, stage)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def summary(self) -> dict:
+        """
+        По этапам: число вызовов, p50/p95/max (мс) по последним METRICS_SAMPLES; счётчики по этапам.
+        """
+        with self._lock:
+            stages = {name: (sorted(s.samples), s.count, s.total) for name, s in self._stages.items()}
+            counters = dict(self._counters)
+
+        def percentile(values, p):
+            return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 2)
+
+        result = {"stages": {}, "counters": {}}
+        for name, (values, count, total) in sorted(stages.items()):
+            result["stages"][name] = {
+                "count": count,
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "max_ms": percentile(values, 100),
+                "total_s": round(total, 3),
+            }
+        for (name, stage), value in sorted(counters.items()):
+            result["counters"].setdefault(name, {})[stage or "all"] = value
+        return result
+
+    def prometheus_text(self) -> str:
+        """
+        Гистограмма medassistant_stage_seconds и счётчики в текстовом формате Prometheus.
+        """
+        with self._lock:
+            stages = {name: (list(s.buckets), s.count, s.total) for name, s in self._stages.items()}
+            counters = dict(self._counters)
+
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Длительность этапа обработки",
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+        ]
+        for name, (buckets, count, total) in sorted(stages.items()):
+            cumulative = 0
+            for bound, value in zip(BUCKETS, buckets):
+                cumulative += value
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{name}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{name}"}} {count}')
+
+        names = sorted({name for name, _ in counters})
+        for name in names:
+            metric = f"{PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, stage), value in sorted(counters.items()):
+                if counter == name:
+                    labels = f'{{stage="{stage}"}}' if stage else ""
+                    lines.append(f"{metric}{labels} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+
+class Span:
+    """
+    Замер одного этапа; используется через span(). set() добавляет атрибуты по ходу этапа.
+    """
+
+    __slots__ = ("name", "attrs", "started", "duration")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.started = 0.0
+        self.duration = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        metrics = get_metrics()
+        metrics.observe(self.name, self.duration)
+        if exc_type is not None:
+            metrics.inc("errors", 1, self.name)
+        for key, value in self.attrs.items():
+            # bool — подкласс int: попадание в кэш считается как 1
+            if isinstance(value, (int, float)) and value:
+                metrics.inc(key, value, self.name)
+        spans = _current_trace.get()
+        if spans is not None:
+            spans.append(self)
+        return False
+
+
+def span(name: str, **attrs) -> Span:
+    return Span(name, attrs)
+
+
+class trace:
+    """
+    Собирает спаны, завершившиеся внутри блока в этом потоке / задаче asyncio.
+
+        with trace() as spans:
+            ...
+        timings(spans)
+    """
+
+    def __enter__(self):
+        self._spans = []
+        self._token = _current_trace.set(self._spans)
+        return self._spans
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        return False
+
+
+def timings(spans: list) -> dict:
+    """
+    {этап: мс} по спанам трассировки (повторные этапы суммируются).
+    """
+    result = {}
+    for s in spans:
+        result[s.name] = round(result.get(s.name, 0.0) + s.duration * 1000, 2)
+    return result
+
+
+# ---------- экспорт ----------
+
+def write_prometheus_file(path: str):
+    """
+    Атомарная запись метрик в файл (читатель не увидит файл наполовину).
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(get_metrics().prometheus_text())
+    os.replace(tmp, path)
+
+
+def _file_exporter(path: str, interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            write_prometheus_file(path)
+        except OSError as e:
+            logger.warning("Не удалось записать метрики в %s: %s", path, e)
+
+
+def start_http_exporter(port: int):
+    """
+    HTTP сервер с /metrics в фоновом потоке.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = get_metrics().prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Метрики Prometheus: http://0.0.0.0:%s/metrics", port)
+    return server
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """
+    Реестр метрик процесса; при первом вызове запускает экспорт, если он настроен.
+    """
+    global _metrics
+    if _metrics is not None:
+        return _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            if METRICS_FILE:
+                threading.Thread(
+                    target=_file_exporter, args=(METRICS_FILE, METRICS_EXPORT_INTERVAL),
+                    name="metrics-file", daemon=True
+                ).start()
+            if METRICS_PORT:
+                try:
+                    start_http_exporter(METRICS_PORT)
+                except OSError as e:
+                    # Порт занят, например, вторым процессом Streamlit
+                    logger.warning("Экспорт метрик на порт %s не запущен: %s", METRICS_PORT, e)
+        return _metrics
@@ -1,37 +1,36 @@
 import logging
-import PyPDF2
 from PIL import Image
-import pytesseract
+from modules.ocr_engine import ocr_image, pdf_text
 
 logger = logging.getLogger(__name__)
 
 def extract_text_from_image(uploaded_file):
     """
     Извлекает текст из изображения или PDF с помощью OCR.
+    Сканированные страницы PDF распознаются параллельно, страницы с текстовым
+    слоем читаются без OCR.
     """
     try:
-        logger.info(f"Извлечение текста из: {uploaded_file.name}")
+        logger.info("Извлечение текста из: %s", uploaded_file.name)
         
         if uploaded_file.name.lower().endswith('.pdf'):
             # Работа с PDF
-            pdf_reader = PyPDF2.PdfReader(uploaded_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-            logger.info(f"Текст из PDF извлечён: {len(text)} символов")
+            uploaded_file.seek(0)
+            text = pdf_text(uploaded_file.read())
+            logger.info("Текст из PDF извлечён: %s символов", len(text))
             return text
         
         elif uploaded_file.name.lower().endswith(('.png', '.jpg', '.jpeg')):
             # Работа с изображением
             image = Image.open(uploaded_file)
-            text = pytesseract.image_to_string(image, lang='rus+eng')
-            logger.info(f"Текст из изображения извлечён: {len(text)} символов")
+            text = ocr_image(image, lang='rus+eng')
+            logger.info("Текст из изображения извлечён: %s символов", len(text))
             return text
         
         else:
-            logger.warning(f"Неподдерживаемый формат: {uploaded_file.name}")
+            logger.warning("Неподдерживаемый формат: %s", uploaded_file.name)
             return ""
     
     except Exception as e:
-        logger.error(f"Ошибка при извлечении текста: {str(e)}", exc_info=True)
+        logger.error("Ошибка при извлечении текста: %s", e, exc_info=True)
         raise
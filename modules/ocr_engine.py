@@ -0,0 +1,227 @@
+import os
+import io
+import atexit
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+import pytesseract
+
+from modules.cache import TieredCache, make_key
+
+logger = logging.getLogger(__name__)
+
+OCR_LANG = os.getenv("OCR_LANG", "rus+eng")
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", "0")) or (os.cpu_count() or 1)
+# Текстовый слой PDF считаем пригодным, если в нём достаточно букв и цифр
+MIN_TEXT_LAYER_CHARS = int(os.getenv("OCR_MIN_TEXT_LAYER_CHARS", "40"))
+OCR_CONFIG = os.getenv("OCR_CONFIG", "")
+OCR_CACHE_MAX_MB = float(os.getenv("OCR_CACHE_MAX_MB", "512"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_cache = None
+_cache_pid = None
+# Попадания считаем в основном процессе: страницы из пула возвращают флаг cached
+_counters = {"hits": 0, "misses": 0}
+
+
+def _init_worker():
+    # Tesseract сам распараллеливается через OpenMP; при пуле процессов это только мешает
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def get_ocr_pool() -> ProcessPoolExecutor:
+    """
+    Общий пул процессов для OCR (по числу ядер), создаётся при первом скане.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=OCR_MAX_WORKERS,
+                initializer=_init_worker
+            )
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+            logger.info("Создан пул OCR: %s процессов", OCR_MAX_WORKERS)
+        return _pool
+
+
+def get_ocr_cache() -> TieredCache:
+    """
+    Кэш результатов OCR. Соединение SQLite нельзя переносить через fork,
+    поэтому в каждом процессе пула открывается своё.
+    """
+    global _cache, _cache_pid
+    with _pool_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            _cache = TieredCache("ocr", max_bytes=int(OCR_CACHE_MAX_MB * 1024 * 1024), ttl=0, memory_items=64)
+            _cache_pid = os.getpid()
+        return _cache
+
+
+def image_key(image, lang: str, config: str) -> str:
+    """
+    Ключ кэша: хэш страницы, приведённой к оттенкам серого, плюс язык и конфиг Tesseract.
+    """
+    gray = image.convert("L")
+    digest = hashlib.sha256(gray.tobytes()).hexdigest()
+    return make_key("image", digest, gray.size, lang, config)
+
+
+def _lines_from_data(data: dict) -> str:
+    # Восстанавливаем строки и абзацы из пословного вывода image_to_data
+    lines, current, previous = [], [], None
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        position = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if previous is not None and position != previous:
+            lines.append(" ".join(current))
+            if position[:2] != previous[:2]:
+                lines.append("")
+            current = []
+        current.append(word)
+        previous = position
+    if current:
+        lines.append(" ".join(current))
+    return "\n".join(lines)
+
+
+def _recognize(image, lang: str, config: str) -> dict:
+    data = pytesseract.image_to_data(image, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    words = [
+        [word, float(conf)] for word, conf in zip(data["text"], data["conf"])
+        if word.strip() and float(conf) >= 0
+    ]
+    confidences = [conf for _, conf in words]
+    return {
+        "text": _lines_from_data(data),
+        "words": words,
+        "mean_confidence": round(sum(confidences) / len(confidences), 1) if confidences else None,
+    }
+
+
+def ocr_image_data(image, lang: str = OCR_LANG, config: str = OCR_CONFIG, use_cache: bool = True) -> dict:
+    """
+    Текст и пословные уверенности Tesseract для изображения PIL:
+    {"text", "words": [[слово, уверенность], ...], "mean_confidence", "cached"}.
+    Повторная страница берётся из кэша без запуска Tesseract.
+    """
+    key = image_key(image, lang, config)
+    cache = get_ocr_cache()
+    result = cache.get(key) if use_cache else None
+    if result is not None:
+        return {**result, "cached": True}
+    result = _recognize(image, lang, config)
+    cache.set(key, result)
+    return {**result, "cached": False}
+
+
+def _count(cached: bool):
+    _counters["hits" if cached else "misses"] += 1
+
+
+def ocr_image(image, lang: str = OCR_LANG, config: str = OCR_CONFIG) -> str:
+    """
+    Распознаёт текст на изображении PIL (с кэшем по содержимому страницы).
+    """
+    result = ocr_image_data(image, lang, config)
+    _count(result["cached"])
+    return result["text"]
+
+
+def ocr_cache_stats() -> dict:
+    """
+    Доля страниц, обслуженных из кэша, и размер кэша на диске.
+    """
+    lookups = _counters["hits"] + _counters["misses"]
+    disk = get_ocr_cache().stats()
+    return {
+        "hits": _counters["hits"],
+        "misses": _counters["misses"],
+        "hit_rate": round(_counters["hits"] / lookups, 3) if lookups else 0.0,
+        "disk_entries": disk["disk_entries"],
+        "disk_bytes": disk["disk_bytes"],
+        "evictions": disk["evictions"],
+    }
+
+
+def _usable_text(text: str) -> bool:
+    return sum(ch.isalnum() for ch in text or "") >= MIN_TEXT_LAYER_CHARS
+
+
+def _ocr_pdf_page(pdf_path: str, page_number: int, dpi: int, lang: str, config: str) -> dict:
+    """
+    Растеризует одну страницу PDF и распознаёт её (выполняется в процессе пула).
+    """
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    if not images:
+        return {"text": "", "words": [], "mean_confidence": None, "cached": False}
+    return ocr_image_data(images[0], lang, config)
+
+
+def ocr_pdf(pdf_bytes: bytes, lang: str = OCR_LANG, dpi: int = OCR_DPI, config: str = OCR_CONFIG) -> list:
+    """
+    Текст всех страниц PDF в исходном порядке: [{"page", "text", "source", ...}].
+
+    Страницы с пригодным текстовым слоем берутся из PyPDF2 без OCR; остальные
+    растеризуются по одной и распознаются параллельно в пуле процессов.
+    Уже распознанные страницы того же PDF берутся из кэша без растеризации,
+    страницы других файлов — по хэшу изображения.
+    """
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    pages = []
+    for number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        usable = _usable_text(text)
+        pages.append({"page": number, "text": text if usable else "", "source": "text_layer" if usable else "ocr"})
+
+    # Быстрый путь: тот же PDF уже распознавался с теми же параметрами
+    cache = get_ocr_cache()
+    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+    page_keys = {p["page"]: make_key("pdf", pdf_hash, p["page"], dpi, lang, config) for p in pages}
+    for page in pages:
+        if page["source"] == "ocr":
+            cached = cache.get(page_keys[page["page"]])
+            if cached is not None:
+                page.update(cached, source="ocr_cache")
+                _count(True)
+
+    scanned = [p["page"] for p in pages if p["source"] == "ocr"]
+    if not scanned:
+        return pages
+
+    logger.info("OCR страниц PDF: %s из %s", len(scanned), len(pages))
+    # pdftoppm читает файл с диска, поэтому передаём в процессы путь, а не байты
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(pdf_bytes)
+    try:
+        if len(scanned) == 1 or OCR_MAX_WORKERS == 1:
+            results = [_ocr_pdf_page(tmp.name, number, dpi, lang, config) for number in scanned]
+        else:
+            pool = get_ocr_pool()
+            n = len(scanned)
+            results = list(pool.map(_ocr_pdf_page, [tmp.name] * n, scanned, [dpi] * n, [lang] * n, [config] * n))
+    finally:
+        os.remove(tmp.name)
+
+    for number, result in zip(scanned, results):
+        cached = result.pop("cached")
+        _count(cached)
+        cache.set(page_keys[number], result)
+        pages[number - 1].update(result, source="ocr_cache" if cached else "ocr")
+    return pages
+
+
+def pdf_text(pdf_bytes: bytes, lang: str = OCR_LANG, config: str = OCR_CONFIG) -> str:
+    """
+    Полный текст PDF (текстовый слой + OCR сканированных страниц).
+    """
+    return "\n".join(p["text"] for p in ocr_pdf(pdf_bytes, lang, config=config))
@@ -1,16 +1,14 @@
-import pytesseract
 import pandas as pd
 from PIL import Image
-from pdf2image import convert_from_bytes
-import io
+from modules.ocr_engine import ocr_image, pdf_text
 
 def ocr_and_parse_lab(uploaded_file):
     if uploaded_file.name.endswith('.pdf'):
-        pages = convert_from_bytes(uploaded_file.read())
-        img = pages[0]  # берём первую страницу
+        # все страницы, сканы распознаются параллельно
+        text = pdf_text(uploaded_file.read(), lang='rus+eng')
     else:
         img = Image.open(uploaded_file)
-    text = pytesseract.image_to_string(img, lang='rus+eng')
+        text = ocr_image(img, lang='rus+eng')
     rows = []
     for line in text.strip().split('\n'):
         if ',' in line:
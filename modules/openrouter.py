@@ -0,0 +1,368 @@
+import json
+import time
+import logging
+import httpx
+
+from modules.config import OPENROUTER_API_KEY, OPENROUTER_URL, MODEL_NAME
+from modules.http_client import get_client, get_async_client
+from modules.cache import get_response_cache, make_key, normalize_prompt
+from modules.context_builder import estimate_tokens
+from modules.metrics import span
+from modules.prompts import system_message, message_text, cached_tokens
+from modules.scheduler import get_scheduler, RetryableError, RETRYABLE_STATUS, RETRYABLE_ERRORS, parse_retry_after, INTERACTIVE, BATCH
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_ERROR = "Timeout: запрос занял слишком много времени"
+
+
+def _prepare_request(prompt: str, system_prompt, max_tokens: int, temperature: float, file_hash: str):
+    """
+    Заголовки, тело запроса chat completions и ключ кэша ответа.
+    system_prompt (строка или modules.prompts.PromptTemplate) идёт первым и неизменным:
+    это префикс, который провайдер кэширует между запросами.
+    """
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "HTTP-Referer": "https://medassistant-cld.local",
+        "X-Title": "MedAssistant",
+        "Content-Type": "application/json"
+    }
+
+    messages = []
+    if system_prompt:
+        messages.append(system_message(system_prompt, MODEL_NAME))
+
+    messages.append({"role": "user", "content": prompt})
+
+    payload = {
+        "model": MODEL_NAME,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": 1.0,
+        # Подробный usage: prompt_tokens_details.cached_tokens
+        "usage": {"include": True}
+    }
+
+    cache_key = make_key(
+        file_hash, normalize_prompt(str(system_prompt) if system_prompt else None), normalize_prompt(prompt),
+        MODEL_NAME, {"temperature": temperature, "max_tokens": max_tokens, "top_p": 1.0}
+    )
+    return headers, payload, cache_key
+
+
+def _missing_key_result() -> dict:
+    return {
+        "success": False,
+        "content": None,
+        "error": "OPENROUTER_API_KEY не установлен в .env или Streamlit secrets"
+    }
+
+
+def _cached_result(cache_key: str, on_token=None):
+    cached = get_response_cache().get(cache_key)
+    if cached is None:
+        return None
+    logger.info("Ответ взят из кэша")
+    if on_token is not None:
+        on_token(cached["content"])
+    return {
+        "success": True,
+        "content": cached["content"],
+        "error": None,
+        "usage": cached.get("usage", {}),
+        "cached": True
+    }
+
+
+def _success_result(cache_key: str, content: str, usage: dict, timing: dict) -> dict:
+    logger.info(
+        "Успешный ответ от OpenRouter: TTFT %s с, %s ток/с, всего %s с, из кэша провайдера %s ток. промпта",
+        timing['ttft_s'], timing['tokens_per_second'], timing['latency_s'], cached_tokens(usage)
+    )
+    get_response_cache().set(cache_key, {"content": content, "usage": usage})
+    return {
+        "success": True,
+        "content": content,
+        "error": None,
+        "usage": usage,
+        "timing": timing,
+        "cached": False
+    }
+
+
+def _completion_content(data: dict) -> str:
+    return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+
+def _encode(payload: dict) -> bytes:
+    """
+    Тело запроса сериализуется один раз: повторы планировщика отправляют те же байты.
+    """
+    with span("llm.serialize") as s:
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        s.set(request_bytes=len(body))
+    return body
+
+
+def _record_usage(s, result: dict):
+    # Атрибуты спана llm.request: токены, попадание в кэш, неуспех
+    usage = result.get("usage") or {}
+    s.set(
+        cache_hit=bool(result.get("cached")),
+        failed=not result.get("success"),
+        prompt_tokens=usage.get("prompt_tokens") or 0,
+        cached_tokens=cached_tokens(usage),
+        completion_tokens=usage.get("completion_tokens") or 0,
+    )
+
+
+def _request_tokens(payload: dict) -> int:
+    """
+    Оценка расхода TPM до ответа: промпт + максимум генерации.
+    """
+    prompt = "".join(message_text(m) for m in payload["messages"])
+    return estimate_tokens(prompt) + payload.get("max_tokens", 0)
+
+
+def _check_status(response):
+    """
+    Для 429/5xx бросает RetryableError (планировщик повторит запрос), для 200 — ничего.
+    Возвращает текст ошибки для прочих статусов.
+    """
+    if response.status_code == 200:
+        return None
+    if response.status_code in RETRYABLE_STATUS:
+        raise RetryableError(response.status_code, response.text, parse_retry_after(response.headers.get("Retry-After")))
+    return _openrouter_error(response.status_code, response.text)
+
+
+def _exhausted_result(error: RetryableError) -> dict:
+    message = _openrouter_error(error.status_code, error.body)
+    return {"success": False, "content": None, "error": f"{message} (повторов: {get_scheduler().max_retries})"}
+
+
+def call_openrouter(prompt: str, system_prompt: str = None, max_tokens: int = 1400, temperature: float = 0.1,
+                    file_hash: str = None, use_cache: bool = True, on_token=None,
+                    priority: int = INTERACTIVE) -> dict:
+    """
+    Отправляет запрос к OpenRouter API с обработкой ошибок.
+
+    file_hash — хэш исходного файла, входит в ключ кэша ответов.
+    use_cache=False — принудительный запрос в обход кэша.
+    on_token — callback для потокового режима (SSE): вызывается с каждым фрагментом текста.
+    priority — полоса планировщика (modules.scheduler): 429/5xx повторяются с задержкой.
+    """
+    with span("llm.request") as s:
+        result = _call_openrouter(prompt, system_prompt, max_tokens, temperature, file_hash, use_cache,
+                                  on_token, priority)
+        _record_usage(s, result)
+    return result
+
+
+def _call_openrouter(prompt, system_prompt, max_tokens, temperature, file_hash, use_cache, on_token, priority):
+    if not OPENROUTER_API_KEY:
+        return _missing_key_result()
+
+    headers, payload, cache_key = _prepare_request(prompt, system_prompt, max_tokens, temperature, file_hash)
+    if use_cache:
+        cached = _cached_result(cache_key, on_token)
+        if cached is not None:
+            return cached
+
+    try:
+        logger.info("Отправка запроса к OpenRouter. Модель: %s, stream=%s", MODEL_NAME, on_token is not None)
+
+        client = get_client()
+        if on_token is not None:
+            payload["stream"] = True
+        body = _encode(payload)
+
+        def send():
+            # Одна попытка; повторяет её планировщик
+            started = time.perf_counter()
+            if on_token is None:
+                with span("llm.http"):
+                    response = client.post(OPENROUTER_URL, content=body, headers=headers)
+                error = _check_status(response)
+                if error:
+                    return {"success": False, "content": None, "error": error}, None
+
+                with span("llm.parse"):
+                    data = response.json()
+                content = _completion_content(data)
+                usage = data.get("usage", {})
+                # Без стриминга первый токен приходит вместе со всем ответом
+                first_token_at = None
+            else:
+                emitted = []
+
+                def emit(token):
+                    emitted.append(len(token))
+                    on_token(token)
+
+                try:
+                    with span("llm.http"), client.stream("POST", OPENROUTER_URL, content=body, headers=headers) as response:
+                        if response.status_code != 200:
+                            response.read()
+                            error = _check_status(response)
+                            return {"success": False, "content": None, "error": error}, None
+                        content, usage, first_token_at, stream_error = _read_sse_stream(response, emit)
+                except RETRYABLE_ERRORS as e:
+                    if not emitted:
+                        raise
+                    # Часть текста уже передана получателю: повтор с начала продублировал бы её
+                    logger.error("Поток OpenRouter оборван после %s фрагментов: %s", len(emitted), e)
+                    return {"success": False, "content": None, "error": f"Поток OpenRouter оборван: {e}"}, None
+                if stream_error:
+                    logger.error("Поток OpenRouter прерван: %s", stream_error)
+                    return {"success": False, "content": None, "error": stream_error}, usage
+
+            timing = _generation_timing(started, first_token_at, time.perf_counter(), usage, content)
+            return _success_result(cache_key, content, usage, timing), usage
+
+        return get_scheduler().run(send, priority=priority, tokens=_request_tokens(payload))
+
+    except RetryableError as e:
+        return _exhausted_result(e)
+
+    except httpx.TimeoutException:
+        logger.error("Timeout: запрос к OpenRouter занял слишком много времени")
+        return {"success": False, "content": None, "error": TIMEOUT_ERROR}
+
+    except Exception as e:
+        logger.error("Неожиданная ошибка: %s", e, exc_info=True)
+        return {"success": False, "content": None, "error": f"Неожиданная ошибка: {str(e)}"}
+
+
+async def acall_openrouter(prompt: str, system_prompt: str = None, max_tokens: int = 1400, temperature: float = 0.1,
+                           file_hash: str = None, use_cache: bool = True, priority: int = BATCH) -> dict:
+    """
+    Асинхронный вариант call_openrouter (без стриминга) для пакетной обработки.
+    """
+    with span("llm.request") as s:
+        result = await _acall_openrouter(prompt, system_prompt, max_tokens, temperature, file_hash, use_cache, priority)
+        _record_usage(s, result)
+    return result
+
+
+async def _acall_openrouter(prompt, system_prompt, max_tokens, temperature, file_hash, use_cache, priority):
+    if not OPENROUTER_API_KEY:
+        return _missing_key_result()
+
+    headers, payload, cache_key = _prepare_request(prompt, system_prompt, max_tokens, temperature, file_hash)
+    if use_cache:
+        cached = _cached_result(cache_key)
+        if cached is not None:
+            return cached
+
+    try:
+        logger.info("Отправка асинхронного запроса к OpenRouter. Модель: %s", MODEL_NAME)
+
+        client = get_async_client()
+        body = _encode(payload)
+
+        async def send():
+            started = time.perf_counter()
+            with span("llm.http"):
+                response = await client.post(OPENROUTER_URL, content=body, headers=headers)
+            error = _check_status(response)
+            if error:
+                return {"success": False, "content": None, "error": error}, None
+
+            with span("llm.parse"):
+                data = response.json()
+            content = _completion_content(data)
+            usage = data.get("usage", {})
+            timing = _generation_timing(started, None, time.perf_counter(), usage, content)
+            return _success_result(cache_key, content, usage, timing), usage
+
+        return await get_scheduler().arun(send, priority=priority, tokens=_request_tokens(payload))
+
+    except RetryableError as e:
+        return _exhausted_result(e)
+
+    except httpx.TimeoutException:
+        logger.error("Timeout: запрос к OpenRouter занял слишком много времени")
+        return {"success": False, "content": None, "error": TIMEOUT_ERROR}
+
+    except Exception as e:
+        logger.error("Неожиданная ошибка: %s", e, exc_info=True)
+        return {"success": False, "content": None, "error": f"Неожиданная ошибка: {str(e)}"}
+
+
+def _openrouter_error(status_code: int, body: str) -> str:
+    """
+    Текст ошибки для неуспешного HTTP статуса (общий для обычного и потокового режима).
+    """
+    # В журнал — постоянный шаблон и только начало тела ответа
+    if status_code == 401:
+        error_msg = "Ошибка аутентификации: неверный API ключ OpenRouter"
+        logger.error("Ошибка OpenRouter %s (аутентификация): %.500s", status_code, body)
+    elif status_code == 429:
+        error_msg = "Превышен лимит запросов (Rate Limit). Попробуйте позже."
+        logger.warning("Ошибка OpenRouter %s (лимит запросов): %.500s", status_code, body)
+    elif status_code == 500:
+        error_msg = "Ошибка на сервере OpenRouter (500). Попробуйте позже."
+        logger.error("Ошибка OpenRouter %s: %.500s", status_code, body)
+    else:
+        error_msg = f"HTTP {status_code}: {body}"
+        logger.error("Ошибка OpenRouter %s: %.500s", status_code, body)
+    return error_msg
+
+
+def _read_sse_stream(response, on_token):
+    """
+    Читает SSE поток chat completions, передавая каждый фрагмент текста в on_token.
+
+    Возвращает (content, usage, first_token_at, error).
+    """
+    parts = []
+    usage = {}
+    first_token_at = None
+
+    for line in response.iter_lines():
+        # Пустые строки разделяют события, строки с ":" — комментарии keep-alive
+        if not line or line.startswith(":") or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+
+        chunk = json.loads(data)
+        if chunk.get("error"):
+            error = chunk["error"]
+            message = error.get("message") if isinstance(error, dict) else error
+            return "".join(parts), usage, first_token_at, f"Ошибка в потоке OpenRouter: {message}"
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+
+        for choice in chunk.get("choices") or []:
+            token = (choice.get("delta") or {}).get("content")
+            if token:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(token)
+                on_token(token)
+
+    return "".join(parts), usage, first_token_at, None
+
+
+def _generation_timing(started: float, first_token_at: float, finished: float, usage: dict, content: str) -> dict:
+    """
+    Время до первого токена и скорость генерации.
+    Без стриминга (first_token_at=None) TTFT равно полному времени, а скорость
+    считается по всему запросу.
+    """
+    completion_tokens = usage.get("completion_tokens") or max(len(content) // 4, 1)
+    if first_token_at is None:
+        first_token_at = finished
+        generation_time = finished - started
+    else:
+        generation_time = finished - first_token_at
+    return {
+        "latency_s": round(finished - started, 3),
+        "ttft_s": round(first_token_at - started, 3),
+        "tokens_per_second": round(completion_tokens / generation_time, 1) if generation_time > 0 else None,
+    }
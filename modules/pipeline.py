@@ -0,0 +1,248 @@
+import io
+import os
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.intent_detection import detect_intent
+from modules.handlers import get_handler
+from modules.metrics import span, trace, timings
+from modules.cache import file_sha256, make_key
+from modules.context_builder import build_context, build_multi_context
+from modules.openrouter import call_openrouter, acall_openrouter
+from modules.prompts import REPORT_SYSTEM
+from modules.history import get_history, file_values, parse_date, today
+
+logger = logging.getLogger(__name__)
+
+# Потоки для одновременного разбора нескольких файлов одного запроса
+PARSE_MAX_WORKERS = int(os.getenv("PARSE_MAX_WORKERS", "4"))
+
+
+class LocalFile(io.BytesIO):
+    """
+    Файл в памяти с атрибутом name — замена Streamlit UploadedFile вне UI.
+    """
+
+    def __init__(self, name: str, data: bytes):
+        super().__init__(data)
+        self.name = name
+
+    @classmethod
+    def from_path(cls, path: str):
+        with open(path, "rb") as f:
+            return cls(path, f.read())
+
+
+def process_uploaded_file(uploaded_file, task_description: str) -> dict:
+    """
+    Обрабатывает загруженный файл в зависимости от типа.
+    """
+    
+    try:
+        logger.info("Обработка файла: %s", uploaded_file.name)
+        
+        with trace() as spans:
+            with span("detect_intent"):
+                intent = detect_intent(task_description, uploaded_file.name)
+            logger.info("Определен intent: %s", intent)
+            
+            with span("file_hash"):
+                file_hash = file_sha256(uploaded_file)
+            result = {
+                "intent": intent,
+                "analysis": None,
+                "raw_data": None,
+                "file_hash": file_hash,
+                "error": None
+            }
+            
+            # Зависимости модальности импортируются обработчиком при первом вызове
+            handler = get_handler(intent)
+            if handler is None:
+                result["error"] = f"Неизвестный тип файла: {intent}"
+            elif not handler.accepts(uploaded_file.name):
+                result["error"] = handler.format_error
+            else:
+                result["analysis"], result["raw_data"] = handler(uploaded_file, task_description)
+        
+        # Длительность этапов разбора этого файла, мс
+        result["timings"] = timings(spans)
+        return result
+    
+    except Exception as e:
+        error_msg = f"Ошибка при обработке файла: {str(e)}"
+        logger.error("Ошибка при обработке файла %s: %s", uploaded_file.name, e, exc_info=True)
+        return {
+            "intent": None,
+            "analysis": None,
+            "raw_data": None,
+            "error": error_msg
+        }
+
+
+def process_uploaded_files(uploaded_files: list, task_description: str) -> list:
+    """
+    Разбирает несколько файлов одновременно (в пуле потоков); порядок результатов
+    совпадает с порядком файлов. Общее время близко к самому долгому разбору.
+    """
+    if len(uploaded_files) == 1:
+        return [process_uploaded_file(uploaded_files[0], task_description)]
+    # Потоки пула не наследуют контекст (ID корреляции журнала): передаём копию в каждый файл
+    contexts = [contextvars.copy_context() for _ in uploaded_files]
+    with ThreadPoolExecutor(max_workers=min(PARSE_MAX_WORKERS, len(uploaded_files))) as pool:
+        return list(pool.map(
+            lambda context, f: context.run(process_uploaded_file, f, task_description),
+            contexts, uploaded_files
+        ))
+
+
+def merge_file_results(uploaded_files: list, file_results: list) -> dict:
+    """
+    Объединяет результаты разбора нескольких файлов в один analysis_data для одного отчета.
+    Файлы с ошибкой разбора в отчет не попадают.
+    """
+    files = [
+        {"name": f.name, "intent": r["intent"], "analysis": r["analysis"], "raw_data": r["raw_data"], "file_hash": r.get("file_hash")}
+        for f, r in zip(uploaded_files, file_results) if not r["error"]
+    ]
+    if len(files) == 1:
+        return next(r for r in file_results if not r["error"])
+    errors = [f"{f.name}: {r['error']}" for f, r in zip(uploaded_files, file_results) if r["error"]]
+    return {
+        "intent": "multi",
+        "analysis": "; ".join(f"{f['name']}: {f['analysis']}" for f in files),
+        "raw_data": None,
+        "files": files,
+        # Ключ кэша отчета — по набору файлов, а не по одному
+        "file_hash": make_key(*sorted(f["file_hash"] or "" for f in files)),
+        "error": "; ".join(errors) if not files else None,
+    }
+
+
+def build_report_prompt(task_description: str, analysis_data: dict):
+    """
+    Системный и пользовательский промпт для генерации отчета и отчет о токенах контекста.
+    Все инструкции — в системном шаблоне REPORT_SYSTEM (общий кэшируемый префикс),
+    в пользовательском сообщении только данные запроса.
+    Данные сворачиваются modules.context_builder в пределах CONTEXT_TOKEN_BUDGET.
+    """
+    
+    prompt = f"""Задача: {task_description}
+Тип анализа: {analysis_data.get('intent', 'неизвестно')}
+Предварительный анализ: {analysis_data.get('analysis', 'нет')}"""
+    
+    context_report = None
+    if analysis_data.get('files'):
+        data_text, context_report = build_multi_context(analysis_data['files'])
+        prompt += f"\n\nДанные одного пациента (файлов: {len(analysis_data['files'])}), оцени их совместно:\n{data_text}"
+    elif analysis_data.get('raw_data'):
+        data_text, context_report = build_context(analysis_data.get('intent'), analysis_data['raw_data'])
+        prompt += f"\n\nДанные:\n{data_text}"
+    if analysis_data.get('history'):
+        # Прошлые исследования — уже нормализованные значения из modules.history, не файлы
+        history_text = "\n".join(analysis_data['history'])
+        prompt += f"\n\nДинамика по прошлым исследованиям пациента (дата значение):\n{history_text}"
+    
+    return REPORT_SYSTEM, prompt, context_report
+
+
+def generate_medical_report(task_description: str, analysis_data: dict, use_cache: bool = True,
+                            on_token=None) -> dict:
+    """
+    Генерирует медицинский отчет через OpenRouter API.
+    Повторные запросы с тем же файлом и задачей обслуживаются из кэша.
+    Если передан on_token, отчет генерируется в потоковом режиме.
+    """
+    
+    with trace() as spans:
+        with span("report.context") as s:
+            system_prompt, prompt, context_report = build_report_prompt(task_description, analysis_data)
+            s.set(context_tokens=context_report["used"] if context_report else 0)
+        
+        logger.info("Формирование запроса для генерации отчета")
+        
+        result = call_openrouter(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            max_tokens=1400,
+            temperature=0.1,
+            file_hash=analysis_data.get('file_hash'),
+            use_cache=use_cache,
+            on_token=on_token
+        )
+    result["context"] = context_report
+    result["prompt_version"] = system_prompt.id
+    result["timings"] = timings(spans)
+    
+    return result
+
+
+def update_patient_history(patient_id: str, taken_on: str, names: list, file_results: list) -> list:
+    """
+    Динамика показателей пациента по прошлым исследованиям (строки для отчета),
+    затем запись текущих файлов в историю. Уже сохранённые файлы не дублируются.
+    """
+    history = get_history()
+    taken_on = parse_date(taken_on) if taken_on else today()
+    current = {}
+    for file_result in file_results:
+        current.update(file_values(file_result))
+    file_hashes = [r["file_hash"] for r in file_results if r.get("file_hash")]
+    with span("history") as s:
+        lines = history.trend_summary(patient_id, current, until=taken_on, exclude_files=file_hashes)
+        added = sum(history.add_file_result(patient_id, taken_on, name, r) for name, r in zip(names, file_results))
+        s.set(lines=len(lines), added=added)
+    return lines
+
+
+def run_analysis_job(job, task_description: str, uploaded_files: list, use_cache: bool = True,
+                     stream: bool = True, patient_id: str = None, taken_on: str = None) -> dict:
+    """
+    Анализ файлов как фоновая задача modules.jobs: параллельный разбор всех файлов,
+    затем один отчет по объединённому контексту.
+    Если указан patient_id, результаты сохраняются в историю пациента, а в отчет
+    добавляется динамика по прошлым исследованиям.
+    Текст отчета по мере генерации передаётся в job.append_text.
+    """
+    job.set_progress(f"Обработка файлов: {len(uploaded_files)}")
+    file_results = process_uploaded_files(uploaded_files, task_description)
+    history = None
+    if patient_id:
+        history = update_patient_history(patient_id, taken_on, [f.name for f in uploaded_files], file_results)
+    analysis_data = merge_file_results(uploaded_files, file_results)
+    if analysis_data["error"]:
+        return {"file_results": file_results, "report": None, "history": history}
+    if history:
+        analysis_data = {**analysis_data, "history": history}
+    
+    job.set_progress("Генерация отчета")
+    report = generate_medical_report(
+        task_description, analysis_data, use_cache=use_cache,
+        on_token=job.append_text if stream else None
+    )
+    return {"file_results": file_results, "report": report, "history": history}
+
+
+async def agenerate_medical_report(task_description: str, analysis_data: dict, use_cache: bool = True) -> dict:
+    """
+    Асинхронная генерация отчета (для пакетной обработки).
+    """
+    
+    with trace() as spans:
+        with span("report.context") as s:
+            system_prompt, prompt, context_report = build_report_prompt(task_description, analysis_data)
+            s.set(context_tokens=context_report["used"] if context_report else 0)
+        
+        result = await acall_openrouter(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            max_tokens=1400,
+            temperature=0.1,
+            file_hash=analysis_data.get('file_hash'),
+            use_cache=use_cache
+        )
+    result["context"] = context_report
+    result["prompt_version"] = system_prompt.id
+    result["timings"] = timings(spans)
+    return result
@@ -0,0 +1,123 @@
+"""
+Шаблоны промптов с версией и отпечатком и сборка сообщений со статическим префиксом.
+
+Провайдеры кэшируют совпадающее начало запроса: OpenAI, DeepSeek, Grok — автоматически,
+Anthropic и Gemini — по явной метке cache_control на последнем блоке префикса.
+Поэтому неизменные части (системный промпт, инструкции) всегда идут первыми и
+одинаковы байт в байт, а данные запроса — после них.
+
+Правка текста шаблона должна сопровождаться новой version: отпечаток (sha256 текста)
+попадает в журнал и в результат, по нему видно, каким промптом получен отчет.
+"""
+import os
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# auto — метки cache_control только для моделей, которым они нужны; on / off — всегда / никогда
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "auto").lower()
+# Модели OpenRouter, кэширующие префикс только по явной метке
+CACHE_CONTROL_PREFIXES = ("anthropic/", "google/gemini")
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+class PromptTemplate:
+    """
+    Неизменяемый текст промпта; id — «имя@версия:отпечаток».
+    """
+
+    def __init__(self, name: str, version: int, text: str):
+        self.name = name
+        self.version = version
+        self.text = text
+        self.fingerprint = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@{self.version}:{self.fingerprint}"
+
+    def __str__(self):
+        return self.text
+
+
+# name → PromptTemplate
+PROMPTS = {}
+
+
+def register(name: str, version: int, text: str) -> PromptTemplate:
+    template = PROMPTS[name] = PromptTemplate(name, version, text)
+    return template
+
+
+def prompt_versions() -> dict:
+    return {name: template.id for name, template in PROMPTS.items()}
+
+
+REPORT_SYSTEM = register("report_system", 2, """Ты — опытный врач-диагност и кардиолог с глубокими знаниями стандартов диагностики.
+Твоя задача — провести качественный анализ медицинских данных, опираясь на современные стандарты медицины.
+В ответе:
+1. Описание находок
+2. Предварительные выводы
+3. Рекомендации по стандартам (ГОСТ, МКБ-10, ESC, ACC/AHA)
+4. Необходимые дополнительные исследования
+5. Рекомендации по лечению и наблюдению
+Формат: структурированный отчет с понятными заголовками.
+
+На основе медицинских данных из сообщения пользователя подготовь детальный диагностический отчет.
+Проведи полный анализ с учетом клинических стандартов и рекомендаций.""")
+
+IMAGE_INSTRUCTIONS = register("image_instructions", 2, """Проанализируй медицинское изображение (рентген, УЗИ, КТ, МРТ).
+
+Предоставь:
+1. Описание видимых структур и патологических изменений
+2. Предварительные выводы и диагностические возможности
+3. Рекомендации по дополнительным исследованиям
+4. Ссылки на медицинские стандарты (если применимо)
+
+Формат: структурированный отчёт.""")
+
+
+def supports_cache_control(model: str) -> bool:
+    if PROMPT_CACHE == "on":
+        return True
+    if PROMPT_CACHE == "off":
+        return False
+    return model.startswith(CACHE_CONTROL_PREFIXES)
+
+
+def text_part(text: str, cache: bool = False) -> dict:
+    part = {"type": "text", "text": text}
+    if cache:
+        # Граница кэшируемого префикса: всё до этого блока включительно
+        part["cache_control"] = CACHE_CONTROL
+    return part
+
+
+def system_message(template, model: str) -> dict:
+    """
+    Системное сообщение; для моделей с явным кэшированием — блоком с меткой cache_control.
+    """
+    text = str(template)
+    if supports_cache_control(model):
+        return {"role": "system", "content": [text_part(text, cache=True)]}
+    return {"role": "system", "content": text}
+
+
+def message_text(message: dict) -> str:
+    """
+    Текст сообщения для оценки токенов (строка или текстовые блоки).
+    """
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def cached_tokens(usage: dict) -> int:
+    """
+    Токены промпта, прочитанные из кэша провайдера (usage.prompt_tokens_details.cached_tokens).
+    """
+    details = (usage or {}).get("prompt_tokens_details") or {}
+    return details.get("cached_tokens") or 0
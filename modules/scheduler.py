@@ -0,0 +1,333 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Лимиты провайдера и политика повторов
+LLM_RPM = float(os.getenv("LLM_RPM", "60"))
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+
+# Приоритетные полосы: меньше — раньше
+INTERACTIVE = 0
+BATCH = 1
+LANES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Ошибки соединения безопасно повторять: запрос до модели не дошёл или ответ оборван до начала генерации
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+# Сколько последних ожиданий хранить для перцентилей
+WAIT_SAMPLES = 1000
+
+
+class RetryableError(Exception):
+    """
+    Ответ провайдера, после которого запрос стоит повторить (429, 5xx).
+    """
+
+    def __init__(self, status_code: int, body: str = "", retry_after: float = None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.body = body
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value) -> float:
+    """
+    Заголовок Retry-After: секунды или HTTP-дата; None, если не задан или не разобран.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Ведро токенов: capacity единиц, пополняется rate_per_minute в минуту.
+    Допускает долг (отрицательный остаток) при уточнении фактического расхода.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class LLMScheduler:
+    """
+    Единая очередь запросов к LLM: лимиты RPM/TPM (token bucket), общий предел
+    одновременных запросов, приоритетные полосы и повторы с экспоненциальной
+    задержкой и джиттером (с учётом Retry-After). Работает и из потоков, и из asyncio.
+    """
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._waits = {lane: deque(maxlen=WAIT_SAMPLES) for lane in LANES}
+        self._counters = {"admitted": 0, "retries": 0, "rate_limited": 0, "server_errors": 0,
+                          "connection_errors": 0, "failed": 0}
+
+    # ---------- допуск ----------
+
+    def _admit(self, ticket, tokens: float) -> float:
+        """
+        Пытается выдать слот ticket (под блокировкой). Возвращает 0 при успехе,
+        иначе сколько секунд имеет смысл подождать.
+        """
+        now = time.monotonic()
+        if self._waiting[0] is not ticket:
+            return 0.05
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._in_flight >= self.max_concurrency:
+            return 0.05
+        delay = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if delay > 0:
+            return delay
+        heapq.heappop(self._waiting)
+        self.requests.consume(1)
+        self.tokens.consume(tokens)
+        self._in_flight += 1
+        self._counters["admitted"] += 1
+        return 0.0
+
+    def _enqueue(self, priority: int):
+        ticket = [priority, next(self._sequence)]
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _record_wait(self, priority: int, started: float):
+        self._waits[priority].append(time.monotonic() - started)
+        # Следующий в очереди мог стать первым
+        self._changed.notify_all()
+
+    def acquire(self, priority: int = INTERACTIVE, tokens: float = 0):
+        started = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            with self._changed:
+                while True:
+                    delay = self._admit(ticket, tokens)
+                    if delay == 0:
+                        self._record_wait(priority, started)
+                        return
+                    self._changed.wait(min(delay, 0.5))
+        except BaseException:
+            # Прерванное ожидание (StopException Streamlit, KeyboardInterrupt) не должно держать голову очереди
+            self._withdraw(ticket)
+            raise
+
+    async def aacquire(self, priority: int = BATCH, tokens: float = 0):
+        started = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._changed:
+                    delay = self._admit(ticket, tokens)
+                    if delay == 0:
+                        self._record_wait(priority, started)
+                        return
+                await asyncio.sleep(min(delay, 0.05))
+        except asyncio.CancelledError:
+            self._withdraw(ticket)
+            raise
+
+    def _withdraw(self, ticket):
+        """
+        Убирает билет, так и не получивший слот, и будит остальных ожидающих.
+        """
+        with self._changed:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._changed.notify_all()
+
+    def release(self, estimated_tokens: float = 0, used_tokens: float = None):
+        """
+        Освобождает слот; used_tokens уточняет расход TPM по фактическому usage.
+        """
+        with self._changed:
+            self._in_flight -= 1
+            if used_tokens is not None:
+                self.tokens.adjust(used_tokens - estimated_tokens)
+            self._changed.notify_all()
+
+    # ---------- повторы ----------
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max * 4)
+        # Full jitter: равномерно от 0 до base * 2^attempt
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _on_failure(self, attempt: int, error: Exception):
+        """
+        Учитывает ошибку и возвращает задержку перед повтором или None, если повторять не нужно.
+        """
+        with self._changed:
+            if isinstance(error, RetryableError):
+                if error.status_code == 429:
+                    self._counters["rate_limited"] += 1
+                else:
+                    self._counters["server_errors"] += 1
+            else:
+                self._counters["connection_errors"] += 1
+            if attempt >= self.max_retries:
+                self._counters["failed"] += 1
+                return None
+            self._counters["retries"] += 1
+            delay = self._retry_delay(attempt, error)
+            if isinstance(error, RetryableError) and error.status_code == 429:
+                # Лимит провайдера общий: притормаживаем всю очередь, а не только этот запрос
+                self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        logger.warning("Запрос к LLM не удался (%s), повтор %s/%s через %.1f с", error, attempt + 1, self.max_retries, delay)
+        return delay
+
+    def run(self, send, priority: int = INTERACTIVE, tokens: float = 0):
+        """
+        Выполняет send() через очередь с повторами. send возвращает (результат, usage) или
+        бросает RetryableError / ошибку соединения; после исчерпания повторов ошибка пробрасывается.
+        """
+        attempt = 0
+        while True:
+            self.acquire(priority, tokens)
+            used = None
+            try:
+                result, usage = send()
+                used = (usage or {}).get("total_tokens")
+                return result
+            except (RetryableError, *RETRYABLE_ERRORS) as e:
+                error = e
+            finally:
+                self.release(tokens, used)
+            delay = self._on_failure(attempt, error)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+            attempt += 1
+
+    async def arun(self, send, priority: int = BATCH, tokens: float = 0):
+        """
+        Асинхронный вариант run: send — корутинная функция.
+        """
+        attempt = 0
+        while True:
+            await self.aacquire(priority, tokens)
+            used = None
+            try:
+                result, usage = await send()
+                used = (usage or {}).get("total_tokens")
+                return result
+            except (RetryableError, *RETRYABLE_ERRORS) as e:
+                error = e
+            finally:
+                self.release(tokens, used)
+            delay = self._on_failure(attempt, error)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # ---------- метрики ----------
+
+    def stats(self) -> dict:
+        """
+        Глубина очереди по полосам, ожидание (p50/p95/max, мс), занятые слоты и счётчики повторов.
+        """
+        with self._lock:
+            now = time.monotonic()
+            depth = {name: 0 for name in LANES.values()}
+            for priority, _ in self._waiting:
+                depth[LANES.get(priority, str(priority))] += 1
+            waits = {LANES[p]: sorted(samples) for p, samples in self._waits.items()}
+            result = {
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": depth,
+                "blocked_for_s": round(max(self._blocked_until - now, 0.0), 2),
+                "rpm_available": round(self.requests.tokens, 1),
+                "tpm_available": round(self.tokens.tokens),
+                **self._counters,
+            }
+
+        def percentile(values, p):
+            return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 1) if values else None
+
+        result["wait_ms"] = {
+            lane: {"p50": percentile(v, 50), "p95": percentile(v, 95), "max": percentile(v, 100)}
+            for lane, v in waits.items()
+        }
+        return result
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """
+    Общий планировщик процесса (все сессии Streamlit и пакетная обработка).
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+            logger.info(
+                "Планировщик LLM: %g запр/мин, %g ток/мин, до %s одновременно",
+                LLM_RPM, LLM_TPM, LLM_MAX_CONCURRENCY
+            )
+        return _scheduler